@@ -1,8 +1,15 @@
 import random
 import math
 import time
+import numpy as np
 
-from common import run, neighborhood, Result
+from common import Result, Evaluator, get_store, load_history, NSTEPS, USAGE_FIELDS
+from space import SearchSpace
+
+
+# Statistics of the measurement of every solution saved in the history: confidence interval, samples, racing,
+# disturbed samples discarded and kept (flagged), and mean resource usage of the runs
+MEASUREMENT_COLUMNS = ["E_ci", "n_samples", "aborted", "n_interfered", "n_flagged", *USAGE_FIELDS]
 
 
 class Algorithm:
@@ -13,12 +20,17 @@ class Algorithm:
 	name = ""
 	full_name = ""
 
-	def __init__(self, n1, n2, n3, S0, k_max):
+	def __init__(self, n1, n2, n3, S0, k_max, evaluator=None):
 		self.n1 = n1
 		self.n2 = n2
 		self.n3 = n3
 		self.S0 = S0
 		self.k_max = k_max
+		if evaluator == None:
+			evaluator = Evaluator(n1, n2, n3)
+		self.evaluator = evaluator
+		self.space = SearchSpace(n1, n2, n3, topology=evaluator.topology)
+		self.seeds = []
 
 		self.params = {
 			"method": self.name,
@@ -27,24 +39,159 @@ class Algorithm:
 			"n3": self.n3,
 			"S0": self.S0,
 			"n_iter": self.k_max,
+			"topology": self.space.topology.describe(),
 		}
 
 	def print_params(self):
 		print(self.full_name)
 		print(self.params)
 
+	def start(self):
+		"""
+		Seeds the random number generators, with the seed of the checkpoint if there is one, so that
+		a resumed run replays the same trajectory
+		"""
+		self.time_start = time.time()
+		self.params["objective"] = self.evaluator.objective.describe()
+		if self.evaluator.objective.pareto:
+			self.params["pareto"] = True
+		checkpoint = self.evaluator.checkpoint
+		if checkpoint != None:
+			self.params["seed"] = checkpoint.seed
+			self.store = get_store()
+			self.store.update_trial(checkpoint.id, params=self.params, status="running")
+		if self.params.get("seed") != None:
+			random.seed(self.params["seed"])
+			self.space.seed(self.params["seed"])
+
+	def measure(self, S):
+		return self.evaluator.evaluate(S)
+
+	def objective_scale(self):
+		"""
+		Scale of the objective relative to throughput, from the measurement of S0 (see Objective.scale)
+		"""
+		measurement = self.evaluator.lookup(self.S0)
+		scale = self.evaluator.objective.scale(measurement.samples if measurement != None else [])
+		self.params["objective_scale"] = scale
+		return scale
+
 	def cost(self, S):
-		return run(S, self.n1, self.n2, self.n3)
+		return self.measure(S)
+
+	def cost_batch(self, S_list):
+		"""
+		Measures several configurations at once, concurrently if the evaluator has several slots
+		"""
+		return self.evaluator.evaluate_batch(S_list)
+
+	def confirm(self, S, E, S_best, E_best):
+		"""
+		Called when S seems to beat the incumbent best. With repeated measurements, both are
+		re-measured up to the sample limit so that the incumbent is not replaced by a lucky outlier.
+		"""
+		if not self.evaluator.adaptive:
+			return E, E_best
+		E, E_best = self.evaluator.refine([S, S_best])
+		return E, E_best
+
+	def random_walk(self, S, length):
+		"""
+		Samples a configuration by a random walk of the given length through the neighborhoods of the search space
+		"""
+		for _ in range(length):
+			S = random.choice(self.space.neighbors(S))
+		return S
+
+	def warm_start(self, seeds, pruned, trials=[]):
+		"""
+		Excludes the (name, value) pairs of pruned from the search space, and starts populations from the seed
+		configurations that remain feasible, drawn from the given prior trials
+		"""
+		for name, value in pruned:
+			self.space.exclude(name, value)
+		self.seeds = [S for S in seeds if self.space.contains(S) and S != self.S0]
+		self.params["warm_start"] = {"trials": trials, "seeds": seeds, "pruned": pruned}
+
+	def initial_population(self, size, walk):
+		"""
+		S0, the warm-start seeds, and random walks of up to walk steps from S0 to make up size configurations
+		"""
+		population = [self.S0] + self.seeds[:max(0, size - 1)]
+		return population + [self.random_walk(self.S0, random.randint(1, walk)) for _ in range(size - len(population))]
+
+	def reset_history(self):
+		self.S_list = []
+		self.E_list = []
+		self.columns = {name: [] for name in MEASUREMENT_COLUMNS}
+
+	def record(self, S, E, evaluator=None, **columns):
+		"""
+		Appends the current solution to the history, along with the statistics of its measurement
+		by the given evaluator (the algorithm's one by default) and any additional columns.
+		Rows of new evaluations are also appended to the results database, so that a running trial
+		can be inspected with the results command.
+		"""
+		if evaluator == None:
+			evaluator = self.evaluator
+		measurement = evaluator.lookup(S)
+		self.S_list.append(S)
+		self.E_list.append(E)
+		self.columns["E_ci"].append(measurement.ci if measurement != None else None)
+		self.columns["n_samples"].append(measurement.n if measurement != None else None)
+		self.columns["aborted"].append(measurement.aborted if measurement != None else False)
+		self.columns["n_interfered"].append(measurement.n_interfered if measurement != None else None)
+		usage = measurement.usage() if measurement != None else {}
+		for name in ["n_flagged", *USAGE_FIELDS]:
+			self.columns[name].append(usage.get(name))
+		for name in columns:
+			self.columns.setdefault(name, []).append(columns[name])
+
+		checkpoint = self.evaluator.checkpoint
+		if checkpoint != None and not checkpoint.replaying:
+			extra = {name: self.columns[name][-1] for name in MEASUREMENT_COLUMNS}
+			extra.update(columns)
+			with self.evaluator.tracer.span("persist"):
+				self.store.append_rows(checkpoint.id, [(len(self.S_list) - 1, S, E, extra)])
+			self.store.append_spans(checkpoint.id, self.evaluator.tracer.take())
 
 	def optimize(self):
 		raise NotImplementedError
 
 	def save(self):
 		res = Result()
+		checkpoint = self.evaluator.checkpoint
+		if checkpoint != None:
+			res.id = checkpoint.id
+			self.runtime += checkpoint.elapsed
 		print("Executed in", self.runtime, "s")
-		print("Best solution:", self.S_best, "with", self.E_best, "MPoints/s")
-		res.set_data(self.params, self.S_list, self.E_list, self.S_best, self.E_best, self.runtime)
-		res.save()
+		print("Best solution:", self.S_best, "with", self.E_best, self.evaluator.objective.unit)
+		cache_stats = None
+		if self.evaluator.cache != None:
+			cache_stats = self.evaluator.cache.stats()
+			print("Cache:", cache_stats["hits"], "hits,", cache_stats["misses"], "misses")
+		if self.evaluator.race_steps != None:
+			self.params["race_steps"] = self.evaluator.race_steps
+			self.params["race_margin"] = self.evaluator.race_margin
+			self.params["n_aborted"] = self.evaluator.n_aborted
+			print("Aborted", self.evaluator.n_aborted, "evaluations")
+		if self.evaluator.n_interfered > 0:
+			self.params["n_interfered"] = self.evaluator.n_interfered
+			print("Re-measured", self.evaluator.n_interfered, "disturbed samples")
+		if self.evaluator.coordinator != None:
+			self.params["workers"] = self.evaluator.coordinator.stats()
+			print("Workers:", self.params["workers"])
+		front = []
+		if self.evaluator.objective.pareto:
+			front = self.evaluator.pareto_front()
+			print("Pareto front:", len(front), "configurations")
+		res.set_data(self.params, self.S_list, self.E_list, self.S_best, self.E_best, self.runtime, cache_stats, self.columns,
+			front)
+		with self.evaluator.tracer.span("save"):
+			res.save()
+		res.store.append_spans(res.id, self.evaluator.tracer.take())
+		if checkpoint != None:
+			checkpoint.remove()
 
 
 class Greedy(Algorithm):
@@ -52,45 +199,45 @@ class Greedy(Algorithm):
 	name = "ghc"
 	full_name = "Greedy Hill Climbing"
 
-	def __init__(self, n1, n2, n3, S0, k_max):
-		super().__init__(n1, n2, n3, S0, k_max)
+	def __init__(self, n1, n2, n3, S0, k_max, evaluator=None):
+		super().__init__(n1, n2, n3, S0, k_max, evaluator)
 
 	def optimize(self):
 		time0 = time.time()
 		self.print_params()
+		self.start()
 
 		S_best = self.S0
 		E_best = self.cost(S_best)
-		L_neigh = neighborhood(S_best, self.n1, self.n2, self.n3)
+		L_neigh = self.space.neighbors(S_best)
 
-		S_list = [S_best]
-		E_list = [E_best]
+		self.reset_history()
+		self.record(S_best, E_best)
 
 		k = 0
 		NewBetterS = True
 		while(k < self.k_max and NewBetterS):
 			S = L_neigh.pop()
-			E = self.cost(S)
-			for S_prime in L_neigh:
-				E_prime = self.cost(S_prime)
+			E_neigh = self.cost_batch([S] + L_neigh)
+			E = E_neigh[0]
+			for S_prime, E_prime in zip(L_neigh, E_neigh[1:]):
 				if E_prime > E:
 					S = S_prime
 					E = E_prime
+			if E > E_best:
+				E, E_best = self.confirm(S, E, S_best, E_best)
 			if E > E_best:
 				S_best = S
 				E_best = E
-				L_neigh = neighborhood(S_best, self.n1, self.n2, self.n3)
+				L_neigh = self.space.neighbors(S_best)
 			else:
 				NewBetterS = False
 			k = k + 1
 			print('k: ', k)
-			S_list.append(S)
-			E_list.append(E)
+			self.record(S, E)
 		
 		self.S_best = S_best
 		self.E_best = E_best
-		self.S_list = S_list
-		self.E_list = E_list
 		self.runtime = time.time() - time0
 
 
@@ -99,11 +246,13 @@ class SimulatedAnnealing(Algorithm):
 	name = "sa"
 	full_name = "Simulated Annealing"
 
-	def __init__(self, n1, n2, n3, S0, k_max, T0, temp_decay):
-		super().__init__(n1, n2, n3, S0, k_max)
+	def __init__(self, n1, n2, n3, S0, k_max, T0, temp_decay, evaluator=None):
+		super().__init__(n1, n2, n3, S0, k_max, evaluator)
 
 		self.T0 = T0
 		self.params["T0"] = T0
+		# Temperatures are given in MPoints/s, and scaled to the objective once S0 is measured
+		self.scale = 1.0
 
 		self.params["temp_decay"] = temp_decay
 		if temp_decay == "linear":
@@ -115,24 +264,26 @@ class SimulatedAnnealing(Algorithm):
 
 	def decay_geometric(self, k):
 		a = 10**(math.log10(0.01)/self.k_max)
-		return (a**k)*self.T0
+		return (a**k)*self.T0*self.scale
 
 	def decay_linear(self, k):
-		return self.T0*(1 - k/self.k_max)
+		return self.T0*self.scale*(1 - k/self.k_max)
 
 	def optimize(self):
 		time0 = time.time()
 		self.print_params()
+		self.start()
 
 		S_best = self.S0
 		E_best = self.cost(self.S0)
 		S = self.S0
 		E = E_best
-		neighbors = neighborhood(self.S0, self.n1, self.n2, self.n3)
-		T = self.T0
+		neighbors = self.space.neighbors(self.S0)
+		self.scale = self.objective_scale()
+		T = self.T0*self.scale
 		
-		S_list = [S_best]
-		E_list = [E_best]
+		self.reset_history()
+		self.record(S_best, E_best)
 
 		for k in range(self.k_max):
 			S_new = random.choice(neighbors)
@@ -141,7 +292,9 @@ class SimulatedAnnealing(Algorithm):
 			if E_new > E or random.random() < math.exp(-(E-E_new)/T):
 				S = S_new
 				E = E_new
-				neighbors = neighborhood(S, self.n1, self.n2, self.n3)
+				neighbors = self.space.neighbors(S)
+				if E > E_best:
+					E, E_best = self.confirm(S, E, S_best, E_best)
 				if E > E_best:
 					S_best = S
 					E_best = E
@@ -150,13 +303,10 @@ class SimulatedAnnealing(Algorithm):
 				print(" REJECTED")
 			T = self.temp_decay(k)
 			
-			S_list.append(S)
-			E_list.append(E)
+			self.record(S, E)
 		
 		self.S_best = S_best
 		self.E_best = E_best
-		self.S_list = S_list
-		self.E_list = E_list
 		self.runtime = time.time() - time0
 
 
@@ -165,8 +315,8 @@ class TabuSA(SimulatedAnnealing):
 	name = "tabu_sa"
 	full_name = "Tabu Simulated Annealing"
 
-	def __init__(self, n1, n2, n3, S0, k_max, T0, temp_decay, tabu_size):
-		super().__init__(n1, n2, n3, S0, k_max, T0, temp_decay)
+	def __init__(self, n1, n2, n3, S0, k_max, T0, temp_decay, tabu_size, evaluator=None):
+		super().__init__(n1, n2, n3, S0, k_max, T0, temp_decay, evaluator)
 		
 		self.tabu_size = tabu_size
 		self.params["tabu_size"] = tabu_size
@@ -174,46 +324,48 @@ class TabuSA(SimulatedAnnealing):
 	def optimize(self):
 		time0 = time.time()
 		self.print_params()
+		self.start()
 
 		S_best = self.S0
 		E_best = self.cost(self.S0)
 		S = self.S0
 		E = E_best
-		neighbors = neighborhood(self.S0, self.n1, self.n2, self.n3)
-		T = self.T0
+		neighbors = self.space.neighbors(self.S0)
+		self.scale = self.objective_scale()
+		T = self.T0*self.scale
 
 		Ltabu = [S_best]
+		tabu_keys = {self.space.key(S_best)}
 
-		S_list = [S_best]
-		E_list = [E_best]
+		self.reset_history()
+		self.record(S_best, E_best)
 
 		for k in range(self.k_max):
-			S_new = random.choice(neighbors)
-			while S_new in Ltabu:
-				S_new = random.choice(neighbors)
+			allowed = [S_prime for S_prime in neighbors if self.space.key(S_prime) not in tabu_keys]
+			S_new = random.choice(allowed if len(allowed) > 0 else neighbors)
 			E_new = self.cost(S_new)
 			print(f"[{k}/{self.k_max}] {S_new} {E_new}", end='')
 			if E_new > E or random.random() < math.exp(-(E-E_new)/T):
 				S = S_new
 				E = E_new
-				neighbors = neighborhood(S, self.n1, self.n2, self.n3)
+				neighbors = self.space.neighbors(S)
+				if E > E_best:
+					E, E_best = self.confirm(S, E, S_best, E_best)
 				if E > E_best:
 					S_best = S
 					E_best = E
 				Ltabu = self.fifo_add(S_best, Ltabu)
+				tabu_keys = {self.space.key(S_tabu) for S_tabu in Ltabu}
 				print(" ACCEPTED")
 			else:
 				print(" REJECTED")
 			print(Ltabu)
 			T = self.temp_decay(k)
 
-			S_list.append(S)
-			E_list.append(E)
+			self.record(S, E)
 
 		self.S_best = S_best
 		self.E_best = E_best
-		self.S_list = S_list
-		self.E_list = E_list
 		self.runtime = time.time() - time0
 
 	def fifo_add(self, S_best, Ltabu):
@@ -228,46 +380,52 @@ class TunnelingSA(SimulatedAnnealing):
 	name = "tunnel_sa"
 	full_name = "Tunneling Simulated Annealing"
 
-	def __init__(self, n1, n2, n3, S0, k_max, T0, temp_decay, cost_fun, E_tunnel):
-		super().__init__(n1, n2, n3, S0, k_max, T0, temp_decay)
+	def __init__(self, n1, n2, n3, S0, k_max, T0, temp_decay, cost_fun, E_tunnel, evaluator=None):
+		super().__init__(n1, n2, n3, S0, k_max, T0, temp_decay, evaluator)
 		
 		self.params["cost_fun"] = cost_fun
 		if cost_fun == "average":
-			self.cost = self.cost_average
+			self.tunnel = self.tunnel_average
 		elif cost_fun == "stochastic":
-			self.cost = self.cost_stochastic
+			self.tunnel = self.tunnel_stochastic
 		else:
 			raise ValueError("Invalid cost_fun")
 
 		self.params["E_tunnel"] = E_tunnel
 		self.E_tunnel = E_tunnel
 
-	def cost_average(self, S):
-		E = run(S, self.n1, self.n2, self.n3)
-		if E < self.E_tunnel:
-			return (E + self.E_tunnel)/2, E
+	def cost(self, S):
+		E = self.measure(S)
+		return self.tunnel(E), E
+
+	def tunnel_average(self, E):
+		E_tunnel = self.E_tunnel*self.scale
+		if E < E_tunnel:
+			return (E + E_tunnel)/2
 		else:
-			return E, E
+			return E
 
-	def cost_stochastic(self, S):
-		gamma = 0.004
-		E = run(S, self.n1, self.n2, self.n3)
-		return math.exp(-gamma*(self.E_tunnel - E)) - 1, E
+	def tunnel_stochastic(self, E):
+		gamma = 0.004/self.scale
+		return math.exp(-gamma*(self.E_tunnel*self.scale - E)) - 1
 
 	def optimize(self):
 		time0 = time.time()
 		self.print_params()
+		self.start()
 
 		S_best = self.S0
-		E_best_tun, E_best = self.cost(self.S0)
+		E_best = self.measure(self.S0)
+		self.scale = self.objective_scale()
+		E_best_tun = self.tunnel(E_best)
 		S = self.S0
 		E_tun = E_best_tun
 		E = E_best
-		neighbors = neighborhood(self.S0, self.n1, self.n2, self.n3)
-		T = self.T0
+		neighbors = self.space.neighbors(self.S0)
+		T = self.T0*self.scale
 
-		S_list = [S_best]
-		E_list = [E_best]
+		self.reset_history()
+		self.record(S_best, E_best)
 
 		for k in range(self.k_max):
 			S_new = random.choice(neighbors)
@@ -277,7 +435,7 @@ class TunnelingSA(SimulatedAnnealing):
 				S = S_new
 				E_tun = E_new_tun
 				E = E_new
-				neighbors = neighborhood(S, self.n1, self.n2, self.n3)
+				neighbors = self.space.neighbors(S)
 				if E_tun > E_best_tun:
 					S_best = S
 					E_best_tun = E_tun
@@ -287,13 +445,10 @@ class TunnelingSA(SimulatedAnnealing):
 				print(" REJECTED")
 			T = self.temp_decay(k)
 			
-			S_list.append(S)
-			E_list.append(E)
+			self.record(S, E)
 
 		self.S_best = S_best
 		self.E_best = E_best
-		self.S_list = S_list
-		self.E_list = E_list
 		self.runtime = time.time() - time0
 
 
@@ -302,8 +457,8 @@ class LAHC(Algorithm):
 	name = "lahc"
 	full_name = "Late Acceptance Hill Climbing"
 
-	def __init__(self, n1, n2, n3, S0, k_max, Lh):
-		super().__init__(n1, n2, n3, S0, k_max)
+	def __init__(self, n1, n2, n3, S0, k_max, Lh, evaluator=None):
+		super().__init__(n1, n2, n3, S0, k_max, evaluator)
 
 		self.Lh = Lh
 		self.params["Lh"] = Lh
@@ -311,16 +466,17 @@ class LAHC(Algorithm):
 	def optimize(self):
 		time0 = time.time()
 		self.print_params()
+		self.start()
 
 		S_best = self.S0
 		E_best = self.cost(self.S0)
 		S = S_best
 		E = E_best
-		neighbors = neighborhood(S, self.n1, self.n2, self.n3)
+		neighbors = self.space.neighbors(S)
 		fitness = [E_best] * self.Lh # history of previous costs
 
-		S_list = [S_best]
-		E_list = [E_best]
+		self.reset_history()
+		self.record(S_best, E_best)
 
 		k_idle = 0
 		for k in range(self.k_max):
@@ -337,8 +493,10 @@ class LAHC(Algorithm):
 			if E_new > fitness[v] or E_new >= E:
 				S = S_new
 				E = E_new
-				neighbors = neighborhood(S, self.n1, self.n2, self.n3)
+				neighbors = self.space.neighbors(S)
 				print(" ACCEPTED")
+				if E >= E_best:
+					E, E_best = self.confirm(S, E, S_best, E_best)
 				if E >= E_best:
 					S_best = S
 					E_best = E
@@ -348,12 +506,527 @@ class LAHC(Algorithm):
 			if E > fitness[v]:
 				fitness[v] = E
 
-			S_list.append(S)
-			E_list.append(E)
+			self.record(S, E)
 		
 		self.S_best = S_best
 		self.E_best = E_best
-		self.S_list = S_list
-		self.E_list = E_list
 		self.runtime = time.time() - time0
 
+
+
+class Hyperband(Algorithm):
+
+	name = "hyperband"
+	full_name = "Hyperband"
+
+	def __init__(self, n1, n2, n3, S0, k_max, eta, min_fidelity, fidelity, walk, evaluator=None):
+		super().__init__(n1, n2, n3, S0, k_max, evaluator)
+
+		self.eta = eta
+		self.params["eta"] = eta
+		self.min_fidelity = min_fidelity
+		self.params["min_fidelity"] = min_fidelity
+		self.s_max = int(round(math.log(1/min_fidelity)/math.log(eta)))
+
+		self.params["fidelity"] = fidelity
+		if fidelity == "grid":
+			self.fidelity_size = self.size_grid
+		elif fidelity == "steps":
+			self.fidelity_size = self.size_steps
+		else:
+			raise ValueError("Invalid fidelity")
+
+		self.walk = walk
+		self.params["walk"] = walk
+
+	def size_grid(self, r):
+		"""
+		Low fidelity on a grid with fewer n3 planes, which keeps the n1 and n2 dimensions that the
+		blocking factors act upon
+		"""
+		return self.n1, self.n2, max(16, int(round(self.n3*r))), NSTEPS
+
+	def size_steps(self, r):
+		return self.n1, self.n2, self.n3, max(1, int(round(NSTEPS*r)))
+
+	def evaluator_at(self, r):
+		if r >= 1:
+			return self.evaluator
+		if r not in self.evaluators:
+			self.evaluators[r] = self.evaluator.derive(*self.fidelity_size(r))
+		return self.evaluators[r]
+
+	def optimize(self):
+		time0 = time.time()
+		self.print_params()
+		self.start()
+
+		self.evaluators = {}
+		S_best = self.S0
+		E_best = self.cost(self.S0)
+		self.reset_history()
+		self.record(S_best, E_best, fidelity=1.0, n3=self.n3, nsteps=NSTEPS, bracket=None)
+
+		# Budget counted in integer units of the lowest fidelity, a full-fidelity evaluation costing unit of them,
+		# so that it is spent exactly
+		unit = self.eta**self.s_max
+		budget = self.k_max*unit
+		k = unit
+		# Warm-start seeds enter the first brackets
+		seeds = list(self.seeds)
+		while k < budget:
+			k_pass = k
+			for s in range(self.s_max, -1, -1):
+				n = int(math.ceil((self.s_max + 1)/(s + 1)*self.eta**s))
+				configs = seeds[:n] + [self.random_walk(S_best, random.randint(1, self.walk)) for _ in range(n - len(seeds[:n]))]
+				seeds = seeds[n:]
+				for i in range(s + 1):
+					r = self.eta**(i - s)
+					cost = self.eta**(i - s + self.s_max)
+					configs = configs[:(budget - k)//cost]
+					if len(configs) == 0:
+						break
+					evaluator = self.evaluator_at(r)
+					E_configs = evaluator.evaluate_batch(configs)
+					k += cost*len(configs)
+					print(f"[{k/unit:.1f}/{self.k_max}] bracket {s}, fidelity {r:.3f}: {len(configs)} configurations, best {max(E_configs)}")
+
+					for S, E in zip(configs, E_configs):
+						if r >= 1 and E > E_best:
+							E, E_best = self.confirm(S, E, S_best, E_best)
+						if r >= 1 and E > E_best:
+							S_best = S
+							E_best = E
+						self.record(S, E, evaluator, fidelity=r, n3=evaluator.n3, nsteps=evaluator.nsteps, bracket=s)
+
+					order = sorted(range(len(configs)), key=lambda j: E_configs[j], reverse=True)
+					configs = [configs[j] for j in order[:max(1, len(configs)//self.eta)]]
+				if k >= budget:
+					break
+			if k == k_pass:
+				# The rest of the budget is too small for any bracket
+				break
+
+		self.S_best = S_best
+		self.E_best = E_best
+		self.runtime = time.time() - time0
+
+
+class BayesianOptimization(Algorithm):
+
+	name = "bo"
+	full_name = "Bayesian Optimization"
+
+	def __init__(self, n1, n2, n3, S0, k_max, n_init, use_history, evaluator=None):
+		super().__init__(n1, n2, n3, S0, k_max, evaluator)
+
+		self.n_init = n_init
+		self.params["n_init"] = n_init
+		self.use_history = use_history
+		self.params["use_history"] = use_history
+
+	def encode(self, S_list):
+		"""
+		Maps configurations to feature vectors with components in [0, 1]
+		"""
+		X = self.space.encode_batch(S_list)
+		return np.hstack([p.features(X[:, i]) for i, p in enumerate(self.space.params)])
+
+	def fit(self, X, y):
+		"""
+		Fits a Gaussian process with a squared exponential kernel, choosing its length scale and noise
+		level by maximum marginal likelihood
+		"""
+		self.X = X
+		self.y_mean = y.mean()
+		self.y_std = y.std() if y.std() > 0 else 1.0
+		y = (y - self.y_mean)/self.y_std
+		sq_dist = ((X[:, None, :] - X[None, :, :])**2).sum(axis=2)
+
+		best = None
+		for length in [0.1, 0.2, 0.5, 1.0, 2.0]:
+			for noise in [1e-3, 1e-2, 1e-1]:
+				K = np.exp(-0.5*sq_dist/length**2) + noise*np.eye(len(X))
+				L = np.linalg.cholesky(K)
+				alpha = np.linalg.solve(L.T, np.linalg.solve(L, y))
+				log_likelihood = -0.5*y @ alpha - np.log(np.diag(L)).sum()
+				if best == None or log_likelihood > best[0]:
+					best = (log_likelihood, length, L, alpha)
+		_, self.length, self.L, self.alpha = best
+
+	def predict(self, X):
+		sq_dist = ((X[:, None, :] - self.X[None, :, :])**2).sum(axis=2)
+		K_star = np.exp(-0.5*sq_dist/self.length**2)
+		mu = K_star @ self.alpha
+		v = np.linalg.solve(self.L, K_star.T)
+		sigma = np.sqrt(np.maximum(1 - (v**2).sum(axis=0), 1e-12))
+		return mu*self.y_std + self.y_mean, sigma*self.y_std
+
+	def expected_improvement(self, X, E_best):
+		mu, sigma = self.predict(X)
+		z = (mu - E_best)/sigma
+		cdf = 0.5*(1 + np.array([math.erf(value/math.sqrt(2)) for value in z]))
+		pdf = np.exp(-0.5*z**2)/math.sqrt(2*math.pi)
+		return (mu - E_best)*cdf + sigma*pdf
+
+	def candidates(self, data, measured):
+		"""
+		Unmeasured neighbors of the best known configurations, and random walks from the best one
+		"""
+		top = sorted(data, key=lambda pair: pair[1], reverse=True)[:5]
+		candidates = {}
+		for S, _ in top:
+			for S_neigh in self.space.neighbors(S):
+				candidates[self.space.key(S_neigh)] = S_neigh
+		for _ in range(50):
+			S = self.random_walk(top[0][0], random.randint(2, 10))
+			candidates[self.space.key(S)] = S
+		return [S for key, S in candidates.items() if key not in measured]
+
+	def history_trials(self):
+		"""
+		IDs of the finished trials whose measurements train the model. They are chosen when the trial starts and
+		saved in its parameters, like a warm start, so that a resumed run trains on the same data and replays
+		the same proposals.
+		"""
+		checkpoint = self.evaluator.checkpoint
+		if checkpoint != None and checkpoint.replaying:
+			trials = get_store().get_trial(checkpoint.id)["params"].get("history_trials")
+			if trials != None:
+				return trials
+		trials = get_store().find_trials(n=(self.n1, self.n2, self.n3), status="done", objective=self.evaluator.objective.describe())
+		return sorted(trial["id"] for trial in trials)
+
+	def optimize(self):
+		time0 = time.time()
+		self.print_params()
+		if self.use_history:
+			self.params["history_trials"] = self.history_trials()
+		self.start()
+
+		history = load_history(self.n1, self.n2, self.n3, self.evaluator.objective.describe(), self.params["history_trials"]) \
+			if self.use_history else []
+		history = [(S, E) for S, E in history if self.space.contains(S) and math.isfinite(E)]
+		print(f"Using {len(history)} configurations from previous trials")
+
+		self.reset_history()
+		measured = {}
+		S_init = self.initial_population(max(1, self.n_init - len(history)), 10)
+		E_init = self.cost_batch(S_init)
+		for S, E in zip(S_init, E_init):
+			measured[self.space.key(S)] = (S, E)
+			self.record(S, E, acquisition=None)
+		k = len(S_init)
+
+		while k < self.k_max:
+			# Runs without a finite objective value (timed out with an energy objective) are left out of the model
+			data = history + [(S, E) for S, E in measured.values() if math.isfinite(E)]
+			self.fit(self.encode([S for S, _ in data]), np.array([E for _, E in data]))
+			candidates = self.candidates(data, measured)
+			if len(candidates) == 0:
+				break
+			E_best = max(E for _, E in data)
+			EI = self.expected_improvement(self.encode(candidates), E_best)
+			order = np.argsort(-EI)[:min(self.evaluator.n_slots, self.k_max - k)]
+			S_batch = [candidates[i] for i in order]
+			E_batch = self.cost_batch(S_batch)
+			for S, E, i in zip(S_batch, E_batch, order):
+				print(f"[{k}/{self.k_max}] {S} {E} (EI {EI[i]:.2f})")
+				measured[self.space.key(S)] = (S, E)
+				self.record(S, E, acquisition=float(EI[i]))
+				k += 1
+
+		S_best, E_best = max(measured.values(), key=lambda pair: pair[1])
+		self.S_best = S_best
+		self.E_best = E_best
+		self.runtime = time.time() - time0
+
+
+class ParallelTempering(Algorithm):
+
+	name = "pt"
+	full_name = "Parallel Tempering"
+
+	def __init__(self, n1, n2, n3, S0, k_max, T0, n_replicas, evaluator=None):
+		super().__init__(n1, n2, n3, S0, k_max, evaluator)
+
+		self.T0 = T0
+		self.params["T0"] = T0
+		self.n_replicas = n_replicas
+		self.params["n_replicas"] = n_replicas
+		# Geometric temperature ladder from T0/100 to T0
+		self.temperatures = [T0*0.01**(1 - r/max(1, n_replicas - 1)) for r in range(n_replicas)]
+
+	def optimize(self):
+		time0 = time.time()
+		self.print_params()
+		self.start()
+
+		S_best = self.S0
+		E_best = self.cost(self.S0)
+		scale = self.objective_scale()
+		self.temperatures = [T*scale for T in self.temperatures]
+		S_rep = self.initial_population(self.n_replicas, 5)
+		E_rep = self.cost_batch(S_rep)
+
+		self.reset_history()
+		for r in range(self.n_replicas):
+			self.record(S_rep[r], E_rep[r], iteration=0, replica=r, T=self.temperatures[r])
+
+		for k in range(self.k_max):
+			# One Metropolis step per replica, proposals measured as a batch
+			S_new = [random.choice(self.space.neighbors(S)) for S in S_rep]
+			E_new = self.cost_batch(S_new)
+			for r, T in enumerate(self.temperatures):
+				if E_new[r] > E_rep[r] or random.random() < math.exp(-(E_rep[r] - E_new[r])/T):
+					S_rep[r] = S_new[r]
+					E_rep[r] = E_new[r]
+				if E_rep[r] > E_best:
+					E_rep[r], E_best = self.confirm(S_rep[r], E_rep[r], S_best, E_best)
+				if E_rep[r] > E_best:
+					S_best = S_rep[r]
+					E_best = E_rep[r]
+
+			# Replica exchange between adjacent temperatures
+			n_swaps = 0
+			for r in range(self.n_replicas - 1):
+				T_cold, T_hot = self.temperatures[r], self.temperatures[r + 1]
+				if random.random() < math.exp(min(0.0, (E_rep[r + 1] - E_rep[r])*(1/T_cold - 1/T_hot))):
+					S_rep[r], S_rep[r + 1] = S_rep[r + 1], S_rep[r]
+					E_rep[r], E_rep[r + 1] = E_rep[r + 1], E_rep[r]
+					n_swaps += 1
+			print(f"[{k}/{self.k_max}] {E_rep} ({n_swaps} swaps)")
+
+			for r in range(self.n_replicas):
+				self.record(S_rep[r], E_rep[r], iteration=k + 1, replica=r, T=self.temperatures[r])
+
+		self.S_best = S_best
+		self.E_best = E_best
+		self.runtime = time.time() - time0
+
+
+class GeneticAlgorithm(Algorithm):
+
+	name = "ga"
+	full_name = "Genetic Algorithm"
+
+	def __init__(self, n1, n2, n3, S0, k_max, pop_size, mutation_rate, evaluator=None):
+		super().__init__(n1, n2, n3, S0, k_max, evaluator)
+
+		self.pop_size = pop_size
+		self.params["pop_size"] = pop_size
+		self.mutation_rate = mutation_rate
+		self.params["mutation_rate"] = mutation_rate
+
+	def tournament(self, population, fitness, size=2):
+		i = max(random.sample(range(len(population)), size), key=lambda j: fitness[j])
+		return population[i]
+
+	def crossover(self, S_a, S_b):
+		"""
+		Uniform crossover: each parameter is taken from either parent
+		"""
+		return [random.choice(genes) for genes in zip(S_a, S_b)]
+
+	def mutate(self, S):
+		while random.random() < self.mutation_rate:
+			S = random.choice(self.space.neighbors(S))
+		return S
+
+	def optimize(self):
+		time0 = time.time()
+		self.print_params()
+		self.start()
+
+		population = self.initial_population(self.pop_size, 10)
+		fitness = self.cost_batch(population)
+		best = max(range(self.pop_size), key=lambda i: fitness[i])
+		S_best = population[best]
+		E_best = fitness[best]
+
+		self.reset_history()
+		for i in range(self.pop_size):
+			self.record(population[i], fitness[i], generation=0, individual=i)
+
+		for k in range(self.k_max):
+			# Elitism: the best individual survives unchanged
+			offspring = [self.mutate(self.crossover(self.tournament(population, fitness), self.tournament(population, fitness)))
+				for _ in range(self.pop_size - 1)]
+			E_offspring = self.cost_batch(offspring)
+			population = [S_best] + offspring
+			fitness = [E_best] + E_offspring
+
+			for S, E in zip(offspring, E_offspring):
+				if E > E_best:
+					E, E_best = self.confirm(S, E, S_best, E_best)
+				if E > E_best:
+					S_best = S
+					E_best = E
+			print(f"[{k}/{self.k_max}] best {E_best}, mean {sum(fitness)/len(fitness):.2f}")
+
+			for i in range(self.pop_size):
+				self.record(population[i], fitness[i], generation=k + 1, individual=i)
+
+		self.S_best = S_best
+		self.E_best = E_best
+		self.runtime = time.time() - time0
+
+
+class VariableNeighborhoodSearch(Algorithm):
+
+	name = "vns"
+	full_name = "Variable Neighborhood Search"
+
+	# Neighborhoods, from the most local to the most global
+	neighborhoods = ["step", "multiply", "aligned", "combined"]
+
+	def __init__(self, n1, n2, n3, S0, k_max, window, max_scale, evaluator=None):
+		super().__init__(n1, n2, n3, S0, k_max, evaluator)
+
+		self.window = window
+		self.params["window"] = window
+		self.max_scale = max_scale
+		self.params["max_scale"] = max_scale
+
+	def shake(self, S, kind, scale, n):
+		"""
+		Draws up to n distinct random neighbors of S in a neighborhood at a step scale
+		"""
+		x = self.space.encode(S)
+		if kind == "combined":
+			X = self.space.combined_moves_encoded(x, scale, n)
+		else:
+			X = self.space.moves_encoded(x, kind, scale)
+		neighbors = self.space.decode_batch(X)
+		return random.sample(neighbors, min(n, len(neighbors)))
+
+	def adapt(self, scale, successes):
+		"""
+		1/5 success rule: the step scale of a neighborhood grows when more than a fifth of its recent
+		moves improved, and shrinks when fewer did
+		"""
+		if len(successes) < self.window//2:
+			return scale
+		rate = sum(successes)/len(successes)
+		if rate > 0.2:
+			return min(self.max_scale, scale*1.5)
+		if rate < 0.2:
+			return max(1.0, scale/1.5)
+		return scale
+
+	def optimize(self):
+		"""
+		Reduced VNS: each iteration evaluates a batch of random neighbors of the current configuration in the
+		current neighborhood. An improvement is accepted and restarts from the first neighborhood, otherwise
+		the search moves on to the next one, wrapping around after the last.
+		"""
+		time0 = time.time()
+		self.print_params()
+		self.start()
+
+		S_best = self.S0
+		E_best = self.cost(S_best)
+		scales = [1.0]*len(self.neighborhoods)
+		successes = [[] for _ in self.neighborhoods]
+
+		self.reset_history()
+		self.record(S_best, E_best, neighborhood=None, scale=None, accepted=True)
+
+		k = 1
+		l = 0
+		n_empty = 0
+		while k < self.k_max:
+			kind = self.neighborhoods[l]
+			scale = int(round(scales[l]))
+			S_batch = self.shake(S_best, kind, scale, min(self.evaluator.n_slots, self.k_max - k))
+			if len(S_batch) == 0:
+				# No neighborhood of S_best has any neighbor left in the space
+				n_empty += 1
+				if n_empty == len(self.neighborhoods):
+					print(f"[{k}/{self.k_max}] {S_best} has no neighbors")
+					break
+				l = (l + 1) % len(self.neighborhoods)
+				continue
+			n_empty = 0
+			E_batch = self.cost_batch(S_batch)
+			k += len(S_batch)
+
+			i = max(range(len(S_batch)), key=lambda j: E_batch[j])
+			S, E = S_batch[i], E_batch[i]
+			if E > E_best:
+				E, E_best = self.confirm(S, E, S_best, E_best)
+			improved = E > E_best
+			print(f"[{k}/{self.k_max}] {kind} x{scale}: {S} {E}{' ACCEPTED' if improved else ''}")
+			for S_new, E_new in zip(S_batch, E_batch):
+				self.record(S_new, E_new, neighborhood=kind, scale=scale, accepted=improved and S_new is S)
+
+			successes[l] = (successes[l] + [improved])[-self.window:]
+			scales[l] = self.adapt(scales[l], successes[l])
+			if improved:
+				S_best = S
+				E_best = E
+				l = 0
+			else:
+				l = (l + 1) % len(self.neighborhoods)
+
+		self.params["scales"] = scales
+		self.S_best = S_best
+		self.E_best = E_best
+		self.runtime = time.time() - time0
+
+
+class Sweep(Algorithm):
+
+	name = "sweep"
+	full_name = "Landscape Sweep"
+
+	designs = ["grid", "strided", "lhs"]
+
+	def __init__(self, n1, n2, n3, S0, k_max, design, strides, evaluator=None):
+		super().__init__(n1, n2, n3, S0, k_max, evaluator)
+
+		self.design = design
+		self.params["design"] = design
+		self.strides = list(strides) if design == "strided" else None
+		self.params["strides"] = self.strides
+
+	def points(self):
+		"""
+		Configurations of the sweep, at most k_max of them: a Latin hypercube sample, or the full or strided
+		grid in random order, so that a sweep interrupted or capped by k_max still covers the whole space
+		"""
+		if self.design == "lhs":
+			X = self.space.lhs_encoded(self.k_max)
+		else:
+			X = self.space.grid_sample_encoded(self.strides, self.k_max)
+		return self.space.decode_batch(X)
+
+	def optimize(self):
+		"""
+		Measures every configuration of the sweep, as many at once as the evaluator has slots. The rows of the
+		history make up the landscape, see Result.landscape.
+		"""
+		time0 = time.time()
+		self.print_params()
+		self.start()
+
+		points = self.points()
+		print(f"Sweeping {len(points)} configurations ({self.design} design)")
+		S_best = None
+		E_best = -math.inf
+
+		self.reset_history()
+		batch = max(1, self.evaluator.n_slots)
+		for k in range(0, len(points), batch):
+			S_batch = points[k:k + batch]
+			E_batch = self.cost_batch(S_batch)
+			for i, (S, E) in enumerate(zip(S_batch, E_batch)):
+				if E > E_best:
+					S_best = S
+					E_best = E
+				self.record(S, E, point=k + i)
+			print(f"[{k + len(S_batch)}/{len(points)}] best {E_best}")
+
+		self.S_best = S_best
+		self.E_best = E_best
+		self.runtime = time.time() - time0
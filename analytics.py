@@ -0,0 +1,210 @@
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+
+from common import T_95
+from store import COLUMNS
+
+
+def t_95(dof):
+	"""
+	Two-sided 95% quantiles of the Student t distribution for an array of degrees of freedom (NaN below 1)
+	"""
+	dof = np.asarray(dof)
+	table = np.array(T_95)
+	t = np.where(dof <= len(table), table[np.clip(dof - 1, 0, len(table) - 1)], 1.96)
+	return np.where(dof >= 1, t, np.nan)
+
+def mean_ci(X):
+	"""
+	Mean, half-width of the 95% confidence interval and number of values of every column of X, ignoring NaN
+	"""
+	n = (~np.isnan(X)).sum(axis=0)
+	with np.errstate(invalid="ignore", divide="ignore"):
+		mean = np.nansum(X, axis=0)/n
+		std = np.sqrt(np.nansum((X - mean)**2, axis=0)/(n - 1))
+		ci = t_95(n - 1)*std/np.sqrt(n)
+	return mean, ci, n
+
+
+class TrialSet:
+	"""
+	Set of trials of the results database analyzed together, grouped by algorithm and optionally by
+	hyper-parameters (names of their parameters, e.g. T0 or pop_size).
+
+	Only the trials themselves are read up front. History columns are read when an aggregate needs them,
+	for all trials in one query and only once, and aggregates are computed on arrays of shape
+	(trials, evaluations) padded with NaN. Low-fidelity and aborted evaluations count as evaluations
+	but have no value.
+
+	Trials are compared to the best value reached by any trial of the set with the same problem size and
+	objective (the reference), through their gap to it: (reference - value)/|reference|, 0 for the best.
+	"""
+	def __init__(self, store, trials, group_by=[]):
+		self.store = store
+		self.trials = sorted(trials, key=lambda trial: trial["id"])
+		self.ids = np.array([trial["id"] for trial in self.trials])
+		self.group_by = group_by
+		self.loaded = {}
+		self.E = None
+
+	@staticmethod
+	def query(store, methods=None, n=None, objective=None, since=None, until=None, status="done", group_by=[], tag=None):
+		trials = store.find_trials(n=n, status=status, objective=objective, since=since, until=until, tag=tag)
+		if methods != None:
+			trials = [trial for trial in trials if trial["method"] in methods]
+		return TrialSet(store, trials, group_by)
+
+	def group(self, trial):
+		return " ".join([trial["method"]] + [f"{name}={trial['params'].get(name)}" for name in self.group_by])
+
+	def groups(self):
+		"""
+		Indices of the trials of every group
+		"""
+		groups = {}
+		for i, trial in enumerate(self.trials):
+			groups.setdefault(self.group(trial), []).append(i)
+		return groups
+
+	def columns(self, names):
+		"""
+		History columns of all trials, with their trial_id and iter, as a DataFrame
+		"""
+		key = tuple(names)
+		if key not in self.loaded:
+			header, rows = self.store.get_columns(self.ids, names)
+			self.loaded[key] = pd.DataFrame(rows, columns=header)
+		return self.loaded[key]
+
+	def curves(self):
+		"""
+		Objective values of the evaluations of every trial, in order, as a (trials, evaluations) array
+		"""
+		if self.E is None:
+			data = self.columns(["E", "full"])
+			t = np.searchsorted(self.ids, data["trial_id"].to_numpy())
+			# Position of every row in its trial, rows being ordered by trial
+			position = np.arange(len(t)) - np.searchsorted(t, t)
+			self.lengths = np.bincount(t, minlength=len(self.trials))
+			self.E = np.full((len(self.trials), self.lengths.max(initial=0)), np.nan)
+			values = data["E"].to_numpy(dtype=float, copy=True)
+			values[data["full"].to_numpy() != 1] = np.nan
+			self.E[t, position] = values
+		return self.E
+
+	def best_so_far(self):
+		E = self.curves()
+		with np.errstate(invalid="ignore"):
+			best = np.fmax.accumulate(E, axis=1)
+		best[np.arange(E.shape[1])[None, :] >= self.lengths[:, None]] = np.nan
+		return best
+
+	def references(self):
+		"""
+		Reference value of every trial: the best value of the trials of the set with its problem size and objective
+		"""
+		keys = [(trial["n1"], trial["n2"], trial["n3"], trial["params"].get("objective", "throughput")) for trial in self.trials]
+		best = {}
+		for key, value in zip(keys, self.final()):
+			best[key] = np.fmax(best.get(key, np.nan), value)
+		return np.array([best[key] for key in keys])
+
+	def final(self):
+		"""
+		Best value of every trial, NaN for trials without any
+		"""
+		final = np.fmax.reduce(self.curves(), axis=1, initial=-np.inf)
+		return np.where(np.isneginf(final), np.nan, final)
+
+	def gaps(self, X):
+		reference = self.references()[:, None]
+		return (reference - X)/np.abs(reference)
+
+	def evaluations_to(self, fraction):
+		"""
+		Number of evaluations every trial took to get within 1 - fraction of its reference (gap at most
+		1 - fraction, i.e. fraction of the reference throughput), NaN if it never did
+		"""
+		with np.errstate(invalid="ignore"):
+			reached = self.gaps(self.best_so_far()) <= 1 - fraction
+		if reached.shape[1] == 0:
+			return np.full(len(self.trials), np.nan)
+		return np.where(reached.any(axis=1), reached.argmax(axis=1) + 1.0, np.nan)
+
+	def convergence(self, indices, kind="best"):
+		"""
+		Mean curve of a group of trials with its 95% confidence interval and number of trials at every
+		evaluation: of the gaps of the values (kind "mean") or of the best values so far (kind "best")
+		"""
+		X = self.best_so_far() if kind == "best" else self.curves()
+		return mean_ci(self.gaps(X)[indices])
+
+	def summary(self, fraction=0.95):
+		"""
+		Table of the groups: number of trials, mean number of evaluations and runtime, mean final gap with
+		its confidence interval, fraction of trials within 1 - fraction of their reference and median number of
+		evaluations to get there
+		"""
+		final = self.gaps(self.final()[:, None])[:, 0]
+		to_target = self.evaluations_to(fraction)
+		rows = []
+		for group, indices in self.groups().items():
+			gap, ci, n = mean_ci(final[indices][:, None])
+			reached = to_target[indices][~np.isnan(to_target[indices])]
+			rows.append({
+				"group": group,
+				"n_trials": len(indices),
+				"evaluations": float(self.lengths[indices].mean()),
+				"runtime": float(np.mean([self.trials[i]["runtime"] or np.nan for i in indices])),
+				"final_gap": float(gap[0]),
+				"final_gap_ci": float(ci[0]),
+				"success_rate": len(reached)/len(indices),
+				f"median_evaluations_to_{fraction:g}": float(np.median(reached)) if len(reached) > 0 else None,
+			})
+		return pd.DataFrame(rows)
+
+	def sensitivity(self, min_count=5):
+		"""
+		Effect of every value of every configuration parameter: the mean percentile rank (1 for the best) of the
+		full-fidelity evaluations with that value within their trial, and how many there are. The sensitivity of
+		a parameter is the spread of the mean ranks of its values measured at least min_count times.
+		"""
+		data = self.columns([*COLUMNS, "E", "full"])
+		data = data[(data["full"] == 1) & data["E"].notna()].copy()
+		data["rank"] = data.groupby("trial_id")["E"].rank(pct=True)
+		values = []
+		spreads = []
+		for name in COLUMNS:
+			stats = data.groupby(name)["rank"].agg(["mean", "count"]).reset_index()
+			counted = stats[stats["count"] >= min_count]
+			spreads.append({"parameter": name, "sensitivity": float(counted["mean"].max() - counted["mean"].min())
+				if len(counted) > 1 else 0.0, "n_values": len(stats)})
+			values += [{"parameter": name, "value": row[name], "mean_rank": row["mean"], "count": int(row["count"])}
+				for _, row in stats.iterrows()]
+		return pd.DataFrame(spreads).sort_values("sensitivity", ascending=False), pd.DataFrame(values)
+
+	def plot(self, kind="best"):
+		"""
+		Plots the mean convergence curve of every group with its confidence band
+		"""
+		for group, indices in self.groups().items():
+			mean, ci, n = self.convergence(indices, kind)
+			x = np.arange(1, len(mean) + 1)
+			plt.plot(x, mean, label=f"{group} ({len(indices)})")
+			plt.fill_between(x, mean - np.nan_to_num(ci), mean + np.nan_to_num(ci), alpha=0.2)
+		plt.xlabel("Evaluation")
+		plt.ylabel("Gap to the reference" + (" (best so far)" if kind == "best" else ""))
+		plt.yscale("symlog", linthresh=1e-3)
+		plt.legend()
+		plt.grid(True)
+
+
+def export(table, fn):
+	"""
+	Saves a table as CSV, or as JSON records if fn ends with .json
+	"""
+	if fn.endswith(".json"):
+		table.to_json(fn, orient="records", indent=4)
+	else:
+		table.to_csv(fn, index=False)
@@ -0,0 +1,264 @@
+import io
+import json
+import time
+import contextlib
+import numpy as np
+
+from common import Evaluator, RunResult, load_history
+from space import SearchSpace
+from topology import Topology
+
+
+LANDSCAPES = ["smooth", "plateau", "cliff", "rugged", "replay"]
+
+# Landscapes are drawn on a fixed machine, so that benchmarks run on different nodes are comparable
+REFERENCE_TOPOLOGY = Topology.uniform(2, 16)
+
+
+class Landscape:
+	"""
+	Deterministic throughput function over the search space of a problem size, standing in for ISO3DFD runs.
+	values() maps an array of encoded configurations to their noise-free throughputs, and optimum is
+	the highest throughput of the landscape.
+	"""
+	def __init__(self, space):
+		self.space = space
+		self.optimum = None
+
+	def values(self, X):
+		raise NotImplementedError
+
+	def value(self, S):
+		return float(self.values(self.space.encode(S)[None, :])[0])
+
+	def features(self, X):
+		return np.hstack([p.features(X[:, i]) for i, p in enumerate(self.space.params)])
+
+
+class SyntheticLandscape(Landscape):
+	"""
+	Random landscape with a single planted optimum of 1000 MPoints/s: each categorical value scales the
+	throughput by a random gain, and the throughput decays with the weighted squared distance between
+	the features of the ordered parameters and those of the optimum.
+
+	With plateaus, ordered features are rounded down to that many levels, so that the throughput is flat
+	over whole blocks of values. With cliffs, that fraction of the space, made of contiguous patches of
+	4 values per ordered parameter, drops to 10 to 30% of its throughput. Everything is determined by seed.
+	"""
+	def __init__(self, space, seed=0, plateaus=0, cliffs=0.0):
+		super().__init__(space)
+		self.seed = seed
+		self.plateaus = plateaus
+		self.cliffs = cliffs
+		rng = np.random.default_rng(seed)
+		self.x_opt = np.array([rng.integers(p.size) for p in space.params])
+		self.gains = []
+		self.weights = []
+		for i, p in enumerate(space.params):
+			if p.categorical:
+				gains = rng.uniform(0.7, 1.0, p.size)
+				gains[self.x_opt[i]] = 1.0
+				self.gains.append(gains)
+			else:
+				self.weights.append(rng.uniform(0.5, 2.0))
+		self.ordered = [i for i, p in enumerate(space.params) if not p.categorical]
+		self.f_opt = self.ordered_features(self.x_opt[None, :])[0]
+		self.optimum = float(self.values(self.x_opt[None, :])[0])
+
+	def ordered_features(self, X):
+		F = np.hstack([self.space.params[i].features(X[:, i]) for i in self.ordered])
+		if self.plateaus > 0:
+			F = np.floor(F*self.plateaus)/self.plateaus
+		return F
+
+	def values(self, X):
+		E = np.full(len(X), 1000.0)
+		for i, gains in zip([i for i, p in enumerate(self.space.params) if p.categorical], self.gains):
+			E *= gains[X[:, i]]
+		d = ((self.ordered_features(X) - self.f_opt)**2 @ np.array(self.weights))
+		E *= np.exp(-d)
+		if self.cliffs > 0:
+			patches = X.copy()
+			patches[:, self.ordered] //= 4
+			h = hash_keys(self.space.keys(patches), self.seed)
+			cliff = (h < self.cliffs) & (self.space.keys(X) != self.space.keys(self.x_opt[None, :])[0])
+			E[cliff] *= 0.1 + 0.2*hash_keys(self.space.keys(X), self.seed + 1)[cliff]
+		return E
+
+
+def hash_keys(keys, seed):
+	"""
+	Deterministic pseudo-random numbers in [0, 1) for integer keys
+	"""
+	# 64-bit finalizer of MurmurHash3, wrapping around on overflow
+	with np.errstate(over="ignore"):
+		h = np.asarray(keys, dtype=np.uint64) + np.uint64(seed)*np.uint64(0x9E3779B97F4A7C15)
+		h ^= h >> np.uint64(33)
+		h *= np.uint64(0xFF51AFD7ED558CCD)
+		h ^= h >> np.uint64(33)
+		h *= np.uint64(0xC4CEB9FE1A85EC53)
+		h ^= h >> np.uint64(33)
+	return (h >> np.uint64(11)).astype(float)/2.0**53
+
+
+class ReplayLandscape(Landscape):
+	"""
+	Landscape built from the configurations measured by the saved trials of the problem size: measured
+	configurations have their mean throughput, and the others the throughput of the nearest measured one
+	in feature space
+	"""
+	def __init__(self, space):
+		super().__init__(space)
+		history = [(S, E) for S, E in load_history(space.n1, space.n2, space.n3) if space.contains(S)]
+		if len(history) == 0:
+			raise ValueError(f"No saved trial of size {space.n1}x{space.n2}x{space.n3} to replay")
+		self.F = self.features(space.encode_batch([S for S, _ in history]))
+		self.E = np.array([E for _, E in history])
+		self.optimum = float(self.E.max())
+
+	def values(self, X):
+		F = self.features(X)
+		d = ((F[:, None, :] - self.F[None, :, :])**2).sum(axis=2)
+		return self.E[d.argmin(axis=1)]
+
+
+def create_landscape(name, space, seed=0):
+	if name == "smooth":
+		return SyntheticLandscape(space, seed)
+	if name == "plateau":
+		return SyntheticLandscape(space, seed, plateaus=4)
+	if name == "cliff":
+		return SyntheticLandscape(space, seed, cliffs=0.2)
+	if name == "rugged":
+		return SyntheticLandscape(space, seed, plateaus=4, cliffs=0.2)
+	if name == "replay":
+		return ReplayLandscape(space)
+	raise ValueError(f"Invalid landscape: {name} not in {LANDSCAPES}")
+
+
+class SyntheticEvaluator(Evaluator):
+	"""
+	Evaluator measuring configurations on a landscape instead of running ISO3DFD, with multiplicative
+	Gaussian noise of relative standard deviation noise.
+
+	It counts the runs, the time spent in the landscape and the number of runs until one reached
+	target (in noise-free throughput). These statistics are shared with the evaluators derived from it.
+	"""
+	def __init__(self, landscape, seed=0, noise=0.0, target=None, **kwargs):
+		space = landscape.space
+		super().__init__(space.n1, space.n2, space.n3, **kwargs)
+		self.landscape = landscape
+		self.topology = space.topology
+		self.noise = noise
+		self.target = target
+		self.rng = np.random.default_rng(seed)
+		self.stats = {"n_runs": 0, "eval_time": 0.0, "runs_to_target": None}
+
+	def key(self, S):
+		return json.dumps([self.n1, self.n2, self.n3, self.nsteps, *S])
+
+	def run_batch(self, S_list, nsteps=None):
+		results = []
+		for S in S_list:
+			time0 = time.perf_counter()
+			value = self.landscape.value(S)
+			throughput = max(0.0, value*(1 + self.noise*self.rng.normal()))
+			self.stats["eval_time"] += time.perf_counter() - time0
+			self.stats["n_runs"] += 1
+			if self.target != None and value >= self.target and self.stats["runs_to_target"] == None:
+				self.stats["runs_to_target"] = self.stats["n_runs"]
+			results.append(RunResult(throughput, 0.0, 0, ""))
+		return results
+
+
+def run_benchmark(create_algorithm, algos, landscapes, n1, n2, n3, seeds, noise=0.0, target=0.95, S0=None):
+	"""
+	Runs every algorithm on every landscape for every seed, with algorithms built by
+	create_algorithm(name, S0, evaluator). Landscapes are drawn with the seed, so each seed is a
+	different instance of each synthetic landscape. Returns one record per run.
+	"""
+	space = SearchSpace(n1, n2, n3, topology=REFERENCE_TOPOLOGY)
+	if S0 == None:
+		S0 = space.default()
+	records = []
+	for landscape_name in landscapes:
+		for seed in seeds:
+			landscape = create_landscape(landscape_name, space, seed)
+			for algo_name in algos:
+				evaluator = SyntheticEvaluator(landscape, seed, noise, target*landscape.optimum)
+				algo = create_algorithm(algo_name, S0, evaluator)
+				algo.params["seed"] = seed
+				time0 = time.perf_counter()
+				with contextlib.redirect_stdout(io.StringIO()):
+					algo.optimize()
+				runtime = time.perf_counter() - time0
+				stats = evaluator.stats
+				final_best = landscape.value(algo.S_best)
+				records.append({
+					"algo": algo_name,
+					"landscape": landscape_name,
+					"seed": seed,
+					"optimum": landscape.optimum,
+					"evaluations": stats["n_runs"],
+					"evaluations_to_target": stats["runs_to_target"],
+					"final_best": final_best,
+					"final_best_ratio": final_best/landscape.optimum,
+					"runtime": runtime,
+					"overhead_per_evaluation": (runtime - stats["eval_time"])/max(1, stats["n_runs"]),
+				})
+				print(f"{algo_name}\t{landscape_name}\tseed {seed}\t{stats['n_runs']} evaluations\t"
+					f"to target: {stats['runs_to_target']}\tbest {final_best/landscape.optimum:.4f} of optimum")
+	return records
+
+
+def summarize(records):
+	"""
+	Statistics over seeds of every (algorithm, landscape) pair
+	"""
+	groups = {}
+	for record in records:
+		groups.setdefault((record["algo"], record["landscape"]), []).append(record)
+	summary = []
+	for (algo, landscape), group in groups.items():
+		to_target = [r["evaluations_to_target"] for r in group if r["evaluations_to_target"] != None]
+		ratios = np.array([r["final_best_ratio"] for r in group])
+		summary.append({
+			"algo": algo,
+			"landscape": landscape,
+			"n_seeds": len(group),
+			"success_rate": len(to_target)/len(group),
+			"median_evaluations_to_target": float(np.median(to_target)) if len(to_target) > 0 else None,
+			"final_best_ratio": {
+				"mean": float(ratios.mean()),
+				"std": float(ratios.std()),
+				"min": float(ratios.min()),
+				"median": float(np.median(ratios)),
+				"max": float(ratios.max()),
+			},
+			"overhead_per_evaluation": float(np.mean([r["overhead_per_evaluation"] for r in group])),
+		})
+	return summary
+
+
+def compare(summary, baseline, tolerance):
+	"""
+	Lists the regressions of a summary with respect to a baseline one: a lower success rate or mean final
+	best, or more evaluations to target or overhead per evaluation, by more than tolerance (relative)
+	"""
+	base = {(s["algo"], s["landscape"]): s for s in baseline}
+	regressions = []
+	for s in summary:
+		b = base.get((s["algo"], s["landscape"]))
+		if b == None:
+			continue
+		name = f"{s['algo']} on {s['landscape']}"
+		if s["success_rate"] < b["success_rate"] - tolerance:
+			regressions.append(f"{name}: success rate {s['success_rate']:.2f} < {b['success_rate']:.2f}")
+		if s["final_best_ratio"]["mean"] < b["final_best_ratio"]["mean"]*(1 - tolerance):
+			regressions.append(f"{name}: final best {s['final_best_ratio']['mean']:.4f} < {b['final_best_ratio']['mean']:.4f}")
+		if s["median_evaluations_to_target"] != None and b["median_evaluations_to_target"] != None \
+				and s["median_evaluations_to_target"] > b["median_evaluations_to_target"]*(1 + tolerance):
+			regressions.append(f"{name}: {s['median_evaluations_to_target']} evaluations to target > {b['median_evaluations_to_target']}")
+		if s["overhead_per_evaluation"] > b["overhead_per_evaluation"]*(1 + tolerance):
+			regressions.append(f"{name}: overhead {s['overhead_per_evaluation']*1e3:.3f} ms > {b['overhead_per_evaluation']*1e3:.3f} ms per evaluation")
+	return regressions
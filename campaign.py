@@ -0,0 +1,166 @@
+import os
+import sys
+import json
+import time
+import itertools
+import subprocess
+
+from common import RESULTS_DIR, CHECKPOINT_DIR, get_store
+
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+CAMPAIGN_DIR = os.path.join(RESULTS_DIR, "campaigns")
+
+
+class Campaign:
+	"""
+	Matrix of optimization trials described by a JSON spec: every algorithm with every combination of its
+	hyper-parameter values, on every problem size, with every seed. For example:
+
+		{
+			"name": "sa_schedules",
+			"algos": {"sa": {"T0": [10, 100], "decay": ["geometric", "linear"]}, "lahc": {"Lh": [5, 10, 20]}},
+			"sizes": [[256, 256, 256], [512, 512, 512]],
+			"seeds": 3,
+			"args": {"k": 100},
+			"parallel": 2
+		}
+
+	algos can also be a list of algorithms sharing the hyper-parameter values of params. Hyper-parameters and
+	args are optimize options without their dash (true for flags), seeds is a number of seeds or a list of
+	seeds, and parallel the number of trials run at once.
+
+	Each trial runs main.py optimize in its own process, pinned to its own partition of the cores, and is tagged
+	in the results database with the name of the campaign and with its run, which tells the campaign which runs
+	are done when it is restarted.
+	"""
+	def __init__(self, spec):
+		self.name = spec["name"]
+		algos = spec["algos"]
+		if isinstance(algos, list):
+			algos = {algo: spec.get("params", {}) for algo in algos}
+		seeds = spec.get("seeds", 1)
+		if isinstance(seeds, int):
+			seeds = list(range(seeds))
+		self.args = spec.get("args", {})
+		self.parallel = spec.get("parallel", 1)
+		self.runs = []
+		for algo, params in algos.items():
+			names = list(params)
+			for values in itertools.product(*[params[name] for name in names]):
+				for n in spec.get("sizes", [[256, 256, 256]]):
+					for seed in seeds:
+						self.runs.append({"algo": algo, "params": dict(zip(names, values)), "n": list(n), "seed": seed})
+		self.store = get_store()
+		self.log_dir = os.path.join(CAMPAIGN_DIR, self.name)
+
+	@staticmethod
+	def load(fn):
+		with open(fn, "r") as f:
+			return Campaign(json.load(f))
+
+	def tag(self, run):
+		return f"{self.name}/{describe(run)}"
+
+	def command(self, run):
+		"""
+		Command line starting the trial of a run
+		"""
+		command = [sys.executable, MAIN, "optimize", "-algo", run["algo"], "-n", *map(str, run["n"]), "-seed", str(run["seed"])]
+		for name, value in {**self.args, **run["params"]}.items():
+			if value is True:
+				command.append(f"-{name}")
+			elif isinstance(value, list):
+				command += [f"-{name}", *map(str, value)]
+			elif value is not False and value != None:
+				command += [f"-{name}", str(value)]
+		return command + ["-tag", self.name, self.tag(run)]
+
+	def trial(self, run):
+		"""
+		Latest trial of a run, None if it was never started
+		"""
+		trials = self.store.find_trials(tag=self.tag(run))
+		return max(trials, key=lambda trial: trial["id"]) if len(trials) > 0 else None
+
+	def status(self):
+		"""
+		(run, trial) pairs of all runs
+		"""
+		return [(run, self.trial(run)) for run in self.runs]
+
+	def print_status(self):
+		status = self.status()
+		for run, trial in status:
+			if trial == None:
+				print(f"pending\t-\t-\t{describe(run)}")
+			else:
+				print(f"{trial['status']}\t{trial['id']:05d}\t{trial['E_best']}\t{describe(run)}")
+		counts = {}
+		for _, trial in status:
+			state = trial["status"] if trial != None else "pending"
+			counts[state] = counts.get(state, 0) + 1
+		print(f"Campaign {self.name}:", ", ".join(f"{count} {state}" for state, count in counts.items()))
+
+	def start(self, run, cpus):
+		"""
+		Starts the trial of a run on the given CPUs, resuming it from its checkpoint if it was interrupted
+		"""
+		trial = self.trial(run)
+		if trial != None and os.path.exists(os.path.join(CHECKPOINT_DIR, f"{trial['id']:05d}.jsonl")):
+			command = [sys.executable, MAIN, "optimize", "-resume", str(trial["id"])]
+		else:
+			command = self.command(run)
+		os.makedirs(self.log_dir, exist_ok=True)
+		log = open(os.path.join(self.log_dir, describe(run).replace(" ", "_") + ".log"), "a")
+		process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT,
+			preexec_fn=lambda: os.sched_setaffinity(0, cpus))
+		log.close()
+		return process
+
+	def run(self, partitions, poll=1.0):
+		"""
+		Runs the trials that are not done yet, one on each of the given partitions of the CPUs at a time
+		(see cpu_partitions). Trials that fail are marked as failed, and are resumed on the next run.
+		Returns the number of failed trials.
+		"""
+		partitions = list(partitions)
+		pending = [run for run, trial in self.status() if trial == None or trial["status"] != "done"]
+		print(f"Campaign {self.name}: {len(self.runs) - len(pending)} of {len(self.runs)} trials done,",
+			f"running {len(pending)} on {len(partitions)} partitions of {len(partitions[0])} CPUs")
+		running = {}
+		n_failed = 0
+		try:
+			while len(pending) > 0 or len(running) > 0:
+				while len(pending) > 0 and len(partitions) > 0:
+					run = pending.pop(0)
+					cpus = partitions.pop(0)
+					running[self.start(run, cpus)] = (run, cpus)
+					print("Started", describe(run))
+				time.sleep(poll)
+				for process in list(running):
+					code = process.poll()
+					if code == None:
+						continue
+					run, cpus = running.pop(process)
+					partitions.append(cpus)
+					trial = self.trial(run)
+					if code == 0 and trial != None and trial["status"] == "done":
+						print(f"Finished {describe(run)}: trial {trial['id']:05d}, best {trial['E_best']}")
+					else:
+						n_failed += 1
+						if trial != None:
+							self.store.update_trial(trial["id"], status="failed")
+						print(f"Failed {describe(run)} with exit code {code}, see {self.log_dir}")
+		except KeyboardInterrupt:
+			# Trials are interrupted as well, and resumed from their checkpoints on the next run
+			for process in running:
+				process.wait()
+			print("Interrupted, run the campaign again to resume it")
+			raise
+		return n_failed
+
+
+def describe(run):
+	return " ".join([run["algo"], *[f"{name}={value}" for name, value in run["params"].items()],
+		"x".join(map(str, run["n"])), f"seed={run['seed']}"])
@@ -0,0 +1,96 @@
+import os
+import json
+import socket
+import argparse
+
+
+# Commands of the tuning service client, which only import the standard library so that they start in milliseconds
+COMMANDS = ["submit", "jobs", "watch", "cancel"]
+JOB_COMMANDS = ["optimize", "energy", "sweep"]
+SOCKET_FN = os.path.join(os.getcwd(), "results", "serve.sock")
+
+
+def add_commands(subparsers):
+	"""
+	Adds the client commands to the subparsers of a command line parser
+	"""
+	submit_parser = subparsers.add_parser("submit",
+					description="Queue an optimize, energy or sweep job on the tuning service (main.py serve)",
+					formatter_class=argparse.ArgumentDefaultsHelpFormatter
+					)
+	submit_parser.add_argument("-watch", help="Stream the output of the job until it ends", action="store_true")
+	submit_parser.add_argument("job", help="Command of the job (sweep stands for optimize -algo sweep)", choices=JOB_COMMANDS)
+	submit_parser.add_argument("args", help="Arguments of the command, as given to main.py", nargs=argparse.REMAINDER)
+
+	jobs_parser = subparsers.add_parser("jobs", description="List the jobs of the tuning service")
+	jobs_parser.add_argument("id", help="Job IDs (all jobs if none)", type=int, nargs="*")
+
+	watch_parser = subparsers.add_parser("watch", description="Stream the output of a job of the tuning service until it ends")
+	watch_parser.add_argument("id", help="Job ID", type=int)
+
+	cancel_parser = subparsers.add_parser("cancel",
+					description="Cancel a job of the tuning service: queued jobs are dropped, and running ones are interrupted\
+								 and can be resumed from their checkpoint with submit optimize -resume ID"
+					)
+	cancel_parser.add_argument("id", help="Job IDs", type=int, nargs="+")
+
+	for command_parser in [submit_parser, jobs_parser, watch_parser, cancel_parser]:
+		command_parser.add_argument("-socket", help="Unix socket of the tuning service", default=SOCKET_FN)
+
+
+def request(socket_fn, message):
+	"""
+	Sends a request to the tuning service and yields its responses
+	"""
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		sock.connect(socket_fn)
+	except OSError as e:
+		raise SystemExit(f"Cannot connect to the tuning service at {socket_fn} ({e}), start it with main.py serve")
+	with sock, sock.makefile("rw") as f:
+		f.write(json.dumps(message) + "\n")
+		f.flush()
+		for line in f:
+			response = json.loads(line)
+			if response["type"] == "error":
+				raise SystemExit(response["message"])
+			yield response
+
+def describe(job):
+	trial = f"{job['trial']:05d}" if job["trial"] != None else "-"
+	evaluations = job["n_evaluations"] if job["n_evaluations"] != None else "-"
+	return f"{job['id']}\t{job['state']}\t{trial}\t{evaluations}\t{job['E_best']}\t{' '.join(job['argv'])}"
+
+def watch(socket_fn, id):
+	"""
+	Prints the output of a job until it ends and returns its exit code
+	"""
+	for response in request(socket_fn, {"type": "watch", "id": id}):
+		if response["type"] == "output":
+			print(response["line"], end="", flush=True)
+		else:
+			print(describe(response["job"]))
+			return response["job"]["returncode"]
+
+def main(argv):
+	"""
+	Runs a client command given its command line arguments, and returns its exit code
+	"""
+	parser = argparse.ArgumentParser(prog="iso3dfd_performance")
+	add_commands(parser.add_subparsers(title="Commands", dest="command"))
+	args = parser.parse_args(argv)
+
+	if args.command == "submit":
+		job = next(request(args.socket, {"type": "submit", "argv": [args.job, *args.args]}))["job"]
+		print(describe(job))
+		if args.watch:
+			return watch(args.socket, job["id"])
+	elif args.command == "jobs":
+		for job in next(request(args.socket, {"type": "jobs", "ids": args.id}))["jobs"]:
+			print(describe(job))
+	elif args.command == "watch":
+		return watch(args.socket, args.id)
+	elif args.command == "cancel":
+		for id in args.id:
+			print(describe(next(request(args.socket, {"type": "cancel", "id": id}))["job"]))
+	return 0
@@ -1,14 +1,39 @@
 import subprocess
 import os
 import json
+import time
+import math
+import copy
+import hashlib
+import shutil
+import tempfile
+import fcntl
+import signal
+import threading
+import multiprocessing
+import contextlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
+from store import ResultStore, COLUMNS as STORE_COLUMNS
+from topology import Topology
+
 
 # Constants
 ISO3DFD_DIR = os.path.expanduser("~") + "/iso3dfd-st7"
 RESULTS_DIR = os.path.join(os.getcwd(), "results")
+DB_FN = os.path.join(RESULTS_DIR, "results.db")
+CACHE_FN = os.path.join(RESULTS_DIR, "cache.jsonl")
+CHECKPOINT_DIR = os.path.join(RESULTS_DIR, "checkpoints")
+BIN_DIR = os.path.join(os.getcwd(), "bin")
+BUILD_DIR = os.path.join(os.getcwd(), "build")
+MANIFEST_FN = os.path.join(BIN_DIR, "manifest.json")
+CPU_MONITOR_DIR = os.environ.get("CPU_MONITOR_DIR", "/opt/cpu_monitor")
+NSTEPS = 100
+MAX_POWER = 8000.0 # W, power samples above are measurement errors
+ENERGY_CHUNKSIZE = 100000 # rows of power trace read at once
 
 def get_algo_by_name(name):
 	algo_dict = {
@@ -16,7 +41,13 @@ def get_algo_by_name(name):
 		"sa": "Simulated Annealing",
 		"tabu_sa": "Tabu SA",
 		"tunnel_sa": "Tunneling SA",
-		"lahc": "Late Acceptance Hill Climbing"
+		"lahc": "Late Acceptance Hill Climbing",
+		"hyperband": "Hyperband",
+		"bo": "Bayesian Optimization",
+		"pt": "Parallel Tempering",
+		"ga": "Genetic Algorithm",
+		"vns": "Variable Neighborhood Search",
+		"sweep": "Landscape Sweep"
 	}
 	return algo_dict[name]
 
@@ -24,78 +55,168 @@ class Result:
 	"""
 	Class for interfacing with optimization results, enabling loading, saving and plotting.
 	
-	Each instantiation corresponds to an optimization run.
-	History of attempted solutions are saved in a numbered .csv file, and parameters and metadata
-	are saved in a common summary.json file
+	Each instantiation corresponds to an optimization run (trial).
+	Parameters, metadata and history of attempted solutions are saved in the results database,
+	see store.ResultStore
 	"""
 	def __init__(self, id=None):
 		self.id = None
-		self.json_fn = os.path.join(RESULTS_DIR, "summary.json")
+		self.status = "done"
+		self.front = []
+		self.spans = []
+		self.store = get_store()
 		if id != None:
 			self.load_from_id(id)
 
 	def load_from_id(self, id):
 		self.id = id
-		with open(self.json_fn, "r") as f:
-			summary = json.load(f)
-		id_str = str(id)
-		self.params = summary[id_str]["params"]
-		self.S_best = summary[id_str]["S_best"]
-		self.E_best = summary[id_str]["E_best"]
-		self.runtime = summary[id_str]["runtime"]
-
-		csv_fn = os.path.join(RESULTS_DIR, f"{self.id:05d}.csv")
-		self.data = pd.read_csv(csv_fn, index_col=0)
-
-	def set_data(self, params, S_list, E_list, S_best, E_best, runtime):
-		self.data = pd.DataFrame(S_list, columns = ["Olevel", "simd", "NbTh", "n1_thrd_block", "n2_thrd_block", "n3_thrd_block"])
+		trial = self.store.get_trial(id)
+		self.params = trial["params"]
+		self.S_best = trial["S_best"]
+		self.E_best = trial["E_best"]
+		self.runtime = trial["runtime"]
+		self.cache_stats = trial["cache"]
+		self.status = trial["status"]
+		self.front = self.store.get_front(id)
+		self.spans = self.store.get_spans(id)
+
+		names, rows = self.store.get_history(id)
+		self.data = pd.DataFrame(rows, columns=names).set_index("iter")
+		self.data.index.name = None
+		if self.status == "running" and len(self.data) > 0:
+			best = self.data["E"].idxmax()
+			self.S_best = self.data.loc[best, STORE_COLUMNS].tolist()
+			self.E_best = self.data.loc[best, "E"]
+		if self.runtime == None:
+			self.runtime = time.time() - trial["created"]
+
+	def set_data(self, params, S_list, E_list, S_best, E_best, runtime, cache_stats=None, columns={}, front=[]):
+		self.data = pd.DataFrame(S_list, columns = STORE_COLUMNS)
 		self.data["E"] = E_list
+		for name in columns:
+			self.data[name] = columns[name]
 		self.params = params
 		self.S_best = S_best
 		self.E_best = E_best
 		self.runtime = runtime
-
-	def calculate_id(self):
-			i = -1
-			for name in os.listdir(RESULTS_DIR):
-					if name[-4:] == ".csv":
-						i = max(i, int(name[:-4]))
-			self.id = i+1
+		self.cache_stats = cache_stats
+		self.front = front
 
 	def save(self):
-			if not os.path.exists(RESULTS_DIR):
-				subprocess.run(f"mkdir -p {RESULTS_DIR}", shell=True, stdout=subprocess.PIPE)
-			if self.id == None:
-					self.calculate_id()
-			if os.path.exists(self.json_fn):
-					with open(self.json_fn, "r") as f:
-							summary = json.load(f)
-			else:
-					summary = {}
-			id_str = str(self.id)
-			summary[id_str] = {}
-			summary[id_str]["params"] = self.params
-			summary[id_str]["S_best"] = self.S_best
-			summary[id_str]["E_best"] = self.E_best
-			summary[id_str]["runtime"] = self.runtime
-			print("Saving summary file to", self.json_fn)
-			with open(self.json_fn, "w") as f:
-					json.dump(summary, f, indent=4)
-
-			csv_fn = os.path.join(RESULTS_DIR, f"{self.id:05d}.csv")
-			print("Saving result file to", csv_fn)
-			self.data.to_csv(csv_fn)
+		"""
+		Saves the trial and replaces its history, allocating a new trial ID if it has none
+		"""
+		if self.id == None:
+			self.id = self.store.create_trial(self.params, self.status)
+		self.store.update_trial(self.id, self.params, self.S_best, self.E_best, self.runtime, self.status, self.cache_stats)
+		extra_names = [name for name in self.data.columns if name not in STORE_COLUMNS and name != "E"]
+		rows = []
+		for i, row in zip(self.data.index, self.data.to_dict("records")):
+			extra = {name: row[name] for name in extra_names if row[name] == row[name] and row[name] != None}
+			rows.append((int(i), [row[name] for name in STORE_COLUMNS], row["E"], extra))
+		self.store.replace_history(self.id, rows)
+		self.store.replace_front(self.id, self.front)
+		print(f"Saved trial {self.id:05d} to", self.store.fn)
 
 	def print_summary(self):
-		print(f"=== Result for trial {self.id:05d} ===")
+		print(f"=== Result for trial {self.id:05d}{' (running)' if self.status == 'running' else ''} ===")
 		print("Parameters:")
 		for key in self.params:
 			print(f"\t{key}\t{self.params[key]}")
 		print(f"Executed in {self.runtime:.2f} s")
-		print(f"Best result: {self.E_best} MPoints/s with {self.S_best}")
+		objective = Objective.parse(self.params.get("objective", "throughput"))
+		print(f"Best result: {self.E_best} {objective.unit} with {self.S_best}")
+		if self.cache_stats != None:
+			print(f"Cache: {self.cache_stats['hits']} hits, {self.cache_stats['misses']} misses")
+		if len(self.front) > 0:
+			print("Pareto front:")
+			for S, throughput, energy in self.front:
+				print(f"\t{throughput:.1f} MPoints/s\t{energy:.4f} kJ\t{S}")
 		print()
 		print(self.data)
 
+	def profile(self):
+		"""
+		Time spent in every phase of the trial, as (name, count, total, mean, max) tuples sorted by total time.
+		The time outside of any span is reported as untracked, which is mostly spent by the algorithm itself.
+		"""
+		phases = {}
+		for span in self.spans:
+			phases.setdefault(span["name"], []).append(span["duration"])
+		rows = [(name, len(durations), sum(durations), sum(durations)/len(durations), max(durations))
+			for name, durations in phases.items()]
+		# Spans of concurrent evaluations overlap, so the tracked time is the length of the union of their intervals
+		tracked = 0.0
+		end = -math.inf
+		for start, stop in sorted((span["start"], span["start"] + span["duration"]) for span in self.spans):
+			if stop > end:
+				tracked += stop - max(start, end)
+				end = stop
+		rows.append(("untracked", 1, max(0.0, self.runtime - tracked), max(0.0, self.runtime - tracked), max(0.0, self.runtime - tracked)))
+		return sorted(rows, key=lambda row: -row[2])
+
+	def print_profile(self):
+		print(f"=== Profile of trial {self.id:05d} ({self.runtime:.2f} s) ===")
+		print(f"{'phase':<12}{'count':>8}{'total (s)':>12}{'mean (s)':>12}{'max (s)':>12}{'share':>8}")
+		for name, count, total, mean, maximum in self.profile():
+			print(f"{name:<12}{count:>8}{total:>12.3f}{mean:>12.4f}{maximum:>12.4f}{total/self.runtime:>8.1%}")
+
+	def export_trace(self, fn):
+		"""
+		Writes the spans of the trial to a trace in the Chrome trace event format, which can be opened
+		with Perfetto (ui.perfetto.dev) or chrome://tracing
+		"""
+		events = [{"name": span["name"], "cat": "iso3dfd", "ph": "X", "ts": span["start"]*1e6, "dur": span["duration"]*1e6,
+			"pid": span["pid"], "tid": span["tid"], "args": span["args"]} for span in self.spans]
+		with open(fn, "w") as f:
+			json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"trial": self.id, "params": self.params}}, f)
+		print(f"Wrote {len(events)} spans of trial {self.id:05d} to {fn}")
+
+	def landscape(self):
+		"""
+		Configurations measured at full fidelity by the trial, with the mean objective value E of their rows,
+		its standard deviation E_std and their number of rows n
+		"""
+		data = self.data
+		if "fidelity" in data:
+			data = data[data["fidelity"].fillna(1) >= 1]
+		if "aborted" in data:
+			data = data[data["aborted"] != True]
+		data = data[data["E"].notna()]
+		table = data.groupby(STORE_COLUMNS)["E"].agg(["mean", "std", "count"]).reset_index()
+		return table.rename(columns={"mean": "E", "std": "E_std", "count": "n"})
+
+	def export_landscape(self, fn):
+		table = self.landscape()
+		table.to_csv(fn, index=False)
+		print(f"Wrote {len(table)} configurations of trial {self.id:05d} to {fn}")
+
+	def heatmap(self, x, y, fixed={}, reduce="max"):
+		"""
+		Slice of the landscape along parameters x and y, as a table of y values by x values. Configurations are
+		restricted to the fixed parameter values, and the objective values of those in a cell are reduced
+		with reduce (max: best value of the other parameters, or mean).
+		"""
+		table = self.landscape()
+		for name, value in fixed.items():
+			table = table[table[name] == value]
+		return table.pivot_table(index=y, columns=x, values="E", aggfunc=reduce)
+
+	def plot_heatmap(self, x, y, fixed={}, reduce="max", title=None):
+		table = self.heatmap(x, y, fixed, reduce)
+		plt.imshow(table.to_numpy(dtype=float), origin="lower", aspect="auto", interpolation="nearest")
+		plt.colorbar(label=Objective.parse(self.params.get("objective", "throughput")).label)
+		# At most about 16 tick labels per axis
+		for ticks, values in [(plt.xticks, table.columns), (plt.yticks, table.index)]:
+			step = max(1, len(values)//16)
+			ticks(range(0, len(values), step), [str(value) for value in values[::step]])
+		plt.xlabel(x)
+		plt.ylabel(y)
+		if title == None:
+			title = f"Trial {self.id:05d}" + "".join(f", {name}={value}" for name, value in fixed.items()) \
+				+ f" ({reduce} over the other parameters)"
+		plt.title(title)
+
 	def plot(self, title, label):
 		if label == None:
 			label = f"{self.id:05d}"
@@ -105,84 +226,583 @@ class Result:
 		plt.plot(self.data["E"], label=label)
 		plt.title(title)
 		plt.xlabel("Iteration")
-		plt.ylabel("Throughput (MPoints/s)")
+		plt.ylabel(Objective.parse(self.params.get("objective", "throughput")).label)
 		plt.legend()
 		plt.grid(True)
 
 
-def make(Olevel, simd):
+def get_store():
 	"""
-	Compiles the iso3dfd code
+	Results database of the process, opened on first use
+	"""
+	global _store
+	if _store == None:
+		_store = ResultStore(DB_FN)
+	return _store
+
+_store = None
+
+
+def load_history(n1, n2, n3, objective="throughput", trials=None):
+	"""
+	Gathers the configurations measured at full fidelity by all saved trials of a problem size with
+	the given objective (or only by the given trials), as a list of (S, E) pairs averaged over repeated rows
+	"""
+	return get_store().config_means(n1, n2, n3, objective, trials)
+
+
+class Checkpoint:
 	"""
-	filename = f"iso3dfd_dev13_cpu_{simd}_{Olevel}.exe"
-	if not os.path.exists("./bin/" + filename):
-		# Make command
-		cmd = f"make Olevel=-{Olevel} simd={simd} last"
-		print("Running command:", cmd)
-		res = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, cwd=ISO3DFD_DIR)
+	Journal of the measurements of an optimization run, appended after every evaluation, along with
+	the command line arguments and random seed of the run.
+
+	Algorithms are deterministic given their seed and the measurements they receive, so an interrupted
+	run is resumed by replaying it from the start with the journaled measurements. This restores its
+	whole state (current and best solutions, temperature, tabu list, LAHC history, random generators
+	and history) without re-running any configuration, after which it continues with new measurements.
+	"""
+	def __init__(self, id, args=None, seed=None):
+		self.id = id
+		self.fn = os.path.join(CHECKPOINT_DIR, f"{id:05d}.jsonl")
+		self.entries = []
+		self.position = 0
+		self.elapsed = 0.0
+		self.resumed = time.time()
+		if args != None:
+			os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+			self.args = args
+			self.seed = seed
+			self.time = time.time()
+			with open(self.fn, "x") as f:
+				f.write(json.dumps({"args": args, "seed": seed, "time": self.time}) + "\n")
+		else:
+			with open(self.fn, "r") as f:
+				lines = [line for line in f if line.endswith("\n")]
+			header = json.loads(lines[0])
+			self.args = header["args"]
+			self.seed = header["seed"]
+			self.time = header["time"]
+			self.entries = [json.loads(line) for line in lines[1:]]
+			if len(self.entries) > 0:
+				self.elapsed = self.entries[-1]["time"] - self.time
+			print(f"Resuming trial {id:05d} from {len(self.entries)} journaled evaluations")
+
+	@property
+	def replaying(self):
+		return self.position < len(self.entries)
+
+	def replay(self, S_list):
+		entry = self.entries[self.position]
+		if entry["S"] != S_list:
+			raise RuntimeError(f"Checkpoint {self.fn} does not match the replayed run: expected {entry['S']}, got {S_list}")
+		self.position += 1
+		return entry
+
+	def append(self, S_list, measurements):
+		entry = {
+			"S": S_list,
+			"samples": [measurement.samples for measurement in measurements],
+			"aborted": [measurement.aborted for measurement in measurements],
+			"usages": [measurement.usages for measurement in measurements],
+			"interfered": [measurement.n_interfered for measurement in measurements],
+			"time": self.time + self.elapsed + time.time() - self.resumed,
+		}
+		with open(self.fn, "a") as f:
+			f.write(json.dumps(entry) + "\n")
+
+	def remove(self):
+		os.remove(self.fn)
+
+
+def new_checkpoint(args, seed):
+	"""
+	Creates the checkpoint of a new run, reserving its trial ID in the results database
+	"""
+	n1, n2, n3 = args["n"]
+	id = get_store().create_trial({"method": args["algo"], "n1": n1, "n2": n2, "n3": n3})
+	return Checkpoint(id, args, seed)
+
+
+class EvalCache:
+	"""
+	Persistent measurement cache shared by all algorithms and trials.
+
+	Measurement samples are keyed by problem size, configuration and binary identity, and appended as
+	JSON lines to a common file so that concurrent optimizations can reuse each other's runs.
+	Entries older than max_age seconds are considered stale and re-measured, and only the
+	max_entries most recent entries are kept when the file is compacted.
+	"""
+	def __init__(self, fn=CACHE_FN, max_age=None, max_entries=None):
+		self.fn = fn
+		self.max_age = max_age
+		self.max_entries = max_entries
+		self.entries = {}
+		self.offset = 0
+		self.inode = None
+		self.hits = 0
+		self.misses = 0
+		self.refresh()
+		self.evict()
+
+	def refresh(self):
+		"""
+		Reads entries appended to the cache file since the last refresh, or the whole file again when another
+		process has compacted it since
+		"""
+		try:
+			f = open(self.fn, "r")
+		except FileNotFoundError:
+			return
+		with f:
+			stat = os.fstat(f.fileno())
+			if stat.st_ino != self.inode or stat.st_size < self.offset:
+				self.inode = stat.st_ino
+				self.offset = 0
+			f.seek(self.offset)
+			for line in f:
+				if not line.endswith("\n"):
+					break
+				entry = json.loads(line)
+				self.entries[entry["key"]] = entry
+				self.offset += len(line)
+
+	def get(self, key):
+		if key not in self.entries:
+			self.refresh()
+		entry = self.entries.get(key)
+		if entry != None and (self.max_age == None or time.time() - entry["time"] <= self.max_age):
+			self.hits += 1
+			return entry["value"]
+		self.misses += 1
+		return None
+
+	def put(self, key, value):
+		entry = {"key": key, "value": value, "time": time.time()}
+		self.entries[key] = entry
+		os.makedirs(os.path.dirname(self.fn), exist_ok=True)
+		# Shared with other writers, exclusive with compactions, which would lose entries appended to the replaced file.
+		# The entry is read back by the next refresh, since other processes may have appended entries before it.
+		with open(self.fn + ".lock", "w") as lock:
+			fcntl.flock(lock, fcntl.LOCK_SH)
+			with open(self.fn, "a") as f:
+				f.write(json.dumps(entry) + "\n")
+		if self.max_entries != None and len(self.entries) > 2*self.max_entries:
+			self.evict()
+
+	def evict(self):
+		"""
+		Drops stale entries and keeps the max_entries most recent ones, compacting the cache file. The file is read
+		again under an exclusive lock first, so that the entries appended by other processes are kept.
+		"""
+		if self.max_age == None and self.max_entries == None:
+			return
+		os.makedirs(os.path.dirname(self.fn), exist_ok=True)
+		with open(self.fn + ".lock", "w") as lock:
+			fcntl.flock(lock, fcntl.LOCK_EX)
+			self.refresh()
+			entries = sorted(self.entries.values(), key=lambda entry: entry["time"])
+			if self.max_age != None:
+				entries = [entry for entry in entries if time.time() - entry["time"] <= self.max_age]
+			if self.max_entries != None:
+				entries = entries[-self.max_entries:]
+			if len(entries) == len(self.entries):
+				return
+			self.entries = {entry["key"]: entry for entry in entries}
+			tmp_fn = f"{self.fn}.{os.getpid()}.tmp"
+			with open(tmp_fn, "w") as f:
+				for entry in entries:
+					f.write(json.dumps(entry) + "\n")
+				stat = os.fstat(f.fileno())
+			os.replace(tmp_fn, self.fn)
+			self.inode = stat.st_ino
+			self.offset = stat.st_size
+
+	def stats(self):
+		total = self.hits + self.misses
+		return {
+			"hits": self.hits,
+			"misses": self.misses,
+			"hit_rate": self.hits/total if total > 0 else 0.0,
+		}
+
 
-		# Copy the executable
-		cmd = f"mkdir -p bin && cp {ISO3DFD_DIR}/bin/iso3dfd_dev13_cpu_{simd}.exe ./bin/{filename}"
-		print("Runing command:", cmd)
-		res = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE)
+binary_ids = {}
+
+def binary_id(filename):
+	"""
+	Identifies an executable by the hash of its content, so that recompiled binaries invalidate
+	cached measurements
+	"""
+	path = os.path.join(BIN_DIR, filename)
+	stat = os.stat(path)
+	if binary_ids.get(path, (None,))[0] != (stat.st_mtime, stat.st_size):
+		with open(path, "rb") as f:
+			digest = hashlib.sha1(f.read()).hexdigest()
+		binary_ids[path] = ((stat.st_mtime, stat.st_size), digest)
+	return binary_ids[path][1]
+
+
+def binary_name(Olevel, simd):
+	return f"iso3dfd_dev13_cpu_{simd}_{Olevel}.exe"
+
+def source_id():
+	"""
+	Identifies the state of the ISO3DFD sources by the names, sizes and modification times of their files
+	"""
+	digest = hashlib.sha1()
+	for root, dirs, files in os.walk(ISO3DFD_DIR):
+		dirs[:] = sorted(d for d in dirs if d not in ("bin", "obj", ".git"))
+		for name in sorted(files):
+			stat = os.stat(os.path.join(root, name))
+			digest.update(f"{os.path.relpath(os.path.join(root, name), ISO3DFD_DIR)}:{stat.st_size}:{stat.st_mtime}".encode())
+	return digest.hexdigest()
+
+def load_manifest():
+	if not os.path.exists(MANIFEST_FN):
+		return {}
+	with open(MANIFEST_FN, "r") as f:
+		return json.load(f)
+
+def update_manifest(entries):
+	"""
+	Merges build entries into the manifest, holding a lock so that concurrent builds do not lose updates
+	"""
+	os.makedirs(BIN_DIR, exist_ok=True)
+	with open(MANIFEST_FN + ".lock", "w") as lock:
+		fcntl.flock(lock, fcntl.LOCK_EX)
+		manifest = load_manifest()
+		manifest.update(entries)
+		tmp_fn = f"{MANIFEST_FN}.{os.getpid()}.tmp"
+		with open(tmp_fn, "w") as f:
+			json.dump(manifest, f, indent=4)
+		os.replace(tmp_fn, MANIFEST_FN)
+
+def build_variant(Olevel, simd, source):
+	"""
+	Compiles one variant in a private copy of the ISO3DFD tree and atomically installs the executable
+	"""
+	filename = binary_name(Olevel, simd)
+	os.makedirs(BUILD_DIR, exist_ok=True)
+	os.makedirs(BIN_DIR, exist_ok=True)
+	build_dir = tempfile.mkdtemp(prefix=f"{Olevel}_{simd}_", dir=BUILD_DIR)
+	try:
+		src_dir = os.path.join(build_dir, "src")
+		shutil.copytree(ISO3DFD_DIR, src_dir, ignore=shutil.ignore_patterns("*.exe", "*.o", ".git"))
+		cmd = ["make", f"Olevel=-{Olevel}", f"simd={simd}", "last"]
+		print("Running command:", " ".join(cmd), "in", src_dir)
+		res = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=src_dir)
+		log_fn = os.path.join(BUILD_DIR, f"{Olevel}_{simd}.log")
+		with open(log_fn, "wb") as f:
+			f.write(res.stdout)
+		exe = os.path.join(src_dir, "bin", f"iso3dfd_dev13_cpu_{simd}.exe")
+		if res.returncode != 0 or not os.path.exists(exe):
+			raise RuntimeError(f"Build of {filename} failed, see {log_fn}")
+
+		tmp_fn = os.path.join(BIN_DIR, f".{filename}.{os.getpid()}.tmp")
+		shutil.copy2(exe, tmp_fn)
+		os.replace(tmp_fn, os.path.join(BIN_DIR, filename))
+	finally:
+		shutil.rmtree(build_dir, ignore_errors=True)
+
+	return filename, {
+		"Olevel": Olevel,
+		"simd": simd,
+		"sha1": binary_id(filename),
+		"source": source,
+		"time": time.time(),
+	}
+
+def build(variants, jobs=None, force=False):
+	"""
+	Compiles the given (Olevel, simd) variants concurrently, skipping those whose manifest entry
+	matches the current sources, and records them in the build manifest
+	"""
+	source = source_id()
+	manifest = load_manifest()
+	todo = []
+	for Olevel, simd in variants:
+		filename = binary_name(Olevel, simd)
+		entry = manifest.get(filename)
+		if force or entry == None or entry["source"] != source or not os.path.exists(os.path.join(BIN_DIR, filename)):
+			todo.append((Olevel, simd))
+	if len(todo) == 0:
+		return manifest
+
+	if jobs == None:
+		jobs = min(len(todo), os.cpu_count())
+	with ThreadPoolExecutor(max_workers=jobs) as executor:
+		entries = dict(executor.map(lambda variant: build_variant(*variant, source), todo))
+	update_manifest(entries)
+	return load_manifest()
+
+def make(Olevel, simd):
+	"""
+	Returns the executable of a variant, compiling it only if it is missing from the build manifest
+	or does not match the recorded hash
+	"""
+	filename = binary_name(Olevel, simd)
+	entry = load_manifest().get(filename)
+	path = os.path.join(BIN_DIR, filename)
+	if entry == None or not os.path.exists(path) or binary_id(filename) != entry["sha1"]:
+		build([(Olevel, simd)], force=True)
 	return filename
 
-def run_iso3dfd(n1, n2, n3, NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block, filename):
-	cmd = f"KMP_AFFINITY=balanced,granularity=core ./bin/{filename} {n1} {n2} {n3} {NbTh} 100 {n1_thrd_block} {n2_thrd_block} {n3_thrd_block} > output.txt"
-	res = subprocess.run(cmd,shell=True,stdout=subprocess.PIPE)
+class Tracer:
+	"""
+	Records timed spans of the phases of evaluations and of the algorithm, as dictionaries with a name,
+	start time (seconds since the epoch), duration, process and thread IDs, and arguments
+	"""
+	def __init__(self):
+		self.spans = []
+		self.flushed = 0
+		self.lock = threading.Lock()
+
+	@contextlib.contextmanager
+	def span(self, name, **args):
+		start = time.time()
+		try:
+			yield
+		finally:
+			self.add([{"name": name, "start": start, "duration": time.time() - start, "pid": os.getpid(),
+				"tid": threading.get_native_id(), "args": args}])
+
+	def add(self, spans):
+		with self.lock:
+			self.spans += spans
+
+	def take(self):
+		"""
+		Returns the spans recorded since the last call, to be saved
+		"""
+		with self.lock:
+			spans = self.spans[self.flushed:]
+			self.flushed = len(self.spans)
+		return spans
+
+
+class RunResult:
+	"""
+	Outcome of one ISO3DFD execution: parsed throughput (None if it could not be found),
+	wall time in seconds, exit status and captured output, and for runs under cpu_monitor
+	the energy consumed in kJ (DRAM, package and total), along with the spans of its phases and the resource
+	usage of its process (see USAGE_FIELDS)
+	"""
+	def __init__(self, throughput, wall_time, returncode, output, timed_out=False):
+		self.throughput = throughput
+		self.wall_time = wall_time
+		self.returncode = returncode
+		self.output = output
+		self.timed_out = timed_out
+		self.dram_energy = None
+		self.pkg_energy = None
+		self.energy = None
+		self.spans = []
+		self.usage = None
+
+	def __repr__(self):
+		return f"RunResult(throughput={self.throughput}, wall_time={self.wall_time:.3f}, returncode={self.returncode}, timed_out={self.timed_out})"
+
+
+# Resource usage of a run: from getrusage of the reaped process (times in seconds, max_rss in KiB), then from
+# /proc sampling if enabled: CPU migrations of its threads, number of CPUs they ran on and maximum number of
+# runnable tasks on the machine
+RUSAGE_FIELDS = ["user_time", "sys_time", "max_rss", "major_faults", "minor_faults", "voluntary_switches",
+	"involuntary_switches"]
+USAGE_FIELDS = RUSAGE_FIELDS + ["migrations", "n_cpus_used", "max_running"]
+
+def read_rusage(rusage):
+	values = [rusage.ru_utime, rusage.ru_stime, rusage.ru_maxrss, rusage.ru_majflt, rusage.ru_minflt, rusage.ru_nvcsw,
+		rusage.ru_nivcsw]
+	return dict(zip(RUSAGE_FIELDS, values))
+
+
+class ProcSampler:
+	"""
+	Samples /proc every interval seconds while the processes of a session run: the CPU migrations of
+	their threads (se.nr_migrations in /proc/PID/task/TID/sched), the CPUs they last ran on, and the
+	number of runnable tasks on the machine (procs_running in /proc/stat)
+	"""
+	def __init__(self, session, interval):
+		self.session = session
+		self.interval = interval
+		self.migrations = {}
+		self.cpus = set()
+		self.max_running = 0
+		self.stopped = threading.Event()
+		self.thread = threading.Thread(target=self.loop, daemon=True)
+		self.thread.start()
+
+	def loop(self):
+		while not self.stopped.wait(self.interval):
+			self.sample()
 
-def run_energy(n1, n2, n3, NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block, filename):
+	def pids(self):
+		pids = []
+		for pid in os.listdir("/proc"):
+			if not pid.isdigit():
+				continue
+			try:
+				with open(f"/proc/{pid}/stat", "r") as f:
+					# Fields after the command name, which may contain spaces: the session is the 6th field
+					fields = f.read().rsplit(")", 1)[1].split()
+			except OSError:
+				continue
+			if int(fields[3]) == self.session:
+				pids.append(pid)
+		return pids
+
+	def sample(self):
+		for pid in self.pids():
+			try:
+				tids = os.listdir(f"/proc/{pid}/task")
+			except OSError:
+				continue
+			for tid in tids:
+				try:
+					with open(f"/proc/{pid}/task/{tid}/sched", "r") as f:
+						for line in f:
+							if line.startswith("se.nr_migrations"):
+								self.migrations[tid] = int(line.split(":")[1])
+					with open(f"/proc/{pid}/task/{tid}/stat", "r") as f:
+						# The CPU the thread last ran on is the 39th field
+						self.cpus.add(int(f.read().rsplit(")", 1)[1].split()[36]))
+				except (OSError, ValueError, IndexError):
+					continue
+		with open("/proc/stat", "r") as f:
+			for line in f:
+				if line.startswith("procs_running"):
+					self.max_running = max(self.max_running, int(line.split()[1]))
+
+	def stop(self):
+		"""
+		Stops sampling and returns the sampled usage
+		"""
+		self.stopped.set()
+		self.thread.join()
+		return {"migrations": sum(self.migrations.values()), "n_cpus_used": len(self.cpus), "max_running": self.max_running}
+
+
+def parse_throughput(line):
+	if 'throughput:' in line:
+		return float(line.split()[1])
+	return None
+
+def run_iso3dfd(n1, n2, n3, NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block, filename, timeout=None, prefix=[], cwd=None, nsteps=NSTEPS,
+		env={}, tracer=None, affinity="balanced", proc_interval=None):
+	"""
+	Launches an ISO3DFD executable directly (optionally wrapped by a prefix command such as cpu_monitor),
+	reads its output as it is streamed through a pipe, and kills the whole process group if it runs
+	for longer than timeout seconds. Threads are placed on cores with the given KMP_AFFINITY type,
+	and env holds additional environment variables.
+	The process is reaped with its resource usage, and /proc is sampled every proc_interval seconds if given.
+	The spawn, execute and parse phases are recorded as spans in the given tracer.
+	"""
+	if tracer == None:
+		tracer = Tracer()
+	cmd = prefix + [os.path.join(BIN_DIR, filename), str(n1), str(n2), str(n3), str(NbTh), str(nsteps),
+		str(n1_thrd_block), str(n2_thrd_block), str(n3_thrd_block)]
+	env = dict(os.environ, KMP_AFFINITY=f"{affinity},granularity=core", **env)
+
+	time0 = time.time()
+	with tracer.span("spawn", binary=filename):
+		proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd, env=env,
+			text=True, start_new_session=True)
+	timed_out = threading.Event()
+	def kill():
+		timed_out.set()
+		os.killpg(proc.pid, signal.SIGKILL)
+	timer = None
+	if timeout != None:
+		timer = threading.Timer(timeout, kill)
+		timer.start()
+	sampler = None
+	if proc_interval != None:
+		sampler = ProcSampler(proc.pid, proc_interval)
+
+	try:
+		with tracer.span("execute", binary=filename, NbTh=NbTh, blocks=[n1_thrd_block, n2_thrd_block, n3_thrd_block],
+				affinity=affinity):
+			lines = list(proc.stdout)
+			_, status, rusage = os.wait4(proc.pid, 0)
+			# Reaped here rather than by Popen, which would not get the resource usage
+			returncode = proc.returncode = os.waitstatus_to_exitcode(status)
+	except BaseException:
+		# The run has its own session, so that it would keep running (and hold its CPUs) after a Ctrl-C or a
+		# cancelled job: its whole process group is killed and reaped
+		if proc.returncode == None:
+			try:
+				os.killpg(proc.pid, signal.SIGKILL)
+			except ProcessLookupError:
+				pass
+			proc.wait()
+		if sampler != None:
+			sampler.stop()
+		raise
+	finally:
+		proc.stdout.close()
+		if timer != None:
+			timer.cancel()
+	wall_time = time.time() - time0
+	usage = read_rusage(rusage)
+	if sampler != None:
+		usage.update(sampler.stop())
+
+	with tracer.span("parse"):
+		throughput = None
+		for line in lines:
+			throughput = parse_throughput(line)
+			if throughput != None:
+				break
+	result = RunResult(throughput, wall_time, returncode, "".join(lines), timed_out.is_set())
+	result.usage = usage
+	return result
+
+def run_energy(n1, n2, n3, NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block, filename, csv_fn, timeout=None,
+		nsteps=NSTEPS, tracer=None, affinity="balanced", proc_interval=None):
+	"""
+	Runs ISO3DFD under cpu_monitor, whose plot command (plot_grp2.sh) moves the power trace to csv_fn,
+	so that concurrent energy measurements do not overwrite each other's traces
+	"""
 	# log into John3 machine from Chome with "su -" command.
-	cmd = f"/opt/cpu_monitor/cpu_monitor.x --csv --plot-cmd=/opt/cpu_monitor/scripts/plot_grp2.sh --quiet --redirect -- {os.path.dirname(os.path.realpath(__file__))}/bin/{filename} {n1} {n2} {n3} {NbTh} 100 {n1_thrd_block} {n2_thrd_block} {n3_thrd_block}"
-	res = subprocess.run(cmd,shell=True,stdout=subprocess.PIPE, cwd="/opt/cpu_monitor/scripts")
-
-# This program makes sense of the information in a CSV file, integrates power measurements and outputs 3 energy values
-def csv_to_energy(csv_path):
-        """takes a csv file from cpu_monitor and return the energy consumed"""
-        idx = pd.Index([],dtype='int64')
-
-        #delete line in csv
-        with open(csv_path,'r') as inp:
-            lines = inp.readlines()
-            ptr = 1
-            with open("/opt/cpu_monitor/scripts/Database_edited2.txt",'w') as out:
-                for line in lines:
-                    if ptr != 3:
-                        out.write(line)
-                    ptr += 1
-
-        #convert txt to csv
-        df = pd.read_csv("/opt/cpu_monitor/scripts/Database_edited2.txt")
-        df.to_csv("/opt/cpu_monitor/scripts/Database_edited2.csv", index=None)
-        df = pd.read_csv("/opt/cpu_monitor/scripts/Database_edited2.csv",sep=';')
-
-        del df[df.columns[-1]] # to delete last column with null values
-        sub_df = df.filter(regex=("^PW_*"))
-        (max_row, max_col) = sub_df.shape
-        for i in range(0, max_col):
-                idx = idx.union(sub_df[sub_df.iloc[:,i].astype(float)>8000.0].index)
-
-
-        df.drop(idx, inplace=True)
-        (max_row, max_col) = df.shape
-        df[df.select_dtypes(include=[np.number]).ge(0).all(1)]
-
-        power_pkg_table = df.filter(regex=("^PW_PKG[0-9]*"))
-        power_dram_table = df.filter(regex=("^PW_DRAM[0-9]*"))
-
-        power_row, power_col = power_pkg_table.shape
-        pkg = power_col
-
-        t  = df['TIME'].to_numpy()
-        t_min = np.min(t)
-        t_max = np.max(t)
-
-        dram_energy = 0.0
-        pkg_energy = 0.0
-        for i in range(0, power_col):
-                dram_energy += np.trapz(power_dram_table.iloc[:,i].to_numpy(),t)/1000.0
-                pkg_energy += np.trapz(power_pkg_table.iloc[:,i].to_numpy(),t)/1000.0
-        return dram_energy,pkg_energy,dram_energy+pkg_energy
+	prefix = [f"{CPU_MONITOR_DIR}/cpu_monitor.x", "--csv", f"--plot-cmd={CPU_MONITOR_DIR}/scripts/plot_grp2.sh",
+		"--quiet", "--redirect", "--"]
+	return run_iso3dfd(n1, n2, n3, NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block, filename, timeout,
+		prefix=prefix, cwd=f"{CPU_MONITOR_DIR}/scripts", nsteps=nsteps, env={"ENERGY_CSV": csv_fn}, tracer=tracer,
+		affinity=affinity, proc_interval=proc_interval)
+
+def csv_to_energy(csv_path, chunksize=ENERGY_CHUNKSIZE):
+	"""
+	Takes a CSV file from cpu_monitor and returns the energy consumed in kJ (DRAM, package, and their sum).
+
+	The trace is read in chunks of rows and integrated in a single pass: samples where any power
+	column exceeds MAX_POWER W are dropped, and the power columns of the remaining samples are
+	integrated over time with the trapezoidal rule, carrying the last sample of each chunk over to
+	the next one
+	"""
+	energy = None
+	last = None
+	# The third line of the trace is not a sample
+	for chunk in pd.read_csv(csv_path, sep=";", skiprows=[2], chunksize=chunksize):
+		power_columns = [name for name in chunk.columns if name.startswith("PW")]
+		t = chunk["TIME"].to_numpy(dtype=float)
+		P = chunk[power_columns].to_numpy(dtype=float)
+		valid = (P <= MAX_POWER).all(axis=1)
+		t, P = t[valid], P[valid]
+		if last != None:
+			t = np.concatenate([[last[0]], t])
+			P = np.concatenate([last[1][None, :], P])
+		if len(t) == 0:
+			continue
+		chunk_energy = ((t[1:] - t[:-1])[:, None]*(P[1:] + P[:-1])/2).sum(axis=0)
+		energy = chunk_energy if energy is None else energy + chunk_energy
+		last = (t[-1], P[-1])
+	if energy is None:
+		raise ValueError(f"No valid power sample in {csv_path}")
+
+	energy = dict(zip(power_columns, energy/1000.0))
+	dram_energy = float(sum(energy[name] for name in power_columns if name.startswith("PW_DRAM")))
+	pkg_energy = float(sum(energy[name] for name in power_columns if name.startswith("PW_PKG")))
+	return dram_energy, pkg_energy, dram_energy + pkg_energy
 
 # uses input parameters to evaluate to get the energy consumption of the program. outputs 3 energy values in kJ (dram energy, package energy, and sum of dram and package energies)
 def run_energy_final(params, n1=512, n2=512, n3=512):
@@ -192,95 +812,532 @@ def run_energy_final(params, n1=512, n2=512, n3=512):
 	n1_thrd_block = params[3]
 	n2_thrd_block = params[4]
 	n3_thrd_block = params[5]
+	affinity = params[6]
 
 	filename = make(Olevel, simd)
-	run_energy(n1, n2, n3, NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block, filename)
-	dram_energy,pkg_energy,combined = csv_to_energy("/opt/cpu_monitor/scripts/current_csv.csv")
+	with tempfile.TemporaryDirectory(prefix="energy_") as tmp_dir:
+		csv_fn = os.path.join(tmp_dir, "trace.csv")
+		result = run_energy(n1, n2, n3, NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block, filename, csv_fn, affinity=affinity)
+		if result.returncode != 0:
+			print(result.output)
+			raise RuntimeError(f"Energy measurement of {params} failed (exit status {result.returncode})")
+		dram_energy,pkg_energy,combined = csv_to_energy(csv_fn)
 	return dram_energy,pkg_energy,combined
 
-def parse_output():
-	with open('output.txt', 'r') as f:
-		line_list = f.readlines()
-		for line in line_list:
-			if 'throughput:' in line:
-				a = float(line.split()[1])
-				cmd = "rm ./output.txt"
-				res = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE)
-				return a
-	print("Error parsing output")
-	print(*line_list, end="\n")
-	raise ValueError
-
-def run(params, n1=512, n2=512, n3=512):
+def run(params, n1=512, n2=512, n3=512, timeout=None, nsteps=NSTEPS, energy=False, proc_interval=None):
+	"""
+	Runs a configuration and returns its RunResult. A run killed by the timeout is given a zero
+	throughput, as the worst possible configuration, while any other run without throughput is an error.
+	With energy, the run is made under cpu_monitor, which measures its energy consumption along with its throughput.
+	The spans of the phases of the run are returned in the spans attribute of the RunResult, and its
+	resource usage in the usage attribute, with /proc sampled every proc_interval seconds if given.
+	"""
 	Olevel = params[0]
 	simd = params[1]
 	NbTh = params[2]
 	n1_thrd_block = params[3]
 	n2_thrd_block = params[4]
 	n3_thrd_block = params[5]
+	affinity = params[6]
 
-	filename = make(Olevel, simd)
-	run_iso3dfd(n1, n2, n3, NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block, filename)
-	throughput = parse_output()
-	return throughput
+	tracer = Tracer()
+	with tracer.span("make", Olevel=Olevel, simd=simd):
+		filename = make(Olevel, simd)
+	if energy:
+		with tempfile.TemporaryDirectory(prefix="energy_") as tmp_dir:
+			csv_fn = os.path.join(tmp_dir, "trace.csv")
+			result = run_energy(n1, n2, n3, NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block, filename, csv_fn, timeout, nsteps,
+				tracer, affinity, proc_interval)
+			if not result.timed_out and result.returncode == 0:
+				with tracer.span("energy"):
+					result.dram_energy, result.pkg_energy, result.energy = csv_to_energy(csv_fn)
+	else:
+		result = run_iso3dfd(n1, n2, n3, NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block, filename, timeout, nsteps=nsteps,
+			tracer=tracer, affinity=affinity, proc_interval=proc_interval)
+	result.spans = tracer.spans
+	if result.timed_out:
+		print(f"Run of {params} killed after {timeout} s")
+		result.throughput = 0.0
+	elif result.throughput == None:
+		print("Error parsing output")
+		print(result.output)
+		raise ValueError(f"No throughput in output of {params} (exit status {result.returncode})")
+	return result
 
 
-def neighborhood(params, n1, n2, n3):
-	Olevel = params[0]
-	simd = params[1]
-	NbTh = params[2]
-	n1_thrd_block = params[3]
-	n2_thrd_block = params[4]
-	n3_thrd_block = params[5]
+def cpu_partitions(n_slots):
+	"""
+	Splits the CPUs available to this process into n_slots disjoint partitions of equal size.
+	Partitions are made of whole physical cores, with all their SMT siblings, so that concurrent runs never
+	share a core, and cores are ordered by NUMA node, so that with one slot per socket each slot gets its
+	own socket.
+	"""
+	cores = {}
+	for cpu, core, socket, node in Topology.detect().cpus:
+		cores.setdefault((node, socket, core), []).append(cpu)
+	cores = [cores[key] for key in sorted(cores)]
+
+	size = len(cores) // n_slots
+	if size == 0:
+		raise ValueError(f"Cannot split {len(cores)} cores into {n_slots} slots")
+	return [sorted(cpu for cpus in cores[i*size:(i+1)*size] for cpu in cpus) for i in range(n_slots)]
+
+def slot_topology(n_slots):
+	"""
+	Topology of the CPUs that run a configuration when the machine is split into n_slots slots
+	"""
+	if n_slots > 1:
+		return Topology.detect(cpu_partitions(n_slots)[0])
+	return Topology.detect()
+
+def pin_worker(partitions):
+	"""
+	Pool initializer: binds the worker, and thus every ISO3DFD process it spawns, to a free partition
+	"""
+	os.sched_setaffinity(0, partitions.get())
+
+
+# Two-sided 95% quantiles of the Student t distribution for 1 to 30 degrees of freedom
+T_95 = [12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228, 2.201, 2.179, 2.160, 2.145, 2.131,
+	2.120, 2.110, 2.101, 2.093, 2.086, 2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042]
+
+# Lower bound of the scale of outlier rejection relative to the median, since the median absolute deviation
+# of mostly identical samples is 0
+MAD_FLOOR = 0.01
+
+OBJECTIVES = ["throughput", "energy", "edp", "weighted"]
+
+class Objective:
+	"""
+	Quantity maximized by the optimization algorithms, computed from the samples of a configuration:
+	- throughput: MPoints/s
+	- energy: minus the energy consumed by the run, in kJ
+	- edp: minus the energy-delay product of the run (energy times wall time), in kJ.s
+	- weighted: weight*ln(MPoints/s) - (1 - weight)*ln(kJ), trading relative throughput for relative energy
+
+	Objectives other than throughput, and the Pareto mode which tracks the configurations that no other
+	beats on both throughput and energy, measure the energy of every run. Their samples are then
+	{"throughput", "energy", "time"} dictionaries instead of throughputs, and runs without energy
+	(killed by the timeout) are scored -inf.
+	"""
+	def __init__(self, name="throughput", weight=0.5, pareto=False):
+		if name not in OBJECTIVES:
+			raise ValueError(f"Invalid objective: {name} not in {OBJECTIVES}")
+		self.name = name
+		self.weight = weight
+		self.pareto = pareto
+		self.needs_energy = name != "throughput" or pareto
+
+	def describe(self):
+		if self.name == "weighted":
+			return f"weighted({self.weight})"
+		return self.name
+
+	@staticmethod
+	def parse(description):
+		"""
+		Inverse of describe
+		"""
+		if description.startswith("weighted("):
+			return Objective("weighted", float(description[len("weighted("):-1]))
+		return Objective(description)
+
+	@property
+	def label(self):
+		return {"throughput": "Throughput (MPoints/s)", "energy": "Energy (-kJ)", "edp": "Energy-delay product (-kJ.s)",
+			"weighted": f"Weighted objective ({self.weight})"}[self.name]
+
+	@property
+	def unit(self):
+		return {"throughput": "MPoints/s", "energy": "-kJ", "edp": "-kJ.s", "weighted": ""}[self.name]
+
+	def sample(self, result):
+		"""
+		Sample of a RunResult, as saved in the cache and checkpoints
+		"""
+		if not self.needs_energy:
+			return result.throughput
+		return {"throughput": result.throughput, "energy": result.energy, "time": result.wall_time}
+
+	def score(self, sample):
+		if not isinstance(sample, dict):
+			return sample
+		if self.name == "throughput":
+			return sample["throughput"]
+		if sample["energy"] == None or sample["throughput"] <= 0:
+			return float("-inf")
+		if self.name == "energy":
+			return -sample["energy"]
+		if self.name == "edp":
+			return -sample["energy"]*sample["time"]
+		return self.weight*math.log(sample["throughput"]) - (1 - self.weight)*math.log(sample["energy"])
+
+	def scale(self, samples):
+		"""
+		Factor of the temperatures and tunneling energies of the annealers, which are given in MPoints/s, computed
+		from the samples of the start configuration: the ratio of its score to its throughput, so that a move
+		losing a given fraction of the start value is as likely to be accepted under every objective. Differences
+		of the weighted objective are already relative, so its scale is 1/throughput.
+		"""
+		if self.name == "throughput":
+			return 1.0
+		samples = [sample for sample in samples if math.isfinite(self.score(sample))]
+		if len(samples) == 0:
+			return 1.0
+		throughput = sum(sample["throughput"] for sample in samples)/len(samples)
+		if self.name == "weighted":
+			return 1/throughput
+		score = sum(self.score(sample) for sample in samples)/len(samples)
+		return abs(score)/throughput if score != 0 else 1.0
+
+
+class Interference:
+	"""
+	Detects samples disturbed by other activity on the machine, from the resource usage of their run:
+	- more than max_switches involuntary context switches per second and per thread: threads were preempted
+	  by other tasks, while OpenMP threads on dedicated cores are not
+	- major page faults: pages were read from disk during the run, e.g. a binary evicted from the page cache
+	- with /proc sampling (every proc_interval seconds), more than max_migrations CPU migrations per thread,
+	  while threads are bound to cores
+	Disturbed samples are discarded and re-measured, up to max_remeasure times per sample (0 to only flag them),
+	after which the last one is kept and flagged.
+	"""
+	def __init__(self, max_remeasure=2, max_switches=100.0, max_migrations=1.0, proc_interval=None):
+		self.max_remeasure = max_remeasure
+		self.max_switches = max_switches
+		self.max_migrations = max_migrations
+		self.proc_interval = proc_interval
+
+	def check(self, result, NbTh):
+		"""
+		Reason why a RunResult was disturbed, None if it was not or its usage is unknown
+		"""
+		usage = result.usage
+		if usage == None or result.timed_out:
+			return None
+		# Rate over at least a second, so that the few switches of process startup do not flag short runs
+		switches = usage["involuntary_switches"]/max(result.wall_time, 1.0)/NbTh
+		if switches > self.max_switches:
+			return f"{switches:.0f} involuntary context switches/s per thread"
+		if usage["major_faults"] > 0:
+			return f"{usage['major_faults']} major page faults"
+		if usage.get("migrations") != None and usage["migrations"]/NbTh > self.max_migrations:
+			return f"{usage['migrations']/NbTh:.1f} CPU migrations per thread"
+		return None
+
+
+class Measurement:
+	"""
+	Repeated samples of one configuration, scored by the objective (throughput by default) and summarized
+	by a robust mean and the half-width of its 95% confidence interval. Scores further than 3 scaled
+	median absolute deviations (at least MAD_FLOOR of the median) from the median are rejected as outliers
+	before averaging.
+
+	An aborted measurement holds the throughput extrapolated from a short racing probe.
+	Samples come with the resource usage of their run (None when unknown, such as for cached samples),
+	and n_interfered counts the disturbed samples that were discarded (see Interference).
+	"""
+	def __init__(self, samples, aborted=False, objective=None, usages=None, n_interfered=0):
+		self.samples = samples
+		self.aborted = aborted
+		self.n = len(samples)
+		self.usages = usages if usages != None else [None]*len(samples)
+		self.n_interfered = n_interfered
+		if objective != None:
+			x = np.array([objective.score(sample) for sample in samples], dtype=float)
+		else:
+			x = np.array(samples, dtype=float)
+		if len(x) >= 3 and np.isfinite(np.median(x)):
+			median = np.median(x)
+			mad = max(1.4826*np.median(np.abs(x - median)), MAD_FLOOR*abs(median))
+			x = x[np.abs(x - median) <= 3*mad]
+		self.n_outliers = self.n - len(x)
+		self.mean = float(np.mean(x))
+		if len(x) > 1:
+			t = T_95[len(x) - 2] if len(x) - 1 <= len(T_95) else 1.96
+			self.ci = float(t*np.std(x, ddof=1)/math.sqrt(len(x)))
+		else:
+			self.ci = float("nan")
+
+	def usage(self):
+		"""
+		Mean resource usage of the samples (see USAGE_FIELDS), and the number of kept samples flagged as disturbed,
+		None for fields no sample has
+		"""
+		usages = [usage for usage in self.usages if usage != None]
+		mean = {}
+		for name in USAGE_FIELDS:
+			values = [usage[name] for usage in usages if usage.get(name) != None]
+			mean[name] = float(np.mean(values)) if len(values) > 0 else None
+		mean["n_flagged"] = sum(usage.get("interfered") != None for usage in usages) if len(usages) > 0 else None
+		return mean
+
+
+class Evaluator:
+	"""
+	Measures the throughput of configurations for a given problem size, going through the
+	measurement cache when one is given.
+
+	With a single slot, configurations are run one at a time on the whole machine. With several
+	slots, batches are run concurrently on a process pool whose workers are each pinned to their
+	own partition of cores (one socket per slot on a 2-socket node with 2 slots), so that
+	concurrent measurements do not interfere. Results are always returned in input order.
+	The topology of the CPUs of a slot determines the thread counts and placements of the search space.
+
+	Each configuration is sampled sequentially: at least min_samples runs, then more until the
+	confidence interval is within rel_ci of the mean or max_samples runs were made.
+
+	With racing enabled, new configurations are first run for race_steps time steps only, and
+	aborted if even race_margin above their extrapolated throughput they would lose to the
+	lower bound of the best measurement so far.
+
+	Configurations are scored by the given objective, throughput by default. Racing extrapolates
+	throughputs, so it is only available with the throughput objective without Pareto mode.
+
+	With a coordinator (see distributed.Coordinator), runs are dispatched to remote workers instead
+	of the local machine, and n_slots only sets the batch size of the algorithms that choose one.
+	Workers are assumed to run on nodes with the same topology as the local one.
+
+	Samples disturbed by other activity on the machine are detected from the resource usage of their run
+	and re-measured, following the given interference policy (see Interference).
+	"""
+	def __init__(self, n1, n2, n3, n_slots=1, cache=None, timeout=None, min_samples=1, max_samples=1, rel_ci=0.02,
+			race_steps=None, race_margin=0.1, checkpoint=None, objective=None, coordinator=None, interference=None):
+		if objective == None:
+			objective = Objective()
+		if interference == None:
+			interference = Interference()
+		if race_steps != None and objective.needs_energy:
+			raise ValueError("Racing is only available for the throughput objective without Pareto mode")
+		self.n1 = n1
+		self.n2 = n2
+		self.n3 = n3
+		self.n_slots = n_slots
+		self.cache = cache
+		self.timeout = timeout
+		self.min_samples = min_samples
+		self.max_samples = max(min_samples, max_samples)
+		self.rel_ci = rel_ci
+		self.race_steps = race_steps
+		self.race_margin = race_margin
+		self.nsteps = NSTEPS
+		self.checkpoint = checkpoint
+		self.objective = objective
+		self.coordinator = coordinator
+		self.interference = interference
+		self.measurements = {}
+		self.best_key = None
+		self.n_aborted = 0
+		self.n_interfered = 0
+		self.tracer = Tracer()
+		self.pool = None
+		if n_slots > 1 and coordinator == None:
+			partitions = cpu_partitions(n_slots)
+			self.n_cpus = len(partitions[0])
+			self.topology = slot_topology(n_slots)
+			queue = multiprocessing.Queue()
+			for cpus in partitions:
+				queue.put(cpus)
+			self.pool = ProcessPoolExecutor(max_workers=n_slots, initializer=pin_worker, initargs=(queue,))
+		else:
+			self.n_cpus = len(os.sched_getaffinity(0))
+			self.topology = Topology.detect()
+
+	@property
+	def adaptive(self):
+		return self.max_samples > 1
+
+	def key(self, S):
+		# The binary is built here, before the configuration is run, so this is where build time is spent
+		with self.tracer.span("make", Olevel=S[0], simd=S[1]):
+			filename = make(S[0], S[1])
+			identity = binary_id(filename)
+		key = [self.n1, self.n2, self.n3, self.nsteps, *S, identity, self.n_cpus]
+		if self.objective.needs_energy:
+			# Samples with energy are kept apart from throughput-only ones
+			key.append("energy")
+		return json.dumps(key)
+
+	def derive(self, n1, n2, n3, nsteps=NSTEPS):
+		"""
+		Returns an evaluator of configurations at another fidelity (problem size and number of time steps),
+		sharing the pool, cache and sampling policy of this one. Only the original evaluator should be closed.
+		"""
+		evaluator = copy.copy(self)
+		evaluator.n1 = n1
+		evaluator.n2 = n2
+		evaluator.n3 = n3
+		evaluator.nsteps = nsteps
+		evaluator.race_steps = None
+		evaluator.measurements = {}
+		evaluator.best_key = None
+		evaluator.n_aborted = 0
+		evaluator.n_interfered = 0
+		return evaluator
+
+	def evaluate(self, S):
+		return self.evaluate_batch([S])[0]
+
+	def evaluate_batch(self, S_list):
+		return [measurement.mean for measurement in self.measure_batch(S_list, self.min_samples)]
+
+	def refine(self, S_list):
+		"""
+		Re-measures configurations up to the sample limit and returns their updated mean scores
+		"""
+		return [measurement.mean for measurement in self.measure_batch(S_list, self.max_samples)]
+
+	def lookup(self, S):
+		return self.measurements.get(self.key(S))
+
+	def needs_sample(self, key, min_samples):
+		measurement = self.measurements.get(key)
+		if measurement == None:
+			return True
+		# Aborted measurements are final: their probe cannot be merged with samples of full runs
+		if measurement.aborted:
+			return False
+		if measurement.n < min_samples:
+			return True
+		if measurement.n >= self.max_samples:
+			return False
+		return not (measurement.ci <= self.rel_ci*measurement.mean)
+
+	def measure_batch(self, S_list, min_samples):
+		"""
+		Samples every distinct configuration of the batch until it satisfies the sampling policy.
+		Each round runs one more sample of every configuration that still needs one, concurrently.
+		The resulting measurements are journaled in the checkpoint, or taken from it when resuming.
+		"""
+		keys = [self.key(S) for S in S_list]
+		if self.checkpoint != None and self.checkpoint.replaying:
+			entry = self.checkpoint.replay(S_list)
+			# Entries journaled before resource accounting have no usage
+			usages = entry.get("usages", [None]*len(keys))
+			interfered = entry.get("interfered", [0]*len(keys))
+			for key, samples, aborted, usage, n_interfered in zip(keys, entry["samples"], entry["aborted"], usages, interfered):
+				self.measurements[key] = Measurement(samples, aborted, self.objective, usage, n_interfered)
+				self.n_aborted += aborted
+				self.n_interfered += n_interfered
+			self.update_best(keys)
+			return [self.measurements[key] for key in keys]
+
+		configs = {}
+		with self.tracer.span("cache", operation="get"):
+			for key, S in zip(keys, S_list):
+				if key in configs:
+					continue
+				configs[key] = S
+				if self.cache != None:
+					samples = self.cache.get(key)
+					if samples != None:
+						self.measurements[key] = Measurement(samples, objective=self.objective)
+					elif key in self.measurements and not self.measurements[key].aborted:
+						del self.measurements[key]
+
+		todo = [key for key in configs if self.needs_sample(key, min_samples)]
+		if self.race_steps != None and self.best_key != None:
+			todo = self.race([key for key in todo if key not in self.measurements], configs) \
+				+ [key for key in todo if key in self.measurements]
+		# Number of disturbed runs discarded for the next sample of each configuration
+		discarded = {}
+		while len(todo) > 0:
+			results = self.run_batch([configs[key] for key in todo])
+			for key, result in zip(todo, results):
+				reason = self.interference.check(result, configs[key][2])
+				if result.usage != None:
+					result.usage["interfered"] = reason
+				if reason != None and discarded.get(key, 0) < self.interference.max_remeasure:
+					print(f"Re-measuring {configs[key]}: {reason}")
+					discarded[key] = discarded.get(key, 0) + 1
+					self.n_interfered += 1
+					continue
+				samples = [self.objective.sample(result)]
+				usages = [result.usage]
+				n_interfered = discarded.pop(key, 0)
+				if key in self.measurements:
+					samples = self.measurements[key].samples + samples
+					usages = self.measurements[key].usages + usages
+					n_interfered += self.measurements[key].n_interfered
+				self.measurements[key] = Measurement(samples, objective=self.objective, usages=usages, n_interfered=n_interfered)
+				if self.cache != None:
+					with self.tracer.span("cache", operation="put"):
+						self.cache.put(key, samples)
+			todo = [key for key in todo if self.needs_sample(key, min_samples)]
+
+		self.update_best(configs)
+		measurements = [self.measurements[key] for key in keys]
+		if self.checkpoint != None:
+			with self.tracer.span("checkpoint"):
+				self.checkpoint.append(S_list, measurements)
+		return measurements
+
+	def update_best(self, keys):
+		for key in keys:
+			measurement = self.measurements[key]
+			if not measurement.aborted and (self.best_key == None or measurement.mean > self.measurements[self.best_key].mean):
+				self.best_key = key
+
+	def pareto_front(self):
+		"""
+		Measured configurations that no other one beats on both mean throughput and mean energy,
+		as (S, throughput, energy) tuples sorted by throughput
+		"""
+		points = []
+		for key, measurement in self.measurements.items():
+			samples = [sample for sample in measurement.samples if isinstance(sample, dict) and sample["energy"] != None]
+			if measurement.aborted or len(samples) == 0:
+				continue
+			S = json.loads(key)[4:4 + len(STORE_COLUMNS)]
+			points.append((S, float(np.mean([sample["throughput"] for sample in samples])),
+				float(np.mean([sample["energy"] for sample in samples]))))
+		front = [p for p in points if not any(q[1] >= p[1] and q[2] <= p[2] and (q[1] > p[1] or q[2] < p[2]) for q in points)]
+		return sorted(front, key=lambda p: p[1])
+
+	def race(self, todo, configs):
+		"""
+		Runs short probes of new configurations, aborts those that are certain to lose to the best
+		measurement so far and returns the keys of the ones that should be measured in full
+		"""
+		best = self.measurements[self.best_key]
+		threshold = best.mean - (best.ci if best.ci == best.ci else 0.0)
+		results = self.run_batch([configs[key] for key in todo], self.race_steps)
+		survivors = []
+		for key, result in zip(todo, results):
+			if result.throughput*(1 + self.race_margin) < threshold:
+				print(f"Aborted {configs[key]} at {result.throughput} MPoints/s after {self.race_steps} steps")
+				self.measurements[key] = Measurement([result.throughput], aborted=True)
+				self.n_aborted += 1
+			else:
+				survivors.append(key)
+		return survivors
+
+	def run_batch(self, S_list, nsteps=None):
+		"""
+		Runs configurations once each and collects the spans of their phases into the tracer
+		"""
+		if nsteps == None:
+			nsteps = self.nsteps
+		energy = self.objective.needs_energy
+		proc_interval = self.interference.proc_interval
+		if self.coordinator != None:
+			futures = [self.coordinator.submit(S, self.n1, self.n2, self.n3, self.timeout, nsteps, energy, proc_interval)
+				for S in S_list]
+			results = [future.result() for future in futures]
+		elif self.pool == None:
+			results = [run(S, self.n1, self.n2, self.n3, self.timeout, nsteps, energy, proc_interval) for S in S_list]
+		else:
+			futures = [self.pool.submit(run, S, self.n1, self.n2, self.n3, self.timeout, nsteps, energy, proc_interval)
+				for S in S_list]
+			results = [future.result() for future in futures]
+		for result in results:
+			self.tracer.add(result.spans)
+		return results
 
-	neighbors = []
-
-	# Olevel
-	if Olevel == "O3":
-		neighbors.append(["Ofast", simd, NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-	elif Olevel == "Ofast":
-		neighbors.append(["O3", simd, NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-
-	# simd
-	if simd == "avx":
-		neighbors.append([Olevel, "avx2", NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-		neighbors.append([Olevel, "avx512", NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-		neighbors.append([Olevel, "sse", NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-	elif simd == "avx2":
-		neighbors.append([Olevel, "avx", NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-		neighbors.append([Olevel, "avx512", NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-		neighbors.append([Olevel, "sse", NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-	elif simd == "avx512":
-		neighbors.append([Olevel, "avx2", NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-		neighbors.append([Olevel, "avx", NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-		neighbors.append([Olevel, "sse", NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-	elif simd == "sse":
-		neighbors.append([Olevel, "avx2", NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-		neighbors.append([Olevel, "avx512", NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-		neighbors.append([Olevel, "avx", NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-
-	# NbTh
-	if NbTh == 16:
-		neighbors.append([Olevel, simd, 16, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-	if NbTh == 32:
-		neighbors.append([Olevel, simd, 32, n1_thrd_block, n2_thrd_block, n3_thrd_block])
-
-	# n1_thrd_block
-	if n1_thrd_block > 16:
-		neighbors.append([Olevel, simd, NbTh, n1_thrd_block - 16, n2_thrd_block, n3_thrd_block])
-	if n1_thrd_block < n1:
-		neighbors.append([Olevel, simd, NbTh, n1_thrd_block + 16, n2_thrd_block, n3_thrd_block])
-
-	# n2_thrd_block
-	if n2_thrd_block > 1:
-		neighbors.append([Olevel, simd, NbTh, n1_thrd_block, n2_thrd_block - 1, n3_thrd_block])
-	if n2_thrd_block < n2:
-		neighbors.append([Olevel, simd, NbTh, n1_thrd_block, n2_thrd_block + 1, n3_thrd_block])
-
-	# n3_thrd_block
-	if n3_thrd_block > 1:
-		neighbors.append([Olevel, simd, NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block - 1])
-	if n3_thrd_block < n3:
-		neighbors.append([Olevel, simd, NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block + 1])
-
-	return neighbors
+	def close(self):
+		if self.pool != None:
+			self.pool.shutdown()
+			self.pool = None
+		if self.coordinator != None:
+			self.coordinator.close()
+			self.coordinator = None
@@ -0,0 +1,276 @@
+import json
+import time
+import socket
+import threading
+import collections
+import socketserver
+import multiprocessing
+from concurrent.futures import Future, ProcessPoolExecutor
+import numpy as np
+
+from common import RunResult, run, cpu_partitions, pin_worker
+from space import SearchSpace
+
+
+class Server(socketserver.ThreadingTCPServer):
+	allow_reuse_address = True
+	daemon_threads = True
+
+
+class Handler(socketserver.StreamRequestHandler):
+	def handle(self):
+		self.server.coordinator.serve(self)
+
+
+class Coordinator:
+	"""
+	Work queue of ISO3DFD evaluations served over TCP to worker processes (main.py worker), typically
+	one per node, which the Evaluator uses instead of running configurations locally.
+
+	Messages are JSON lines. A worker opens one connection per slot and introduces itself with its
+	node name, after which the coordinator sends it one evaluation at a time, whenever it is idle.
+	The worker runs it with its local binaries and sends back its RunResult, and sends heartbeats in
+	the meantime. A connection that is closed or silent for more than 3 heartbeat intervals is
+	considered lost, and its evaluation is put back at the front of the queue for another worker.
+
+	Each node is calibrated when it first connects, by running the default configuration
+	calibration_runs times. Throughputs measured on a node are then scaled by the ratio of the median
+	reference throughput of the first calibrated node to its own, so that identical nodes running at
+	slightly different speeds give comparable measurements.
+	"""
+	def __init__(self, port, n1, n2, n3, host="", heartbeat=5.0, calibration_runs=3):
+		self.n1 = n1
+		self.n2 = n2
+		self.n3 = n3
+		self.heartbeat = heartbeat
+		self.calibration_runs = calibration_runs
+		self.reference = SearchSpace(n1, n2, n3).default()
+		self.reference_throughput = None
+		self.pending = collections.deque()
+		self.condition = threading.Condition()
+		self.next_id = 0
+		self.nodes = {}
+		self.closed = False
+
+		self.server = Server((host, port), Handler)
+		self.server.coordinator = self
+		self.port = self.server.server_address[1]
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+		print(f"Waiting for workers on port {self.port}")
+
+	def submit(self, S, n1, n2, n3, timeout, nsteps, energy, proc_interval=None):
+		"""
+		Queues an evaluation and returns a Future of its RunResult
+		"""
+		future = Future()
+		with self.condition:
+			task = {"id": self.next_id, "S": S, "n1": n1, "n2": n2, "n3": n3, "timeout": timeout, "nsteps": nsteps,
+				"energy": energy, "proc_interval": proc_interval}
+			self.next_id += 1
+			self.pending.append((task, future))
+			self.condition.notify()
+		return future
+
+	def next_task(self):
+		with self.condition:
+			while len(self.pending) == 0 and not self.closed:
+				self.condition.wait()
+			if self.closed:
+				return None, None
+			return self.pending.popleft()
+
+	def serve(self, handler):
+		"""
+		Serves the connection of one worker slot until it is lost or the coordinator is closed
+		"""
+		handler.connection.settimeout(3*self.heartbeat)
+		def send(message):
+			handler.wfile.write((json.dumps(message) + "\n").encode())
+		def receive():
+			# Skips heartbeats, which only keep the connection from timing out
+			while True:
+				line = handler.rfile.readline()
+				if not line:
+					raise ConnectionError("connection closed")
+				message = json.loads(line)
+				if message["type"] != "heartbeat":
+					return message
+
+		node = None
+		task = None
+		try:
+			node = receive()["node"]
+			send({"type": "welcome", "heartbeat": self.heartbeat})
+			self.calibrate(node, send, receive)
+			while True:
+				task, future = self.next_task()
+				if task == None:
+					return
+				send(task)
+				message = receive()
+				self.resolve(node, task, future, message)
+				task = None
+		except (OSError, ValueError, KeyError) as e:
+			if task != None:
+				print(f"Lost worker on {node} ({e}), re-dispatching {task['S']}")
+				with self.condition:
+					self.nodes[node]["n_lost"] += 1
+					self.pending.appendleft((task, future))
+					self.condition.notify()
+
+	def calibrate(self, node, send, receive):
+		"""
+		Measures the reference configuration on a new node, or waits until another connection of the node did
+		"""
+		while True:
+			with self.condition:
+				info = self.nodes.get(node)
+				if info == None:
+					info = {"factor": None, "calibrated": threading.Event(), "n_tasks": 0, "n_lost": 0}
+					self.nodes[node] = info
+					break
+			info["calibrated"].wait()
+			if info["factor"] != None:
+				return
+
+		try:
+			samples = []
+			for i in range(self.calibration_runs):
+				send({"id": -1 - i, "S": self.reference, "n1": self.n1, "n2": self.n2, "n3": self.n3, "timeout": None,
+					"nsteps": None, "energy": False})
+				message = receive()
+				if message["type"] == "error":
+					raise ValueError(f"calibration failed: {message['message']}")
+				samples.append(message["throughput"])
+			factor = 1.0
+			if len(samples) > 0:
+				throughput = float(np.median(samples))
+				with self.condition:
+					if self.reference_throughput == None:
+						self.reference_throughput = throughput
+					factor = self.reference_throughput/throughput
+				print(f"Calibrated {node}: {throughput} MPoints/s with {self.reference}, scaling factor {factor:.4f}")
+			info["factor"] = factor
+		except (OSError, ValueError, KeyError):
+			# Another connection of the node will calibrate it
+			with self.condition:
+				del self.nodes[node]
+			raise
+		finally:
+			info["calibrated"].set()
+
+	def resolve(self, node, task, future, message):
+		if message["id"] != task["id"]:
+			raise ValueError(f"expected the result of evaluation {task['id']}, got {message['id']}")
+		info = self.nodes[node]
+		info["n_tasks"] += 1
+		if message["type"] == "error":
+			future.set_exception(RuntimeError(f"Evaluation of {task['S']} on {node} failed: {message['message']}"))
+			return
+		result = RunResult(message["throughput"], message["wall_time"], message["returncode"], message["output"],
+			message["timed_out"])
+		result.dram_energy = message["dram_energy"]
+		result.pkg_energy = message["pkg_energy"]
+		result.energy = message["energy"]
+		result.spans = [{**span, "args": {**span["args"], "node": node}} for span in message["spans"]]
+		result.usage = message.get("usage")
+		if result.throughput != None:
+			result.throughput *= info["factor"]
+		future.set_result(result)
+
+	def stats(self):
+		return {node: {"factor": info["factor"], "n_tasks": info["n_tasks"], "n_lost": info["n_lost"]}
+			for node, info in self.nodes.items()}
+
+	def close(self):
+		with self.condition:
+			self.closed = True
+			self.condition.notify_all()
+		self.server.shutdown()
+		self.server.server_close()
+
+
+def serve_connection(sock, name, pool):
+	"""
+	Runs the evaluations sent by the coordinator on one connection, until it is closed
+	"""
+	lock = threading.Lock()
+	def send(message):
+		with lock:
+			sock.sendall((json.dumps(message) + "\n").encode())
+	rfile = sock.makefile("r")
+	send({"type": "hello", "node": name})
+	welcome = json.loads(rfile.readline())
+
+	stop = threading.Event()
+	def beat():
+		while not stop.wait(welcome["heartbeat"]):
+			try:
+				send({"type": "heartbeat"})
+			except OSError:
+				return
+	threading.Thread(target=beat, daemon=True).start()
+
+	try:
+		for line in rfile:
+			task = json.loads(line)
+			args = [task["S"], task["n1"], task["n2"], task["n3"], task["timeout"]]
+			if task["nsteps"] != None:
+				args.append(task["nsteps"])
+			kwargs = {"energy": task["energy"], "proc_interval": task.get("proc_interval")}
+			try:
+				if pool == None:
+					result = run(*args, **kwargs)
+				else:
+					result = pool.submit(run, *args, **kwargs).result()
+			except (ValueError, RuntimeError) as e:
+				send({"type": "error", "id": task["id"], "message": str(e)})
+				continue
+			except Exception as e:
+				# Only fails this evaluation: losing the connection would have the coordinator send it again forever
+				send({"type": "error", "id": task["id"], "message": repr(e)})
+				continue
+			send({"type": "result", "id": task["id"], "throughput": result.throughput, "wall_time": result.wall_time,
+				"returncode": result.returncode, "output": result.output, "timed_out": result.timed_out,
+				"dram_energy": result.dram_energy, "pkg_energy": result.pkg_energy, "energy": result.energy,
+				"spans": result.spans, "usage": result.usage})
+	finally:
+		stop.set()
+		sock.close()
+
+
+def worker(host, port, n_slots=1, name=None, retry=5.0):
+	"""
+	Serves evaluations to the coordinator at host:port with n_slots concurrent connections, each running
+	its configurations pinned to its own partition of cores when there are several. Workers outlive
+	coordinators: a lost connection is retried every retry seconds, so that a worker started once on
+	a node serves successive optimizations.
+	"""
+	if name == None:
+		name = socket.gethostname()
+	pool = None
+	if n_slots > 1:
+		queue = multiprocessing.Queue()
+		for cpus in cpu_partitions(n_slots):
+			queue.put(cpus)
+		pool = ProcessPoolExecutor(max_workers=n_slots, initializer=pin_worker, initargs=(queue,))
+
+	def loop():
+		while True:
+			try:
+				sock = socket.create_connection((host, port))
+			except OSError:
+				time.sleep(retry)
+				continue
+			print(f"Connected to {host}:{port} as {name}")
+			try:
+				serve_connection(sock, name, pool)
+			except (OSError, ValueError) as e:
+				print(f"Connection to {host}:{port} lost ({e})")
+			time.sleep(retry)
+
+	threads = [threading.Thread(target=loop, daemon=True) for _ in range(n_slots)]
+	for thread in threads:
+		thread.start()
+	for thread in threads:
+		thread.join()
@@ -1,8 +1,103 @@
+import os
+import sys
+import json
 import argparse
+import random
+from datetime import datetime
+
+import client
+
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] in client.COMMANDS:
+    # Commands of the tuning service client are run before the heavy imports below, so that they start in milliseconds
+    sys.exit(client.main(sys.argv[1:]))
+
 import matplotlib.pyplot as plt
 
-from algorithms import Greedy, SimulatedAnnealing, TabuSA, TunnelingSA, LAHC
-from common import Result, run_energy_final
+from algorithms import Greedy, SimulatedAnnealing, TabuSA, TunnelingSA, LAHC, Hyperband, BayesianOptimization, \
+    ParallelTempering, GeneticAlgorithm, VariableNeighborhoodSearch, Sweep
+from common import Result, EvalCache, Evaluator, Objective, Interference, OBJECTIVES, Checkpoint, new_checkpoint, get_store, \
+    run_energy_final, build, slot_topology, cpu_partitions, RESULTS_DIR, CHECKPOINT_DIR, STORE_COLUMNS
+from space import SearchSpace, OLEVELS, SIMDS
+from topology import AFFINITIES
+from warmstart import WarmStart
+from distributed import Coordinator, worker
+from benchmark import LANDSCAPES, run_benchmark, summarize, compare
+from analytics import TrialSet, export
+from campaign import Campaign
+from serve import TuningService
+
+
+# The budget of an algorithm is counted in its own steps
+K_HELP = "Budget of the algorithm: iterations for sa, tabu_sa, tunnel_sa and lahc (one evaluation each), ghc (one\
+          batch of neighbors each) and pt (one evaluation per replica each), generations for ga (one evaluation per\
+          individual each), evaluations for bo and vns, configurations for sweep, and full-fidelity evaluations for\
+          hyperband, whose low-fidelity evaluations count as fractions of one"
+
+
+def add_algorithm_arguments(parser):
+    """
+    Parameters of the optimization algorithms, shared by the optimize and benchmark commands
+    """
+    parser.add_argument("-T0", help="Initial temperature for Simulated Annealing", type=float, default=100)
+    parser.add_argument("-decay", help="Decay function for Simulated Annealing", type=str, default="geometric")
+    parser.add_argument("-tabu", help="Tabu list size", type=int, default=5)
+    parser.add_argument("-cost", help="Cost function for Tunneling", type=str, default="stochastic")
+    parser.add_argument("-Etunnel", help="Tunneling energy", type=float, default=0.0)
+    parser.add_argument("-Lh", help="List size for LAHC", type=int, default=10)
+    parser.add_argument("-eta", help="Fraction of configurations (1/eta) promoted between fidelities in Hyperband",
+                        type=int, default=3)
+    parser.add_argument("-min_fidelity", help="Lowest fidelity used by Hyperband, relative to the full problem",
+                        type=float, default=1/9)
+    parser.add_argument("-fidelity", help="Reduce the problem size (n3) or the number of time steps at low fidelity",
+                        choices=["grid", "steps"], default="grid")
+    parser.add_argument("-walk", help="Maximum length of the random walks sampling configurations for Hyperband",
+                        type=int, default=10)
+    parser.add_argument("-n_init", help="Number of initial configurations for Bayesian Optimization", type=int, default=5)
+    parser.add_argument("-no_history", help="Do not train Bayesian Optimization on previous trials of the same problem size",
+                        action="store_true")
+    parser.add_argument("-replicas", help="Number of replicas for Parallel Tempering", type=int, default=4)
+    parser.add_argument("-pop", help="Population size for the Genetic Algorithm", type=int, default=8)
+    parser.add_argument("-mutation", help="Mutation rate for the Genetic Algorithm", type=float, default=0.3)
+    parser.add_argument("-window", help="Number of recent moves whose success rate adapts the step scale of each VNS neighborhood",
+                        type=int, default=10)
+    parser.add_argument("-max_scale", help="Maximum step scale of the VNS neighborhoods", type=float, default=8)
+    parser.add_argument("-design", help="Configurations measured by a sweep: the full grid, the strided grid or a Latin\
+                        hypercube sample, of at most K configurations", choices=Sweep.designs, default="lhs")
+    parser.add_argument("-strides", help="Strides of the parameters in the strided grid of a sweep", type=int, nargs=7,
+                        default=[1, 1, 1, 2, 8, 8, 1],
+                        metavar=("Olevel","simd","NbTh","n1_thrd_block","n2_thrd_block","n3_thrd_block","affinity"))
+
+
+def create_algorithm(args, n1, n2, n3, S0, evaluator):
+    """
+    Identifies and initializes the algorithm chosen by args.algo
+    """
+    if args.algo == "ghc":
+        return Greedy(n1, n2, n3, S0, args.k, evaluator=evaluator)
+    elif args.algo == "sa":
+        return SimulatedAnnealing(n1, n2, n3, S0, args.k, args.T0, args.decay, evaluator=evaluator)
+    elif args.algo == "tabu_sa":
+        return TabuSA(n1, n2, n3, S0, args.k, args.T0, args.decay, args.tabu, evaluator=evaluator)
+    elif args.algo == "tunnel_sa":
+        return TunnelingSA(n1, n2, n3, S0, args.k, args.T0, args.decay, args.cost, args.Etunnel, evaluator=evaluator)
+    elif args.algo == "lahc":
+        return LAHC(n1, n2, n3, S0, args.k, args.Lh, evaluator=evaluator)
+    elif args.algo == "hyperband":
+        return Hyperband(n1, n2, n3, S0, args.k, args.eta, args.min_fidelity, args.fidelity, args.walk,
+                         evaluator=evaluator)
+    elif args.algo == "bo":
+        return BayesianOptimization(n1, n2, n3, S0, args.k, args.n_init, not args.no_history, evaluator=evaluator)
+    elif args.algo == "pt":
+        return ParallelTempering(n1, n2, n3, S0, args.k, args.T0, args.replicas, evaluator=evaluator)
+    elif args.algo == "ga":
+        return GeneticAlgorithm(n1, n2, n3, S0, args.k, args.pop, args.mutation, evaluator=evaluator)
+    elif args.algo == "vns":
+        return VariableNeighborhoodSearch(n1, n2, n3, S0, args.k, args.window, args.max_scale, evaluator=evaluator)
+    elif args.algo == "sweep":
+        return Sweep(n1, n2, n3, S0, args.k, args.design, args.strides, evaluator=evaluator)
+    else:
+        raise ValueError("Invalid algorithm")
+
 
 if __name__ == "__main__":
     # CLI argument parser
@@ -11,26 +106,128 @@ if __name__ == "__main__":
                     description='Perform throughput optimization, energy evaluation or results visualization of ISO3DFD performance',
                     )
     subparsers = parser.add_subparsers(title="Commands", dest="command")
-    algo_list = ["ghc", "sa", "tabu_sa", "tunnel_sa", "lahc"]
+    algo_list = ["ghc", "sa", "tabu_sa", "tunnel_sa", "lahc", "hyperband", "bo", "pt", "ga", "vns", "sweep"]
     
     # Optimization
     opti_parser = subparsers.add_parser("optimize",
-                    description="Optimize the ISO3DFD parameters (Olevel, SIMD, NbTh, n2_thrd_block, n2_thrd_block, n3_thrd_block)\
-                                 using the chosen algorithm for maximum throughput (MPoints/s)",
+                    description="Optimize the ISO3DFD parameters (Olevel, SIMD, NbTh, n2_thrd_block, n2_thrd_block, n3_thrd_block, affinity)\
+                                 using the chosen algorithm for maximum throughput (MPoints/s) or another objective",
                     formatter_class=argparse.ArgumentDefaultsHelpFormatter
                     )
     opti_parser.add_argument("-algo", choices=algo_list, help="Algorithm to use in optimization", type=str, default="sa")
     opti_parser.add_argument("-n", help="Problem size separated by spaces", type=int, default=[256, 256, 256], 
                         nargs=3, metavar=("n1","n2","n3"))
-    opti_parser.add_argument("-k", help="Maximum number of iterations", type=int, default=200)
-    opti_parser.add_argument("-S0", help="Initial solution", nargs=6, 
-                        metavar=("Olevel","simd","NbTh","n1_thrd_block","n2_thrd_block","n3_thrd_block"))
-    opti_parser.add_argument("-T0", help="Initial temperature for Simulated Annealing", type=float, default=100)
-    opti_parser.add_argument("-decay", help="Decay function for Simulated Annealing", type=str, default="geometric")
-    opti_parser.add_argument("-tabu", help="Tabu list size", type=int, default=5)
-    opti_parser.add_argument("-cost", help="Cost function for Tunneling", type=str, default="stochastic")
-    opti_parser.add_argument("-Etunnel", help="Tunneling energy", type=float, default=0.0)
-    opti_parser.add_argument("-Lh", help="List size for LAHC", type=int, default=10)
+    opti_parser.add_argument("-k", help=K_HELP, type=int, default=200)
+    opti_parser.add_argument("-S0", help="Initial solution", nargs=7, 
+                        metavar=("Olevel","simd","NbTh","n1_thrd_block","n2_thrd_block","n3_thrd_block","affinity"))
+    add_algorithm_arguments(opti_parser)
+    opti_parser.add_argument("-objective", help="Quantity to optimize: throughput, energy, energy-delay product or\
+                             a weighted mix of log-throughput and log-energy. Temperatures (-T0) and tunneling energies\
+                             (-Etunnel) are given in MPoints/s, and scaled to other objectives by the ratio of the score\
+                             of S0 to its throughput", choices=OBJECTIVES, default="throughput")
+    opti_parser.add_argument("-weight", help="Weight of throughput in the weighted objective", type=float, default=0.5)
+    opti_parser.add_argument("-pareto", help="Measure energy and save the Pareto front of throughput and energy",
+                        action="store_true")
+    opti_parser.add_argument("-warm_start", help="Start from the best configurations of the finished trials of the N nearest\
+                             problem sizes with the same objective, scaled to this problem size", type=int, nargs="?", const=5,
+                        metavar="N")
+    opti_parser.add_argument("-prune", help="With -warm_start, exclude the Olevel, simd, NbTh and affinity values whose best\
+                             configuration ranked in this bottom fraction of every prior trial that measured them (0 to disable)",
+                        type=float, default=0.25)
+    opti_parser.add_argument("-seed", help="Seed of the random number generators", type=int)
+    opti_parser.add_argument("-tag", help="Tags of the trial in the results database, to find and compare it with other trials",
+                        type=str, nargs="+", action="extend", default=[])
+    opti_parser.add_argument("-resume", "--resume", help="Resume an interrupted trial from its checkpoint, with its original arguments",
+                        type=int, metavar="ID")
+    opti_parser.add_argument("-slots", help="Number of concurrent evaluation slots, each pinned to its own partition of cores",
+                        type=int, default=1)
+    opti_parser.add_argument("-listen", help="Dispatch evaluations to workers (main.py worker) connecting to this TCP port\
+                             instead of running them locally", type=int, metavar="PORT")
+    opti_parser.add_argument("-heartbeat", help="Heartbeat interval of workers in seconds, a worker silent for 3 intervals\
+                             is considered lost", type=float, default=5.0)
+    opti_parser.add_argument("-calibration", help="Number of runs of the default configuration calibrating each worker node",
+                        type=int, default=3)
+    opti_parser.add_argument("-timeout", help="Kill ISO3DFD runs lasting longer than this number of seconds", type=float)
+    opti_parser.add_argument("-samples", help="Minimum and maximum number of runs per configuration, repeated until the\
+                             confidence interval is within -rel_ci of the mean", type=int, nargs=2, default=[1, 1],
+                        metavar=("MIN", "MAX"))
+    opti_parser.add_argument("-rel_ci", help="Target half-width of the 95%% confidence interval relative to the mean",
+                        type=float, default=0.02)
+    opti_parser.add_argument("-remeasure", help="Number of times a sample disturbed by other activity on the machine (involuntary\
+                             context switches, major page faults or CPU migrations) is discarded and re-measured", type=int,
+                        default=2)
+    opti_parser.add_argument("-max_switches", help="Involuntary context switches per second and per thread above which a sample\
+                             is disturbed", type=float, default=100.0)
+    opti_parser.add_argument("-max_migrations", help="CPU migrations per thread above which a sample is disturbed (with\
+                             -proc_interval)", type=float, default=1.0)
+    opti_parser.add_argument("-proc_interval", help="Sample the CPU migrations of ISO3DFD threads and the load of the machine\
+                             from /proc every PROC_INTERVAL seconds during runs", type=float)
+    opti_parser.add_argument("-race", help="Probe new configurations for this number of time steps and abort those\
+                             that are certain to lose to the best one", type=int)
+    opti_parser.add_argument("-race_margin", help="Relative uncertainty of the throughput extrapolated from a probe",
+                        type=float, default=0.1)
+    opti_parser.add_argument("-prebuild", "--prebuild", help="Compile all (Olevel, simd) variants concurrently before optimizing",
+                        action="store_true")
+    opti_parser.add_argument("-no_cache", help="Disable the persistent measurement cache", action="store_true")
+    opti_parser.add_argument("-cache_age", help="Maximum age of reused measurements in seconds", type=float)
+    opti_parser.add_argument("-cache_size", help="Maximum number of measurements kept in the cache", type=int)
+
+    # Benchmark
+    bench_parser = subparsers.add_parser("benchmark",
+                        description="Compare optimization algorithms on synthetic throughput landscapes",
+                        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                        )
+    bench_parser.add_argument("-algos", choices=algo_list, help="Algorithms to compare", nargs="+",
+                        default=["ghc", "sa", "tabu_sa", "tunnel_sa", "lahc"])
+    bench_parser.add_argument("-landscapes", choices=LANDSCAPES, help="Landscapes to run on", nargs="+",
+                        default=["smooth", "plateau", "cliff", "rugged"])
+    bench_parser.add_argument("-n", help="Problem size separated by spaces", type=int, default=[256, 256, 256],
+                        nargs=3, metavar=("n1","n2","n3"))
+    bench_parser.add_argument("-k", help=K_HELP, type=int, default=200)
+    bench_parser.add_argument("-seeds", help="Number of seeds (landscape instances and algorithm seeds)", type=int, default=10)
+    bench_parser.add_argument("-noise", help="Relative standard deviation of the measurement noise", type=float, default=0.01)
+    bench_parser.add_argument("-target", help="Fraction of the optimum throughput counted as reaching the target",
+                        type=float, default=0.95)
+    bench_parser.add_argument("-o", help="Output file", type=str, default="results/benchmark.json")
+    bench_parser.add_argument("-baseline", help="Report regressions with respect to this earlier output file, exiting\
+                             with status 1 if there are any", type=str)
+    bench_parser.add_argument("-tolerance", help="Relative change of a statistic counted as a regression", type=float,
+                        default=0.25)
+    add_algorithm_arguments(bench_parser)
+
+    # Campaign
+    campaign_parser = subparsers.add_parser("campaign",
+                        description="Run every trial of a matrix of algorithms, hyper-parameters, problem sizes and seeds\
+                                     described by a JSON spec, skipping those already done",
+                        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                        )
+    campaign_parser.add_argument("spec", help="JSON file describing the campaign")
+    campaign_parser.add_argument("-parallel", help="Number of trials run at once, each pinned to its own partition of cores,\
+                             instead of that of the spec", type=int)
+    campaign_parser.add_argument("-status", help="Print the status of every trial of the campaign and exit", action="store_true")
+
+    # Worker
+    worker_parser = subparsers.add_parser("worker",
+                        description="Run the evaluations dispatched by an optimization started with -listen",
+                        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                        )
+    worker_parser.add_argument("host", help="Host of the optimization")
+    worker_parser.add_argument("port", help="Port given to -listen", type=int)
+    worker_parser.add_argument("-slots", help="Number of concurrent evaluation slots, each pinned to its own partition of cores",
+                        type=int, default=1)
+    worker_parser.add_argument("-name", help="Node name used for calibration (default: host name)")
+    worker_parser.add_argument("-retry", help="Delay in seconds between connection attempts", type=float, default=5.0)
+
+    # Tuning service
+    serve_parser = subparsers.add_parser("serve",
+                        description="Run the tuning service: queue the optimize, energy and sweep jobs submitted with the submit\
+                                     command, and run them on the evaluation slots of the node",
+                        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                        )
+    serve_parser.add_argument("-slots", help="Number of jobs run at once, each pinned to its own partition of cores",
+                        type=int, default=1)
+    serve_parser.add_argument("-socket", help="Unix socket the service listens on", default=client.SOCKET_FN)
+    client.add_commands(subparsers)
 
     # Energy
     energy_parser = subparsers.add_parser("energy",
@@ -45,49 +242,210 @@ if __name__ == "__main__":
     energy_parser.add_argument("n1_thrd_block", type=int)
     energy_parser.add_argument("n2_thrd_block", type=int)
     energy_parser.add_argument("n3_thrd_block", type=int)
+    energy_parser.add_argument("-affinity", help="Thread placement (KMP_AFFINITY type)", choices=AFFINITIES, default="balanced")
     
 
     # Results visualization
     results_parser = subparsers.add_parser("results",
                         description="Visualize results of an optimization trial"
                         )
-    results_parser.add_argument("id", help="Trial IDs", type=int, nargs="+")
+    results_parser.add_argument("id", help="Trial IDs (all trials matching the filters if none)", type=int, nargs="*")
+    results_parser.add_argument("-algo", help="Only list trials of this algorithm", type=str, choices=algo_list)
+    results_parser.add_argument("-n", help="Only list trials of this problem size", type=int, nargs=3,
+                        metavar=("n1","n2","n3"))
+    results_parser.add_argument("-min_E", help="Only list trials with a best objective value of at least this value", type=float)
+    results_parser.add_argument("-objective", help="Only list trials optimizing this objective (e.g. energy or weighted(0.5))",
+                        type=str)
+    results_parser.add_argument("-top", help="Only list the TOP best trials", type=int)
+    results_parser.add_argument("-tag", help="Only list trials with this tag (e.g. the name of a campaign)", type=str)
+    results_parser.add_argument("-profile", help="Print the time spent in every phase of the trials", action="store_true")
+    results_parser.add_argument("-trace", help="Export the spans of the trials to Chrome trace files ({id} is replaced by the trial ID)",
+                        type=str, nargs="?", const="results/trace_{id:05d}.json")
+    results_parser.add_argument("-landscape", help="Export the mean objective value of every configuration measured by the\
+                             trials to CSV files ({id} is replaced by the trial ID)", type=str, nargs="?",
+                        const="results/landscape_{id:05d}.csv")
+    results_parser.add_argument("-heatmap", help="Plot the landscape of the trials along two parameters instead of their history",
+                        type=str, nargs=2, metavar=("X", "Y"))
+    results_parser.add_argument("-fix", help="Restrict the heatmap to configurations with these parameter values",
+                        type=str, nargs="+", default=[], metavar="NAME=VALUE")
+    results_parser.add_argument("-reduce", help="Reduction of the objective values of the configurations in a heatmap cell",
+                        choices=["max", "mean"], default="max")
+    results_parser.add_argument("-slice", help="Export the heatmap tables to CSV files ({id} is replaced by the trial ID)",
+                        type=str, nargs="?", const="results/heatmap_{id:05d}.csv")
     results_parser.add_argument("-plot", help="Plot on interactive screen", action="store_true")
     results_parser.add_argument("-save", help="Save plot to file", type=str, nargs="?", const="img.png")
     results_parser.add_argument("-title", help="Plot title")
     results_parser.add_argument("-legend", help="Legend labels separated by spaces", nargs="+")
     
+    # Aggregated analytics of many trials
+    analyze_parser = subparsers.add_parser("analyze",
+                        description="Compare groups of optimization trials: final quality, convergence and parameter sensitivity",
+                        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+                        )
+    analyze_parser.add_argument("-algo", help="Only analyze trials of these algorithms", type=str, choices=algo_list, nargs="+",
+                        metavar="ALGO")
+    analyze_parser.add_argument("-n", help="Only analyze trials of this problem size", type=int, nargs=3,
+                        metavar=("n1","n2","n3"))
+    analyze_parser.add_argument("-objective", help="Only analyze trials optimizing this objective", type=str)
+    analyze_parser.add_argument("-since", help="Only analyze trials created on or after this date (YYYY-MM-DD[THH:MM])", type=str)
+    analyze_parser.add_argument("-until", help="Only analyze trials created before this date (YYYY-MM-DD[THH:MM])", type=str)
+    analyze_parser.add_argument("-status", help="Only analyze trials with this status", type=str, default="done")
+    analyze_parser.add_argument("-tag", help="Only analyze trials with this tag (e.g. the name of a campaign)", type=str)
+    analyze_parser.add_argument("-group", help="Also group trials by these hyper-parameters (e.g. T0 pop_size)", type=str,
+                        nargs="+", default=[])
+    analyze_parser.add_argument("-target", help="Fraction of the reference counted as reaching the target", type=float,
+                        default=0.95)
+    analyze_parser.add_argument("-sensitivity", help="Also rank the configuration parameters by their effect on the objective",
+                        action="store_true")
+    analyze_parser.add_argument("-min_count", help="Minimum number of measurements of a value counted in the sensitivity",
+                        type=int, default=5)
+    analyze_parser.add_argument("-o", help="Save the summary to this file (CSV, or JSON if it ends with .json)", type=str)
+    analyze_parser.add_argument("-curves", help="Convergence curves to plot: of the best value so far or of the mean value",
+                        choices=["best", "mean"], default="best")
+    analyze_parser.add_argument("-plot", help="Plot convergence curves on interactive screen", action="store_true")
+    analyze_parser.add_argument("-save", help="Save convergence plot to file", type=str, nargs="?", const="img.png")
+
+    # Import of trials saved in summary.json and .csv files
+    import_parser = subparsers.add_parser("import",
+                        description="Import trials saved by earlier versions (summary.json and .csv files) in the results database"
+                        )
+    import_parser.add_argument("dir", help="Directory of the summary.json file", nargs="?", default=RESULTS_DIR)
+
     # Parse arguments
     args = parser.parse_args()
     if args.command == "optimize":
+        resuming = args.resume != None
+        if resuming:
+            try:
+                status = get_store().get_trial(args.resume)["status"]
+            except KeyError:
+                opti_parser.error(f"argument -resume: no trial {args.resume:05d}")
+            if status == "done":
+                opti_parser.error(f"argument -resume: trial {args.resume:05d} is already done")
+            if not os.path.exists(os.path.join(CHECKPOINT_DIR, f"{args.resume:05d}.jsonl")):
+                opti_parser.error(f"argument -resume: trial {args.resume:05d} has no checkpoint")
+            checkpoint = Checkpoint(args.resume)
+            get_store().add_tags(args.resume, args.tag)
+            # Options added since the checkpoint was written take their default value
+            args = argparse.Namespace(**{**vars(opti_parser.parse_args([])), **checkpoint.args})
         n1, n2, n3 = args.n
+        try:
+            # Remote workers run configurations on whole nodes
+            topology = slot_topology(args.slots if args.listen == None else 1)
+        except ValueError as e:
+            opti_parser.error(f"argument -slots: {e}")
+        print("Topology:", topology.describe())
+        space = SearchSpace(n1, n2, n3, topology=topology)
         if args.S0 == None:
-            S0 = ["Ofast", "avx512", 32, n1, 4, 4]
+            S0 = space.default()
         else:
-            S0 = args.S0
-            for id in range(3,6):
-                S0[id] = int(S0[id])
-
-        # Identify and initialize chosen algorithm
-        if args.algo == "ghc":
-            algo = Greedy(n1, n2, n3, S0, args.k)
-        elif args.algo == "sa":
-            algo = SimulatedAnnealing(n1, n2, n3, S0, args.k, args.T0, args.decay)
-        elif args.algo == "tabu_sa":
-            algo = TabuSA(n1, n2, n3, S0, args.k, args.T0, args.decay, args.tabu)
-        elif args.algo == "tunnel_sa":
-            algo = TunnelingSA(n1, n2, n3, S0, args.k, args.T0, args.decay, args.cost, args.Etunnel)
-        elif args.algo == "lahc":
-            algo = LAHC(n1, n2, n3, S0, args.k, args.Lh)
+            try:
+                S0 = space.parse(args.S0)
+            except ValueError as e:
+                opti_parser.error(f"argument -S0: {e}")
+
+        objective = Objective(args.objective, args.weight, args.pareto)
+        if args.race != None and objective.needs_energy:
+            opti_parser.error("argument -race: only available with the throughput objective without -pareto")
+
+        warm_start = None
+        if resuming:
+            # Prior trials may have been added since the trial started, so its warm start is reused
+            trial_params = get_store().get_trial(checkpoint.id)["params"]
+            warm_start = trial_params.get("warm_start")
+            if warm_start != None:
+                S0 = trial_params["S0"]
+        if args.warm_start != None and warm_start == None:
+            prior = WarmStart(get_store(), space, objective.describe(), args.warm_start)
+            print("Warm start from trials", ", ".join(prior.describe()))
+            seeds = prior.seeds()
+            if args.S0 == None and len(seeds) > 0:
+                S0 = seeds[0]
+            pruned = prior.pruned(args.prune, S0) if args.prune > 0 else []
+            print("Pruned values:", pruned)
+            warm_start = {"trials": [trial["id"] for trial in prior.trials], "seeds": seeds, "pruned": pruned}
+
+        if not resuming:
+            seed = args.seed if args.seed != None else random.randrange(2**32)
+            checkpoint = new_checkpoint(vars(args), seed)
+            get_store().add_tags(checkpoint.id, args.tag)
+
+        if args.prebuild:
+            build([(Olevel, simd) for Olevel in OLEVELS for simd in SIMDS])
+
+        if args.no_cache:
+            cache = None
         else:
-            raise ValueError("Invalid algorithm")
+            cache = EvalCache(max_age=args.cache_age, max_entries=args.cache_size)
+        coordinator = None
+        if args.listen != None:
+            coordinator = Coordinator(args.listen, n1, n2, n3, heartbeat=args.heartbeat, calibration_runs=args.calibration)
+        interference = Interference(args.remeasure, args.max_switches, args.max_migrations, args.proc_interval)
+        evaluator = Evaluator(n1, n2, n3, args.slots, cache, args.timeout, args.samples[0], args.samples[1], args.rel_ci,
+                              args.race, args.race_margin, checkpoint, objective, coordinator, interference)
+
+        algo = create_algorithm(args, n1, n2, n3, S0, evaluator)
+        if warm_start != None:
+            algo.warm_start(warm_start["seeds"], warm_start["pruned"], warm_start["trials"])
 
         # Run and save optimization trial
         algo.optimize()
         algo.save()
+        evaluator.close()
+
+    elif args.command == "benchmark":
+        # Synthetic landscapes know nothing of previous trials
+        args.no_history = True
+        n1, n2, n3 = args.n
+        def create(name, S0, evaluator):
+            return create_algorithm(argparse.Namespace(**{**vars(args), "algo": name}), n1, n2, n3, S0, evaluator)
+        records = run_benchmark(create, args.algos, args.landscapes, n1, n2, n3, range(args.seeds), args.noise, args.target)
+        summary = summarize(records)
+        for s in summary:
+            print(f"{s['algo']}\t{s['landscape']}\tsuccess {s['success_rate']:.2f}\t"
+                  f"median evaluations to target {s['median_evaluations_to_target']}\t"
+                  f"final best {s['final_best_ratio']['mean']:.4f} +- {s['final_best_ratio']['std']:.4f}\t"
+                  f"overhead {s['overhead_per_evaluation']*1e3:.3f} ms/evaluation")
+        os.makedirs(os.path.dirname(os.path.abspath(args.o)), exist_ok=True)
+        with open(args.o, "w") as f:
+            json.dump({"args": vars(args), "summary": summary, "records": records}, f, indent=4)
+        print("Saved benchmark to", args.o)
+
+        if args.baseline != None:
+            with open(args.baseline, "r") as f:
+                baseline = json.load(f)
+            regressions = compare(summary, baseline["summary"], args.tolerance)
+            for regression in regressions:
+                print("Regression:", regression)
+            if len(regressions) > 0:
+                sys.exit(1)
+
+    elif args.command == "campaign":
+        campaign = Campaign.load(args.spec)
+        if args.status:
+            campaign.print_status()
+            sys.exit(0)
+        try:
+            partitions = cpu_partitions(args.parallel if args.parallel != None else campaign.parallel)
+        except ValueError as e:
+            campaign_parser.error(f"argument -parallel: {e}")
+        n_failed = campaign.run(partitions)
+        campaign.print_status()
+        if n_failed > 0:
+            sys.exit(1)
+
+    elif args.command == "worker":
+        worker(args.host, args.port, args.slots, args.name, args.retry)
+
+    elif args.command == "serve":
+        try:
+            partitions = cpu_partitions(args.slots)
+        except ValueError as e:
+            serve_parser.error(f"argument -slots: {e}")
+        TuningService(args.socket, partitions).serve()
 
     elif args.command == "energy":
-        S = [args.Olevel, args.simd, args.NbTh, args.n1_thrd_block, args.n2_thrd_block, args.n3_thrd_block]
+        S = [args.Olevel, args.simd, args.NbTh, args.n1_thrd_block, args.n2_thrd_block, args.n3_thrd_block, args.affinity]
         dram_energy,pkg_energy,combined = run_energy_final(S, args.n1, args.n2, args.n3)
 
         print("Analysing energy consumption for: ", S, ", and problem size: ", args.n1, "x", args.n2, "x", args.n3)
@@ -98,10 +456,40 @@ if __name__ == "__main__":
 
     elif args.command == "results":
         print(args)
-        for i, id in enumerate(args.id):
+        fixed = {}
+        for assignment in args.fix:
+            name, _, value = assignment.partition("=")
+            if name not in STORE_COLUMNS:
+                results_parser.error(f"argument -fix: {name} not in {STORE_COLUMNS}")
+            fixed[name] = int(value) if value.isdigit() else value
+        if args.heatmap != None and any(name not in STORE_COLUMNS for name in args.heatmap):
+            results_parser.error(f"argument -heatmap: parameters must be in {STORE_COLUMNS}")
+        ids = args.id
+        if len(ids) == 0:
+            trials = get_store().find_trials(args.algo, args.n, args.min_E, limit=args.top,
+                                             objective=args.objective, tag=args.tag)
+            for trial in trials:
+                print(f"{trial['id']:05d}\t{trial['method']}\t{trial['n1']}x{trial['n2']}x{trial['n3']}\t{trial['status']}\t"
+                      f"{trial['E_best']}\t{trial['S_best']}")
+            if args.plot or args.save:
+                ids = [trial["id"] for trial in trials]
+        for i, id in enumerate(ids):
             res = Result(id)
             res.print_summary()
-            if args.plot or args.save:
+            if args.profile:
+                res.print_profile()
+            if args.trace != None:
+                res.export_trace(args.trace.format(id=id))
+            if args.landscape != None:
+                res.export_landscape(args.landscape.format(id=id))
+            if args.heatmap != None and args.slice != None:
+                res.heatmap(*args.heatmap, fixed, args.reduce).to_csv(args.slice.format(id=id))
+                print("Saved heatmap to", args.slice.format(id=id))
+            if (args.plot or args.save) and args.heatmap != None:
+                if i > 0:
+                    plt.figure()
+                res.plot_heatmap(*args.heatmap, fixed, args.reduce, args.title)
+            elif args.plot or args.save:
                 title = args.title
                 if args.legend != None and i < len(args.legend):
                     label = args.legend[i]
@@ -116,5 +504,40 @@ if __name__ == "__main__":
             print("Plotting")
             plt.show()
 
+    elif args.command == "analyze":
+        since = datetime.fromisoformat(args.since).timestamp() if args.since != None else None
+        until = datetime.fromisoformat(args.until).timestamp() if args.until != None else None
+        trials = TrialSet.query(get_store(), args.algo, args.n, args.objective, since, until, args.status, args.group,
+                                args.tag)
+        if len(trials.trials) == 0:
+            print("No trials match the filters")
+            sys.exit(1)
+        summary = trials.summary(args.target)
+        print(summary.to_string(index=False))
+        if args.o != None:
+            export(summary, args.o)
+            print("Saved summary to", args.o)
+        if args.sensitivity:
+            spreads, values = trials.sensitivity(args.min_count)
+            print()
+            print(spreads.to_string(index=False))
+            print()
+            print(values.to_string(index=False))
+            if args.o != None:
+                root, ext = os.path.splitext(args.o)
+                export(spreads, f"{root}_sensitivity{ext}")
+                export(values, f"{root}_values{ext}")
+        if args.plot or args.save:
+            trials.plot(args.curves)
+            if args.save != None:
+                print("Saving to", args.save)
+                plt.savefig(args.save)
+            if args.plot:
+                plt.show()
+
+    elif args.command == "import":
+        ids = get_store().import_legacy(args.dir)
+        print("Imported", len(ids), "trials:", " ".join(f"{id:05d}" for id in ids))
+
     else:
         parser.print_usage()
\ No newline at end of file
@@ -4,4 +4,5 @@ CSV_FILE="$1"
 shift
 BASEDIR=$(dirname $(realpath $0))
 
-mv $CSV_FILE $BASEDIR/current_csv.csv
+# ENERGY_CSV is set by run_energy so that concurrent measurements use their own trace file
+mv $CSV_FILE ${ENERGY_CSV:-$BASEDIR/current_csv.csv}
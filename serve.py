@@ -0,0 +1,257 @@
+import os
+import sys
+import json
+import time
+import runpy
+import signal
+import threading
+import socketserver
+import multiprocessing
+import multiprocessing.forkserver
+from datetime import datetime
+
+from common import RESULTS_DIR, DB_FN
+from store import ResultStore
+
+
+MAIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+SERVE_DIR = os.path.join(RESULTS_DIR, "serve")
+
+
+def run_job(argv, log_fn, cpus, ready):
+	"""
+	Body of the process of a job: runs main.py with the given arguments on the given CPUs, writing its output to log_fn.
+	ready is set once the job can be cancelled
+	"""
+	os.setpgid(0, 0)
+	# Processes of the fork server ignore Ctrl-C, which cancels jobs
+	signal.signal(signal.SIGINT, signal.default_int_handler)
+	ready.set()
+	os.sched_setaffinity(0, cpus)
+	fd = os.open(log_fn, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+	os.dup2(fd, 1)
+	os.dup2(fd, 2)
+	os.close(fd)
+	sys.stdout.reconfigure(line_buffering=True)
+	sys.argv = [MAIN, *argv]
+	runpy.run_path(MAIN, run_name="__main__")
+
+
+class TuningService:
+	"""
+	Long-lived service running the optimize, energy and sweep jobs submitted by the client commands of main.py
+	(see client.py) over a Unix socket, one JSON message per line.
+
+	Jobs are queued, and run in order one on each of the given partitions of the CPUs at a time. Their processes
+	are forked from a server process that has already imported main.py and its dependencies, so that they start
+	without paying for the imports. The output of every job is saved in results/serve and streamed to the clients
+	watching it, and optimize jobs are tagged serve/SESSION/ID, which gives their trial and their progress.
+	Cancelling a running job interrupts it like Ctrl-C, so that it can be resumed from its checkpoint.
+	"""
+	def __init__(self, socket_fn, partitions):
+		self.socket_fn = socket_fn
+		self.partitions = list(partitions)
+		self.session = datetime.now().strftime("%Y%m%d-%H%M%S")
+		self.log_dir = os.path.join(SERVE_DIR, self.session)
+		self.jobs = []
+		self.output = []
+		self.queue = []
+		self.processes = {}
+		self.ready = {}
+		self.lock = threading.Condition()
+		# The fork server imports main.py before getting the path of this process (Python < 3.12)
+		os.environ["PYTHONPATH"] = os.pathsep.join(filter(None, [os.path.dirname(MAIN), os.environ.get("PYTHONPATH")]))
+		self.context = multiprocessing.get_context("forkserver")
+		self.context.set_forkserver_preload(["main"])
+
+	def submit(self, argv):
+		command, *args = argv
+		if command == "sweep":
+			command, args = "optimize", ["-algo", "sweep", *args]
+		with self.lock:
+			id = len(self.jobs) + 1
+			tag = f"serve/{self.session}/{id}"
+			if command == "optimize":
+				args += ["-tag", "serve", tag]
+			self.jobs.append({"id": id, "argv": [command, *args], "tag": tag if command == "optimize" else None,
+				"state": "queued", "submitted": time.time(), "started": None, "finished": None, "returncode": None,
+				"trial": None, "n_evaluations": None, "E_best": None, "log": os.path.join(self.log_dir, f"{id}.log")})
+			self.output.append([])
+			self.queue.append(id)
+			self.lock.notify_all()
+			return self.job(id)
+
+	def job(self, id):
+		if id < 1 or id > len(self.jobs):
+			raise KeyError(f"No job {id}")
+		return dict(self.jobs[id - 1])
+
+	def cancel(self, id):
+		with self.lock:
+			job = self.job(id)
+			if job["state"] == "queued":
+				self.queue.remove(id)
+				self.jobs[id - 1].update(state="cancelled", finished=time.time())
+			elif job["state"] == "running":
+				self.jobs[id - 1]["state"] = "cancelling"
+				# Until then, the job has neither its process group nor its handler of Ctrl-C
+				while not self.ready[id].wait(0.1) and self.processes[id].is_alive():
+					pass
+				try:
+					os.killpg(self.processes[id].pid, signal.SIGINT)
+				except ProcessLookupError:
+					# The job has just ended
+					pass
+			self.lock.notify_all()
+			return self.job(id)
+
+	def watch(self, id):
+		"""
+		Yields the output lines of a job, waiting for new ones until it ends
+		"""
+		i = 0
+		with self.lock:
+			self.job(id)
+			while True:
+				lines = self.output[id - 1][i:]
+				i += len(lines)
+				if len(lines) == 0 and self.jobs[id - 1]["finished"] != None:
+					return
+				if len(lines) == 0:
+					self.lock.wait()
+					continue
+				self.lock.release()
+				try:
+					yield from lines
+				finally:
+					self.lock.acquire()
+
+	def schedule(self):
+		"""
+		Starts the queued jobs on the free partitions
+		"""
+		with self.lock:
+			while True:
+				while len(self.queue) > 0 and len(self.partitions) > 0:
+					id = self.queue.pop(0)
+					cpus = self.partitions.pop(0)
+					job = self.jobs[id - 1]
+					os.makedirs(self.log_dir, exist_ok=True)
+					self.ready[id] = self.context.Event()
+					process = self.context.Process(target=run_job, args=(job["argv"], job["log"], cpus, self.ready[id]))
+					process.start()
+					self.processes[id] = process
+					job.update(state="running", started=time.time())
+					threading.Thread(target=self.monitor, args=(id, cpus), daemon=True).start()
+				self.lock.wait()
+
+	def monitor(self, id, cpus, poll=0.2):
+		"""
+		Follows the output and the progress of a running job until it ends
+		"""
+		job = self.jobs[id - 1]
+		process = self.processes[id]
+		store = ResultStore(DB_FN)
+		with open(job["log"], "a+") as log:
+			log.seek(0)
+			partial = ""
+			last_progress = 0.0
+			while True:
+				running = process.is_alive()
+				data = partial + log.read()
+				lines = data.splitlines(keepends=True)
+				partial = lines.pop() if len(lines) > 0 and not lines[-1].endswith("\n") else ""
+				if not running and partial != "":
+					lines.append(partial)
+				progress = {}
+				if time.time() - last_progress >= 1.0 or not running:
+					progress = self.progress(store, job)
+					last_progress = time.time()
+				with self.lock:
+					self.output[id - 1] += lines
+					job.update(progress)
+					if not running:
+						job.update(state="cancelled" if job["state"] == "cancelling" else "done" if process.exitcode == 0 else "failed",
+							finished=time.time(), returncode=process.exitcode)
+						del self.processes[id]
+						del self.ready[id]
+						self.partitions.append(cpus)
+					self.lock.notify_all()
+				if not running:
+					break
+				time.sleep(poll)
+		store.conn.close()
+
+	@staticmethod
+	def progress(store, job):
+		"""
+		Trial of an optimize job, its number of evaluations so far and its best objective value at full fidelity
+		"""
+		if job["tag"] == None:
+			return {}
+		trials = store.find_trials(tag=job["tag"])
+		if len(trials) == 0:
+			return {}
+		id = max(trial["id"] for trial in trials)
+		_, rows = store.get_columns([id], ["E", "full"])
+		values = [E for _, _, E, full in rows if full == 1 and E != None]
+		return {"trial": id, "n_evaluations": len(rows), "E_best": max(values) if len(values) > 0 else None}
+
+	def handle(self, message, send):
+		if message["type"] == "submit":
+			if len(message["argv"]) == 0 or message["argv"][0] not in ["optimize", "energy", "sweep"]:
+				raise ValueError("Jobs are optimize, energy or sweep commands")
+			send({"type": "job", "job": self.submit(message["argv"])})
+		elif message["type"] == "jobs":
+			with self.lock:
+				ids = message.get("ids") or range(1, len(self.jobs) + 1)
+				send({"type": "jobs", "jobs": [self.job(id) for id in ids]})
+		elif message["type"] == "cancel":
+			send({"type": "job", "job": self.cancel(message["id"])})
+		elif message["type"] == "watch":
+			for line in self.watch(message["id"]):
+				send({"type": "output", "line": line})
+			with self.lock:
+				send({"type": "end", "job": self.job(message["id"])})
+		else:
+			raise ValueError(f"Unknown request {message['type']}")
+
+	def serve(self):
+		service = self
+
+		class Handler(socketserver.StreamRequestHandler):
+			def handle(self):
+				def send(response):
+					self.wfile.write((json.dumps(response) + "\n").encode())
+					self.wfile.flush()
+				try:
+					service.handle(json.loads(self.rfile.readline()), send)
+				except (KeyError, ValueError) as e:
+					send({"type": "error", "message": str(e).strip("'\"")})
+				except (BrokenPipeError, ConnectionResetError):
+					pass
+
+		if os.path.exists(self.socket_fn):
+			os.remove(self.socket_fn)
+		os.makedirs(os.path.dirname(os.path.abspath(self.socket_fn)), exist_ok=True)
+		server = socketserver.ThreadingUnixStreamServer(self.socket_fn, Handler)
+		server.daemon_threads = True
+		# main.py is imported by the fork server once for all jobs
+		multiprocessing.forkserver.ensure_running()
+		threading.Thread(target=self.schedule, daemon=True).start()
+		print(f"Tuning service listening on {self.socket_fn}, running jobs on {len(self.partitions)} partitions of",
+			f"{len(self.partitions[0])} CPUs, logs in {self.log_dir}")
+		try:
+			server.serve_forever()
+		except KeyboardInterrupt:
+			# Running jobs are interrupted as well, and can be resumed from their checkpoints
+			with self.lock:
+				for id in list(self.processes):
+					if self.jobs[id - 1]["state"] == "running":
+						self.cancel(id)
+			for process in list(self.processes.values()):
+				process.join()
+			print("Interrupted")
+		finally:
+			server.server_close()
+			os.remove(self.socket_fn)
@@ -0,0 +1,336 @@
+import math
+import numpy as np
+
+from topology import Topology
+
+
+# Parameter domains
+OLEVELS = ["O3", "Ofast"]
+SIMDS = ["sse", "avx", "avx2", "avx512"]
+N1_BLOCK_STEP = 16
+
+
+class Parameter:
+	"""
+	Tuning parameter with a finite domain of values, each encoded by its index in the domain.
+
+	Ordered parameters move to the previous or next value in a neighborhood, while categorical
+	ones move to any other value.
+	"""
+	categorical = False
+
+	def __init__(self, name, values, log=False):
+		self.name = name
+		self.values = list(values)
+		self.size = len(self.values)
+		self.log = log
+		self.indices = {value: i for i, value in enumerate(self.values)}
+
+	def index(self, value):
+		if value not in self.indices:
+			raise ValueError(f"Invalid {self.name}: {value} not in {self.describe()}")
+		return self.indices[value]
+
+	def parse(self, string):
+		return self.values[self.index(type(self.values[0])(string))]
+
+	def describe(self):
+		return str(self.values)
+
+	def features(self, x):
+		"""
+		Maps encoded values to features in [0, 1], on a log scale for log parameters
+		"""
+		if self.size == 1:
+			return np.zeros((len(x), 1))
+		if self.log:
+			values = np.array(self.values, dtype=float)
+			scaled = np.log(values[x]/values[0])/math.log(values[-1]/values[0])
+		else:
+			scaled = x/(self.size - 1)
+		return scaled[:, None]
+
+	def quantile(self, u):
+		"""
+		Indices of the values at quantiles u in [0, 1) of the domain, on a log scale for log parameters
+		"""
+		if self.log and self.size > 1:
+			values = np.log(np.array(self.values, dtype=float))
+			target = values[0] + u*(values[-1] - values[0])
+			return np.abs(target[:, None] - values[None, :]).argmin(axis=1)
+		return np.minimum((u*self.size).astype(int), self.size - 1)
+
+
+class Categorical(Parameter):
+	"""
+	Unordered parameter, one-hot encoded as features
+	"""
+	categorical = True
+
+	def features(self, x):
+		return np.eye(self.size)[x]
+
+
+class Integer(Parameter):
+	"""
+	Integer parameter taking the values low, low + step, ..., up to high
+	"""
+	def __init__(self, name, low, high, step=1, log=False):
+		super().__init__(name, range(low, high + 1, step), log)
+		self.low = low
+		self.step = step
+
+	def index(self, value):
+		i = (value - self.low)//self.step
+		if not (0 <= i < self.size and self.low + i*self.step == value):
+			raise ValueError(f"Invalid {self.name}: {value} not in {self.describe()}")
+		return i
+
+	def describe(self):
+		return f"[{self.low}, {self.values[-1]}] by steps of {self.step}"
+
+	def nearest(self, values):
+		"""
+		Indices of the nearest values of the domain to an array of arbitrary values
+		"""
+		return np.clip(np.rint((values - self.low)/self.step), 0, self.size - 1).astype(int)
+
+
+class SearchSpace:
+	"""
+	Search space of ISO3DFD configurations [Olevel, simd, NbTh, n1_thrd_block, n2_thrd_block, n3_thrd_block, affinity]
+	for a problem size, on the topology of the CPUs that run them (those of this process by default).
+	Thread counts and thread placements (KMP_AFFINITY types) are built from the topology, so that
+	neighboring thread counts are one topological step apart (e.g. one NUMA node to two).
+
+	Configurations are encoded as integer arrays of domain indices, on which neighbors, random samples
+	and grids are generated with NumPy. Each configuration also has a compact integer key (its index in
+	the mixed-radix numbering of the space) that can be used in sets and dictionaries.
+	Constraints are functions mapping an array of encoded configurations to a mask of feasible ones.
+	"""
+	def __init__(self, n1, n2, n3, constraints=[], topology=None):
+		self.n1 = n1
+		self.n2 = n2
+		self.n3 = n3
+		if topology == None:
+			topology = Topology.detect()
+		self.topology = topology
+		self.params = [
+			Categorical("Olevel", OLEVELS),
+			Categorical("simd", SIMDS),
+			Parameter("NbTh", topology.thread_counts(), log=True),
+			Integer("n1_thrd_block", N1_BLOCK_STEP, N1_BLOCK_STEP*math.ceil(n1/N1_BLOCK_STEP), N1_BLOCK_STEP),
+			Integer("n2_thrd_block", 1, n2, log=True),
+			Integer("n3_thrd_block", 1, n3, log=True),
+			Categorical("affinity", topology.affinities()),
+		]
+		self.names = [p.name for p in self.params]
+		self.sizes = np.array([p.size for p in self.params])
+		self.radix = np.concatenate([np.cumprod(self.sizes[::-1])[-2::-1], [1]])
+		self.constraints = list(constraints)
+		self.rng = np.random.default_rng()
+		# Block parameters and the grid dimensions they divide
+		self.blocks = [(3, n1), (4, n2), (5, n3)]
+		self.aligned = {i: self.aligned_indices(i, n) for i, n in self.blocks}
+
+	def seed(self, seed):
+		self.rng = np.random.default_rng(seed)
+
+	def size(self):
+		return int(np.prod(self.sizes))
+
+	def default(self):
+		"""
+		Default initial solution: Ofast, AVX-512, one thread per core, no blocking along n1, 4x4 blocks
+		and balanced placement
+		"""
+		n1_block = self.params[3].values[min(self.params[3].size - 1, max(0, self.n1//N1_BLOCK_STEP - 1))]
+		return ["Ofast", "avx512", self.topology.n_cores, n1_block, min(4, self.n2), min(4, self.n3), "balanced"]
+
+	def parse(self, strings):
+		"""
+		Converts a configuration given as strings (e.g. on the command line) to typed values,
+		raising ValueError if it is outside of the search space
+		"""
+		if len(strings) != len(self.params):
+			raise ValueError(f"Expected {len(self.params)} values ({', '.join(self.names)})")
+		S = [p.parse(string) for p, string in zip(self.params, strings)]
+		if not self.contains(S):
+			raise ValueError(f"{S} violates the search space constraints")
+		return S
+
+	def encode(self, S):
+		return np.array([p.index(value) for p, value in zip(self.params, S)])
+
+	def encode_batch(self, S_list):
+		return np.array([self.encode(S) for S in S_list]).reshape(len(S_list), len(self.params))
+
+	def decode(self, x):
+		return [p.values[int(i)] for p, i in zip(self.params, x)]
+
+	def decode_batch(self, X):
+		return [self.decode(x) for x in X]
+
+	def key(self, S):
+		return int(self.encode(S) @ self.radix)
+
+	def keys(self, X):
+		return X @ self.radix
+
+	def exclude(self, name, value):
+		"""
+		Removes a value of a parameter from the search space
+		"""
+		i = self.names.index(name)
+		index = self.params[i].index(value)
+		self.constraints.append(lambda X: X[:, i] != index)
+
+	def feasible(self, X):
+		mask = np.ones(len(X), dtype=bool)
+		for constraint in self.constraints:
+			mask &= constraint(X)
+		return mask
+
+	def contains(self, S):
+		try:
+			x = self.encode(S)
+		except ValueError:
+			return False
+		return bool(self.feasible(x[None, :])[0])
+
+	def neighbors_encoded(self, x):
+		"""
+		Changes one parameter at a time: to any other value for categorical parameters, and to the
+		previous or next value for ordered ones
+		"""
+		dims = []
+		values = []
+		for i, p in enumerate(self.params):
+			if p.categorical:
+				v = np.delete(np.arange(p.size), x[i])
+			else:
+				v = x[i] + np.array([-1, 1])
+				v = v[(v >= 0) & (v < p.size)]
+			dims.append(np.full(len(v), i))
+			values.append(v)
+		dims = np.concatenate(dims)
+		X = np.repeat(x[None, :], len(dims), axis=0)
+		X[np.arange(len(dims)), dims] = np.concatenate(values)
+		return X[self.feasible(X)]
+
+	def neighbors(self, S):
+		return self.decode_batch(self.neighbors_encoded(self.encode(S)))
+
+	def aligned_indices(self, i, n):
+		"""
+		Indices of the values of block parameter i that are aligned with its dimension n: powers of two,
+		divisors of n, and the largest value (no blocking)
+		"""
+		p = self.params[i]
+		return np.array([j for j, value in enumerate(p.values)
+			if value & (value - 1) == 0 or n % value == 0 or j == p.size - 1])
+
+	def moves_encoded(self, x, kind, scale):
+		"""
+		Neighbors of x changing one parameter, in one of the neighborhoods of Variable Neighborhood Search:
+		- step: ordered parameters move by up to scale values, categorical ones to any other value
+		- multiply: blocks are multiplied or divided by 1 + k/2 for k up to scale, rounded to the nearest value
+		- aligned: blocks jump to one of the scale nearest aligned values on either side (see aligned_indices)
+		"""
+		dims = []
+		values = []
+		for i, p in enumerate(self.params):
+			if kind == "step":
+				if p.categorical:
+					v = np.delete(np.arange(p.size), x[i])
+				else:
+					v = x[i] + np.concatenate([-np.arange(1, scale + 1), np.arange(1, scale + 1)])
+			elif i not in self.aligned:
+				continue
+			elif kind == "multiply":
+				factors = 1 + np.arange(1, scale + 1)/2
+				v = p.nearest(p.values[x[i]]*np.concatenate([factors, 1/factors]))
+			elif kind == "aligned":
+				aligned = self.aligned[i]
+				below = aligned[aligned < x[i]][::-1][:scale]
+				above = aligned[aligned > x[i]][:scale]
+				v = np.concatenate([below, above])
+			else:
+				raise ValueError(f"Invalid neighborhood: {kind}")
+			v = np.unique(v[(v >= 0) & (v < p.size) & (v != x[i])])
+			dims.append(np.full(len(v), i))
+			values.append(v)
+		dims = np.concatenate(dims)
+		X = np.repeat(x[None, :], len(dims), axis=0)
+		X[np.arange(len(dims)), dims] = np.concatenate(values).astype(int)
+		return X[self.feasible(X)]
+
+	def combined_moves_encoded(self, x, scale, n):
+		"""
+		n random neighbors of x changing 1 + scale parameters at once (all of them at most), each by a move
+		of the step, multiply or aligned neighborhoods at the given scale
+		"""
+		moves = np.concatenate([self.moves_encoded(x, kind, scale) for kind in ["step", "multiply", "aligned"]])
+		changed = (moves != x).argmax(axis=1)
+		by_dim = [moves[changed == i] for i in range(len(self.params)) if (changed == i).any()]
+		X = np.repeat(x[None, :], n, axis=0)
+		for j in range(n):
+			for d in self.rng.choice(len(by_dim), min(len(by_dim), 1 + scale), replace=False):
+				move = by_dim[d][self.rng.integers(len(by_dim[d]))]
+				i = (move != x).argmax()
+				X[j, i] = move[i]
+		return np.unique(X[self.feasible(X)], axis=0)
+
+	def sample_encoded(self, n):
+		"""
+		Draws n feasible configurations uniformly at random
+		"""
+		X = np.zeros((0, len(self.params)), dtype=int)
+		while len(X) < n:
+			X_new = self.rng.integers(0, self.sizes, size=(2*(n - len(X)), len(self.params)))
+			X = np.concatenate([X, X_new[self.feasible(X_new)]])
+		return X[:n]
+
+	def sample(self, n):
+		return self.decode_batch(self.sample_encoded(n))
+
+	def grid_encoded(self, strides=None):
+		"""
+		All feasible configurations, taking every strides[i]-th value of the i-th parameter if given.
+		The full grid has size() configurations, so large problem sizes call for strides.
+		"""
+		if strides == None:
+			strides = [1]*len(self.params)
+		axes = [np.arange(0, p.size, stride) for p, stride in zip(self.params, strides)]
+		X = np.stack(np.meshgrid(*axes, indexing="ij"), axis=-1).reshape(-1, len(self.params))
+		return X[self.feasible(X)]
+
+	def grid(self, strides=None):
+		return self.decode_batch(self.grid_encoded(strides))
+
+	def grid_sample_encoded(self, strides=None, n=None):
+		"""
+		n distinct feasible configurations of the grid (see grid_encoded) in random order, all of them if n is None.
+		Configurations are drawn by their index in the grid, so that the grid is never built when n is small.
+		"""
+		if strides == None:
+			strides = [1]*len(self.params)
+		axes = [np.arange(0, p.size, stride) for p, stride in zip(self.params, strides)]
+		total = int(np.prod([len(axis) for axis in axes]))
+		indices = self.rng.choice(total, min(n, total) if n != None else total, replace=False)
+		X = np.stack([axis[i] for axis, i in zip(axes, np.unravel_index(indices, [len(axis) for axis in axes]))], axis=1)
+		return X[self.feasible(X)]
+
+	def lhs_encoded(self, n):
+		"""
+		Latin hypercube sample of n feasible configurations: the quantiles of every parameter fall in n distinct
+		strata of [0, 1), so that the values of each parameter are covered evenly (on a log scale for log
+		parameters) whatever the others. Duplicates remain when a domain has fewer than n values.
+		"""
+		X = np.zeros((0, len(self.params)), dtype=int)
+		while len(X) < n:
+			m = n - len(X)
+			U = (self.rng.permuted(np.tile(np.arange(m), (len(self.params), 1)), axis=1).T + self.rng.random((m, len(self.params))))/m
+			X_new = np.stack([p.quantile(U[:, i]) for i, p in enumerate(self.params)], axis=1)
+			X = np.concatenate([X, X_new[self.feasible(X_new)]])
+		return X[:n]
@@ -0,0 +1,347 @@
+import os
+import math
+import json
+import time
+import sqlite3
+
+
+COLUMNS = ["Olevel", "simd", "NbTh", "n1_thrd_block", "n2_thrd_block", "n3_thrd_block", "affinity"]
+
+# Values of the parameters that were fixed before they were tuned, for trials that predate them
+LEGACY_VALUES = {"affinity": "balanced"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS trials (
+	id INTEGER PRIMARY KEY,
+	method TEXT,
+	n1 INTEGER,
+	n2 INTEGER,
+	n3 INTEGER,
+	params TEXT,
+	S_best TEXT,
+	E_best REAL,
+	runtime REAL,
+	status TEXT,
+	cache TEXT,
+	created REAL
+);
+CREATE INDEX IF NOT EXISTS trials_method ON trials (method);
+CREATE INDEX IF NOT EXISTS trials_size ON trials (n1, n2, n3);
+CREATE INDEX IF NOT EXISTS trials_E_best ON trials (E_best);
+
+CREATE TABLE IF NOT EXISTS history (
+	trial_id INTEGER,
+	iter INTEGER,
+	Olevel TEXT,
+	simd TEXT,
+	NbTh INTEGER,
+	n1_thrd_block INTEGER,
+	n2_thrd_block INTEGER,
+	n3_thrd_block INTEGER,
+	affinity TEXT,
+	E REAL,
+	extra TEXT,
+	PRIMARY KEY (trial_id, iter)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS pareto (
+	trial_id INTEGER,
+	Olevel TEXT,
+	simd TEXT,
+	NbTh INTEGER,
+	n1_thrd_block INTEGER,
+	n2_thrd_block INTEGER,
+	n3_thrd_block INTEGER,
+	affinity TEXT,
+	throughput REAL,
+	energy REAL
+);
+CREATE INDEX IF NOT EXISTS pareto_trial ON pareto (trial_id);
+
+CREATE TABLE IF NOT EXISTS spans (
+	trial_id INTEGER,
+	name TEXT,
+	start REAL,
+	duration REAL,
+	pid INTEGER,
+	tid INTEGER,
+	args TEXT
+);
+CREATE INDEX IF NOT EXISTS spans_trial ON spans (trial_id);
+
+CREATE TABLE IF NOT EXISTS tags (
+	trial_id INTEGER,
+	tag TEXT,
+	PRIMARY KEY (trial_id, tag)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tags_tag ON tags (tag);
+"""
+
+# Columns are named in inserts, since those added by migrations come last in older databases
+HISTORY_INSERT = f"INTO history (trial_id, iter, {', '.join(COLUMNS)}, E, extra) VALUES ({', '.join('?'*(len(COLUMNS) + 4))})"
+PARETO_INSERT = f"INTO pareto (trial_id, {', '.join(COLUMNS)}, throughput, energy) VALUES ({', '.join('?'*(len(COLUMNS) + 3))})"
+
+
+def to_json(value):
+	"""
+	Serializes a value to JSON, converting NumPy scalars to Python ones
+	"""
+	return json.dumps(value, default=lambda x: x.item())
+
+
+def clean(extra):
+	"""
+	Drops missing values (None and NaN) and infinities from the extra parameters of a history row,
+	which SQLite cannot read back as JSON
+	"""
+	return {name: value for name, value in extra.items()
+		if value != None and not (isinstance(value, float) and not math.isfinite(value))}
+
+
+class ResultStore:
+	"""
+	SQLite database of optimization trials and their histories.
+
+	Trial IDs are allocated atomically by inserting the trial, so that concurrent optimizations
+	never share an ID, and history rows are appended one by one while a trial is running.
+	Parameters of the history other than the configuration and its objective value (E) are stored as
+	a JSON object in the extra column. Trials of energy-aware optimizations also save the Pareto
+	front of their configurations in throughput and energy. The timed spans of the phases of a trial
+	are appended as it runs, like its history.
+	"""
+	def __init__(self, fn):
+		self.fn = fn
+		os.makedirs(os.path.dirname(fn), exist_ok=True)
+		self.conn = sqlite3.connect(fn, timeout=60)
+		self.conn.execute("PRAGMA journal_mode=WAL")
+		self.conn.executescript(SCHEMA)
+		self.migrate()
+
+	def migrate(self):
+		"""
+		Adds the columns of parameters tuned since the database was created, with their former fixed value
+		"""
+		with self.conn:
+			for table in ["history", "pareto"]:
+				names = [row[1] for row in self.conn.execute(f"PRAGMA table_info({table})")]
+				for name, value in LEGACY_VALUES.items():
+					if name not in names:
+						self.conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} TEXT DEFAULT '{value}'")
+
+	def create_trial(self, params, status="running", id=None):
+		with self.conn:
+			cursor = self.conn.execute(
+				"INSERT INTO trials (id, method, n1, n2, n3, params, status, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+				(id, params.get("method"), params.get("n1"), params.get("n2"), params.get("n3"), to_json(params), status, time.time()))
+		return cursor.lastrowid
+
+	def update_trial(self, id, params=None, S_best=None, E_best=None, runtime=None, status=None, cache=None):
+		"""
+		Updates the given fields of a trial
+		"""
+		fields = {}
+		if params != None:
+			fields.update(method=params.get("method"), n1=params.get("n1"), n2=params.get("n2"), n3=params.get("n3"),
+				params=to_json(params))
+		if S_best != None:
+			fields["S_best"] = to_json(S_best)
+		if E_best != None:
+			fields["E_best"] = E_best
+		if runtime != None:
+			fields["runtime"] = runtime
+		if status != None:
+			fields["status"] = status
+		if cache != None:
+			fields["cache"] = to_json(cache)
+		if len(fields) == 0:
+			return
+		with self.conn:
+			self.conn.execute(f"UPDATE trials SET {', '.join(name + ' = ?' for name in fields)} WHERE id = ?",
+				(*fields.values(), id))
+
+	def append_rows(self, id, rows):
+		"""
+		Appends (iter, S, E, extra) rows to the history of a trial, replacing existing rows with the same iter
+		"""
+		with self.conn:
+			self.conn.executemany("INSERT OR REPLACE " + HISTORY_INSERT,
+				[(id, i, *S, E, to_json(clean(extra))) for i, S, E, extra in rows])
+
+	def replace_history(self, id, rows):
+		with self.conn:
+			self.conn.execute("DELETE FROM history WHERE trial_id = ?", (id,))
+			self.conn.executemany("INSERT " + HISTORY_INSERT,
+				[(id, i, *S, E, to_json(clean(extra))) for i, S, E, extra in rows])
+
+	def replace_front(self, id, front):
+		"""
+		Replaces the Pareto front of a trial with a list of (S, throughput, energy) tuples
+		"""
+		with self.conn:
+			self.conn.execute("DELETE FROM pareto WHERE trial_id = ?", (id,))
+			self.conn.executemany("INSERT " + PARETO_INSERT,
+				[(id, *S, throughput, energy) for S, throughput, energy in front])
+
+	def get_front(self, id):
+		rows = self.conn.execute(
+			f"SELECT {', '.join(COLUMNS)}, throughput, energy FROM pareto WHERE trial_id = ? ORDER BY throughput", (id,)).fetchall()
+		n = len(COLUMNS)
+		return [(list(row[:n]), row[n], row[n + 1]) for row in rows]
+
+	def append_spans(self, id, spans):
+		"""
+		Appends spans recorded by a Tracer to a trial
+		"""
+		with self.conn:
+			self.conn.executemany("INSERT INTO spans VALUES (?, ?, ?, ?, ?, ?, ?)",
+				[(id, span["name"], span["start"], span["duration"], span["pid"], span["tid"], to_json(span["args"]))
+					for span in spans])
+
+	def get_spans(self, id):
+		rows = self.conn.execute("SELECT name, start, duration, pid, tid, args FROM spans WHERE trial_id = ? ORDER BY start",
+			(id,)).fetchall()
+		return [{"name": name, "start": start, "duration": duration, "pid": pid, "tid": tid, "args": json.loads(args)}
+			for name, start, duration, pid, tid, args in rows]
+
+	def add_tags(self, id, tags):
+		"""
+		Tags a trial, e.g. with the campaign it belongs to, so that it can be found along with the other trials of the tag
+		"""
+		with self.conn:
+			self.conn.executemany("INSERT OR IGNORE INTO tags VALUES (?, ?)", [(id, tag) for tag in tags])
+
+	def get_tags(self, id):
+		return [tag for tag, in self.conn.execute("SELECT tag FROM tags WHERE trial_id = ? ORDER BY tag", (id,))]
+
+	def trial_from_row(self, row):
+		names = ["id", "method", "n1", "n2", "n3", "params", "S_best", "E_best", "runtime", "status", "cache", "created"]
+		trial = dict(zip(names, row))
+		for name in ["params", "S_best", "cache"]:
+			if trial[name] != None:
+				trial[name] = json.loads(trial[name])
+		return trial
+
+	def get_trial(self, id):
+		row = self.conn.execute("SELECT * FROM trials WHERE id = ?", (id,)).fetchone()
+		if row == None:
+			raise KeyError(f"No trial {id} in {self.fn}")
+		return self.trial_from_row(row)
+
+	def get_history(self, id):
+		"""
+		Returns the column names and rows of the history of a trial, with the extra parameters as columns
+		"""
+		rows = self.conn.execute(
+			f"SELECT iter, {', '.join(COLUMNS)}, E, extra FROM history WHERE trial_id = ? ORDER BY iter", (id,)).fetchall()
+		extras = [json.loads(row[-1]) for row in rows]
+		names = []
+		for extra in extras:
+			names += [name for name in extra if name not in names]
+		return ["iter", *COLUMNS, "E", *names], [(*row[:-1], *[extra.get(name) for name in names]) for row, extra in zip(rows, extras)]
+
+	def get_columns(self, ids, names):
+		"""
+		Returns the given columns of the histories of several trials, preceded by trial_id and iter, as column
+		names and rows ordered by trial and iteration. Names can be configuration columns, E, extra parameters,
+		or full, which tells whether a row was measured at full fidelity and not aborted.
+		"""
+		expressions = []
+		for name in names:
+			if name in COLUMNS or name == "E":
+				expressions.append(name)
+			elif name == "full":
+				expressions.append("COALESCE(json_extract(extra, '$.fidelity'), 1) >= 1 AND COALESCE(json_extract(extra, '$.aborted'), 0) = 0")
+			else:
+				expressions.append(f"json_extract(extra, '$.{name}')")
+		rows = []
+		ids = sorted(int(id) for id in ids)
+		# Bounded number of query parameters
+		for i in range(0, len(ids), 500):
+			chunk = ids[i:i + 500]
+			rows += self.conn.execute(f"""
+				SELECT trial_id, iter, {', '.join(expressions)} FROM history
+				WHERE trial_id IN ({', '.join('?'*len(chunk))}) ORDER BY trial_id, iter""", chunk).fetchall()
+		return ["trial_id", "iter", *names], rows
+
+	def find_trials(self, method=None, n=None, min_E=None, status=None, limit=None, objective=None, since=None, until=None,
+			tag=None):
+		"""
+		Trials matching the given algorithm, problem size, minimum best objective value, status, objective,
+		creation time range (timestamps) and tag, best first
+		"""
+		conditions = []
+		values = []
+		if method != None:
+			conditions.append("method = ?")
+			values.append(method)
+		if n != None:
+			conditions.append("n1 = ? AND n2 = ? AND n3 = ?")
+			values += list(n)
+		if min_E != None:
+			conditions.append("E_best >= ?")
+			values.append(min_E)
+		if status != None:
+			conditions.append("status = ?")
+			values.append(status)
+		if objective != None:
+			conditions.append("COALESCE(json_extract(params, '$.objective'), 'throughput') = ?")
+			values.append(objective)
+		if since != None:
+			conditions.append("created >= ?")
+			values.append(since)
+		if until != None:
+			conditions.append("created < ?")
+			values.append(until)
+		if tag != None:
+			conditions.append("id IN (SELECT trial_id FROM tags WHERE tag = ?)")
+			values.append(tag)
+		query = "SELECT * FROM trials"
+		if len(conditions) > 0:
+			query += " WHERE " + " AND ".join(conditions)
+		query += " ORDER BY E_best DESC"
+		if limit != None:
+			query += f" LIMIT {int(limit)}"
+		return [self.trial_from_row(row) for row in self.conn.execute(query, values)]
+
+	def config_means(self, n1, n2, n3, objective="throughput", trials=None):
+		"""
+		Mean objective value of every configuration measured at full fidelity by the trials of a problem size
+		optimizing the given objective (throughput for trials that predate objectives), or only by the given trials
+		"""
+		restrict = f"AND t.id IN ({', '.join(str(int(id)) for id in trials)})" if trials != None else ""
+		rows = self.conn.execute(f"""
+			SELECT {', '.join('h.' + name for name in COLUMNS)}, AVG(h.E) FROM history h JOIN trials t ON h.trial_id = t.id
+			WHERE t.n1 = ? AND t.n2 = ? AND t.n3 = ?
+				AND COALESCE(json_extract(t.params, '$.objective'), 'throughput') = ? {restrict}
+				AND COALESCE(json_extract(h.extra, '$.aborted'), 0) = 0
+				AND COALESCE(json_extract(h.extra, '$.fidelity'), 1) >= 1
+			GROUP BY {', '.join('h.' + name for name in COLUMNS)}""", (n1, n2, n3, objective)).fetchall()
+		n = len(COLUMNS)
+		return [(list(row[:n]), row[n]) for row in rows]
+
+	def import_legacy(self, results_dir):
+		"""
+		Imports the trials saved in summary.json and NNNNN.csv files, keeping their IDs.
+		Trials whose ID is already in the database are skipped. Returns the imported IDs.
+		"""
+		import pandas as pd
+
+		with open(os.path.join(results_dir, "summary.json"), "r") as f:
+			summary = json.load(f)
+		imported = []
+		for id_str, trial in summary.items():
+			id = int(id_str)
+			if self.conn.execute("SELECT 1 FROM trials WHERE id = ?", (id,)).fetchone() != None:
+				print(f"Skipping trial {id:05d}, already in the database")
+				continue
+			data = pd.read_csv(os.path.join(results_dir, f"{id:05d}.csv"), index_col=0)
+			extra_names = [name for name in data.columns if name not in COLUMNS and name != "E"]
+			rows = []
+			for i, row in zip(data.index, data.to_dict("records")):
+				extra = {name: row[name] for name in extra_names if row[name] == row[name]}
+				rows.append((int(i), [row.get(name, LEGACY_VALUES.get(name)) for name in COLUMNS], row["E"], extra))
+			self.create_trial(trial["params"], trial.get("status", "done"), id)
+			self.update_trial(id, S_best=trial["S_best"], E_best=trial["E_best"], runtime=trial["runtime"], cache=trial.get("cache"))
+			self.replace_history(id, rows)
+			imported.append(id)
+		return imported
@@ -0,0 +1,123 @@
+import os
+import glob
+import subprocess
+
+
+# KMP_AFFINITY types, which place threads on cores either packed (compact), spread over sockets
+# (scatter), or spread over cores with consecutive threads on the same core (balanced)
+AFFINITIES = ["balanced", "compact", "scatter"]
+
+
+def parse_cpulist(cpulist):
+	"""
+	Parses a Linux cpulist such as "0-15,32-47"
+	"""
+	cpus = []
+	for part in cpulist.strip().split(","):
+		if "-" in part:
+			first, last = part.split("-")
+			cpus += list(range(int(first), int(last) + 1))
+		elif part != "":
+			cpus.append(int(part))
+	return cpus
+
+
+class Topology:
+	"""
+	Layout of the logical CPUs available to ISO3DFD runs, as (cpu, core, socket, node) tuples where
+	core is a physical core shared by SMT siblings, socket a physical package and node a NUMA node.
+
+	It is read from /sys, or from lscpu when /sys does not expose it, and is used to build the thread
+	counts and thread placements of the search space.
+	"""
+	def __init__(self, cpus):
+		self.cpus = sorted(cpus)
+		self.n_cpus = len(self.cpus)
+		self.n_cores = len({(socket, core) for _, core, socket, _ in self.cpus})
+		self.n_sockets = len({socket for _, _, socket, _ in self.cpus})
+		self.n_nodes = len({node for _, _, _, node in self.cpus})
+		self.threads_per_core = max(1, self.n_cpus//self.n_cores)
+		self.cores_per_node = max(1, self.n_cores//self.n_nodes)
+
+	@staticmethod
+	def detect(available=None):
+		"""
+		Topology of the given CPUs, those this process may run on by default
+		"""
+		if available == None:
+			available = os.sched_getaffinity(0)
+		available = set(available)
+		cpus = read_sys(available)
+		if cpus == None:
+			cpus = read_lscpu(available)
+		if cpus == None:
+			# Unknown topology: one core per CPU on a single socket
+			cpus = [(cpu, cpu, 0, 0) for cpu in available]
+		return Topology(cpus)
+
+	@staticmethod
+	def uniform(n_sockets, cores_per_socket, threads_per_core=1):
+		"""
+		Machine with identical sockets, one NUMA node each, and CPUs numbered by SMT thread first, like Linux does
+		"""
+		n_cores = n_sockets*cores_per_socket
+		return Topology([(thread*n_cores + core, core, core//cores_per_socket, core//cores_per_socket)
+			for thread in range(threads_per_core) for core in range(n_cores)])
+
+	def thread_counts(self):
+		"""
+		Thread counts worth trying: a quarter and half of a NUMA node, whole NUMA nodes, and all cores with
+		1 to threads_per_core threads per core. Consecutive counts are one topological step apart.
+		"""
+		counts = {self.cores_per_node//4, self.cores_per_node//2}
+		counts.update(self.cores_per_node*nodes for nodes in range(1, self.n_nodes + 1))
+		counts.update(self.n_cores*threads for threads in range(1, self.threads_per_core + 1))
+		return sorted(count for count in counts if count > 0)
+
+	def affinities(self):
+		"""
+		Thread placements that differ on this topology: with a single socket and no SMT, all of them
+		place one thread per core
+		"""
+		if self.n_sockets == 1 and self.threads_per_core == 1:
+			return ["balanced"]
+		return AFFINITIES
+
+	def describe(self):
+		return (f"{self.n_cpus} CPUs, {self.n_cores} cores, {self.n_sockets} sockets, {self.n_nodes} NUMA nodes, "
+			f"{self.threads_per_core} threads per core")
+
+
+def read_sys(available):
+	cpus = []
+	nodes = {}
+	for fn in glob.glob("/sys/devices/system/node/node[0-9]*/cpulist"):
+		node = int(os.path.basename(os.path.dirname(fn))[4:])
+		with open(fn, "r") as f:
+			for cpu in parse_cpulist(f.read()):
+				nodes[cpu] = node
+	try:
+		for cpu in available:
+			path = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+			with open(f"{path}/core_id", "r") as f:
+				core = int(f.read())
+			with open(f"{path}/physical_package_id", "r") as f:
+				socket = int(f.read())
+			cpus.append((cpu, core, socket, nodes.get(cpu, socket)))
+	except (OSError, ValueError):
+		return None
+	return cpus
+
+def read_lscpu(available):
+	try:
+		output = subprocess.run(["lscpu", "-p=CPU,CORE,SOCKET,NODE"], capture_output=True, text=True, check=True).stdout
+	except (OSError, subprocess.CalledProcessError):
+		return None
+	cpus = []
+	for line in output.splitlines():
+		if line.startswith("#"):
+			continue
+		cpu, core, socket, node = [int(field) if field != "" else 0 for field in line.split(",")]
+		if cpu in available:
+			cpus.append((cpu, core, socket, node))
+	return cpus if len(cpus) > 0 else None
@@ -0,0 +1,111 @@
+import math
+import numpy as np
+
+from store import COLUMNS, LEGACY_VALUES
+
+
+# Parameters whose values mean the same at every problem size, which can be pruned
+PRUNABLE = ["Olevel", "simd", "NbTh", "affinity"]
+
+
+class WarmStart:
+	"""
+	Knowledge drawn from the finished trials of the nearest problem sizes that optimized the same objective,
+	to start a new optimization from their best configurations and skip the values they found poor.
+
+	Problem sizes are compared by the sum of the absolute log-ratios of their dimensions, and the n_trials
+	nearest trials are used, the same size included.
+	"""
+	def __init__(self, store, space, objective="throughput", n_trials=5):
+		self.store = store
+		self.space = space
+		size = (space.n1, space.n2, space.n3)
+		trials = store.find_trials(status="done", objective=objective)
+		trials = [trial for trial in trials if trial["S_best"] != None]
+		trials.sort(key=lambda trial: distance(size, (trial["n1"], trial["n2"], trial["n3"])))
+		self.trials = trials[:n_trials]
+		self.histories = {}
+		for trial in self.trials:
+			names, rows = store.get_history(trial["id"])
+			rows = [dict(zip(names, row)) for row in rows]
+			self.histories[trial["id"]] = [row for row in rows if usable(row)]
+
+	def scale(self, S, n1, n2, n3):
+		"""
+		Adapts a configuration tuned for a problem size of n1 x n2 x n3 to the search space.
+		The block along n1 keeps its fraction of n1, while blocks along n2 and n3, which are sized for the cache
+		rather than for the grid, keep their size up to n2 and n3. NbTh is rounded to the nearest thread count
+		of the topology on a log scale, and placements that the topology does not tune fall back to balanced.
+		"""
+		S = list(S) + [LEGACY_VALUES[name] for name in COLUMNS[len(S):]]
+		Olevel, simd, NbTh, n1_block, n2_block, n3_block, affinity = S
+		step = self.space.params[3].step
+		n1_block = int(round(n1_block/n1*self.space.n1/step))*step
+		n1_block = min(max(n1_block, step), self.space.params[3].values[-1])
+		NbTh = min(self.space.params[2].values, key=lambda count: abs(math.log(count/NbTh)))
+		if affinity not in self.space.params[6].values:
+			affinity = "balanced"
+		return [Olevel, simd, NbTh, n1_block, min(n2_block, self.space.n2), min(n3_block, self.space.n3), affinity]
+
+	def seeds(self, per_trial=3):
+		"""
+		Best configuration of every trial, nearest first, then their next best ones, up to per_trial
+		distinct configurations per trial, scaled to the search space
+		"""
+		ranked = []
+		for trial in self.trials:
+			rows = sorted(self.histories[trial["id"]], key=lambda row: -row["E"])
+			configs = [trial["S_best"]] + [[row[name] for name in COLUMNS] for row in rows]
+			ranked.append([self.scale(S, trial["n1"], trial["n2"], trial["n3"]) for S in configs])
+
+		seeds = {}
+		for rank in range(per_trial):
+			for configs in ranked:
+				distinct = [S for S in dict.fromkeys(map(tuple, configs)) if self.space.contains(list(S))]
+				if rank < len(distinct):
+					seeds.setdefault(distinct[rank], None)
+		return [list(S) for S in seeds]
+
+	def pruned(self, threshold, keep=None, min_trials=2, min_rows=10):
+		"""
+		(name, value) pairs of the parameters whose best configuration ranked in the bottom threshold fraction of
+		every trial that measured them, in at least min_trials trials of at least min_rows measurements.
+		Values of keep, and the best value of each parameter, are never pruned.
+		"""
+		ranks = {}
+		for rows in self.histories.values():
+			if len(rows) < min_rows:
+				continue
+			E = np.array([row["E"] for row in rows])
+			# Rank of each measurement from 0 (worst) to 1 (best), whatever the sign of the objective
+			rank = np.argsort(np.argsort(E))/(len(E) - 1)
+			for name in PRUNABLE:
+				best = {}
+				for row, r in zip(rows, rank):
+					value = row[name] if row[name] != None else LEGACY_VALUES.get(name)
+					best[value] = max(best.get(value, 0.0), r)
+				for value, r in best.items():
+					ranks.setdefault((name, value), []).append(r)
+
+		pruned = []
+		for i, p in enumerate(self.space.params):
+			if p.name not in PRUNABLE:
+				continue
+			poor = [value for value in p.values if len(ranks.get((p.name, value), [])) >= min_trials
+				and max(ranks[(p.name, value)]) < threshold and (keep == None or value != keep[i])]
+			if len(poor) < p.size:
+				pruned += [(p.name, value) for value in poor]
+		return pruned
+
+	def describe(self):
+		return [f"{trial['id']:05d} ({trial['n1']}x{trial['n2']}x{trial['n3']})" for trial in self.trials]
+
+
+def distance(size_a, size_b):
+	return sum(abs(math.log(a/b)) for a, b in zip(size_a, size_b))
+
+def usable(row):
+	"""
+	Whether a history row is a full measurement with a finite objective value
+	"""
+	return row["E"] != None and math.isfinite(row["E"]) and not row.get("aborted") and (row.get("fidelity") or 1) >= 1